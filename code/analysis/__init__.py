@@ -0,0 +1,7 @@
+"""Analysis pipeline: raw runs -> per-run table -> grouped aggregates -> figures.
+
+    ingest     per-run rows from orchestrator results (runs.jsonl + sample logs)
+               or from the hand-built spreadsheets in data/, with a parse cache
+    aggregate  mean, confidence interval and percentiles per group
+    figures    every PNG under figures/, drawn from the aggregates in one pass
+"""
@@ -0,0 +1,101 @@
+"""Grouped aggregates over the per-run table."""
+import os
+
+import numpy as np
+import pandas as pd
+
+METRICS = ("duration_s", "throughput_kbs", "wire_kbs", "rtt_avg_ms", "connect_ms")
+# Two-sided Student t critical values at 95 % for 1..30 degrees of freedom
+_T95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+
+
+def t_critical(dof):
+    if dof < 1:
+        return np.nan
+    return _T95[dof - 1] if dof <= len(_T95) else 1.96
+
+
+def confidence_halfwidth(values):
+    """Half width of the 95 % confidence interval of the mean."""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if values.size < 2:
+        return np.nan
+    return t_critical(values.size - 1) * values.std(ddof=1) / np.sqrt(values.size)
+
+
+def summarize(df, by, metrics=METRICS):
+    """One row per group: n, mean, std, 95 % CI bounds, p50 and p95 of every metric."""
+    by = list(by)
+    frames = []
+    grouped = df.groupby(by, dropna=False)
+    for metric in metrics:
+        column = grouped[metric]
+        stats = pd.DataFrame({
+            f"{metric}_n": column.count(),
+            f"{metric}_mean": column.mean(),
+            f"{metric}_std": column.std(),
+            f"{metric}_ci": column.agg(confidence_halfwidth),
+            f"{metric}_p50": column.quantile(0.50),
+            f"{metric}_p95": column.quantile(0.95),
+        })
+        stats[f"{metric}_ci_low"] = stats[f"{metric}_mean"] - stats[f"{metric}_ci"]
+        stats[f"{metric}_ci_high"] = stats[f"{metric}_mean"] + stats[f"{metric}_ci"]
+        frames.append(stats)
+    return pd.concat(frames, axis=1).reset_index()
+
+
+# Tables written next to the figures: (file name, scenario filter, group columns, compared variant).
+# A compared variant (column, baseline value) adds the speedup over the baseline; the table is only
+# written when the rows hold more than one value of that column.
+SINGLE_STREAM = {"stripes": 1, "compression": "none"}
+TABLES = (
+    ("s1_random_summary.xlsx", {"scenario": "s1"}, ("distance",), None),
+    ("s2_file_summary.xlsx", {"scenario": "s2", **SINGLE_STREAM}, ("file_type", "distance"), None),
+    ("s2_striping_summary.xlsx", {"scenario": "s2", "compression": "none"}, ("stripes", "distance"),
+     ("stripes", 1)),
+    ("s2_compression_summary.xlsx", {"scenario": "s2", "stripes": 1}, ("compression", "file_type", "distance"),
+     ("compression", "none")),
+    ("s3_ble_summary.xlsx", {"scenario": "s3"}, ("size_kb", "mode", "distance"), None),
+    ("s4_interference_summary.xlsx", {"scenario": "s4"}, ("interference", "distance"), None),
+)
+
+
+def speedup(summary, metric="throughput_kbs", by=("distance",), series="stripes", baseline=1):
+    """`summary` with a `<metric>_speedup` column: mean over the mean of the `series` == `baseline` row."""
+    by = list(by)
+    base = summary[summary[series] == baseline].set_index(by)[f"{metric}_mean"].rename("_base")
+    summary = summary.join(base, on=by)
+    summary[f"{metric}_speedup"] = summary[f"{metric}_mean"] / summary.pop("_base")
+    return summary
+
+
+def select(df, **filters):
+    mask = np.ones(len(df), dtype=bool)
+    for column, value in filters.items():
+        mask &= (df[column] == value).to_numpy()
+    return df[mask]
+
+
+def write_tables(df, out_dir):
+    """Per-scenario workbook: raw per-run rows and the grouped summary."""
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for name, filters, by, compared in TABLES:
+        rows = select(df, **filters)
+        if rows.empty:
+            continue
+        path = os.path.join(out_dir, name)
+        summary = summarize(rows, by)
+        if compared:
+            series, baseline = compared
+            if rows[series].nunique() < 2:
+                continue
+            summary = speedup(summary, by=[c for c in by if c != series], series=series, baseline=baseline)
+        with pd.ExcelWriter(path) as writer:
+            rows.to_excel(writer, sheet_name="runs", index=False)
+            summary.to_excel(writer, sheet_name="summary", index=False)
+        written.append(path)
+    return written
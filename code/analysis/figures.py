@@ -0,0 +1,263 @@
+"""Every figure under figures/, drawn from the per-run table in one pass.
+
+FIGURES maps each output path (relative to the figures directory) to a
+function(df, ax) that returns False when the table holds no data for it.
+Error bars are 95 % confidence intervals of the mean (aggregate.summarize).
+"""
+import os
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+from analysis.aggregate import SINGLE_STREAM, confidence_halfwidth, select, speedup, summarize
+
+LABELS = {
+    "duration_s": "Transfer duration (s)",
+    "throughput_kbs": "Throughput (KB/s)",
+    "wire_kbs": "Wire throughput (KB/s)",
+    "rtt_avg_ms": "Average RTT (ms)",
+    "connect_ms": "Connection setup (ms)",
+}
+FILE_TYPES = ("TXT", "JPG", "MP3", "MP4")
+
+
+def _errorbar_lines(ax, summary, x, metric, series=None, label_fmt="{}"):
+    groups = [(None, summary)] if series is None else summary.groupby(series)
+    for key, group in groups:
+        group = group.sort_values(x)
+        ax.errorbar(group[x], group[f"{metric}_mean"], yerr=group[f"{metric}_ci"].fillna(0),
+                    marker="o", capsize=3, label=None if key is None else label_fmt.format(key))
+    ax.set_xlabel("Distance (m)" if x == "distance" else x)
+    ax.set_ylabel(LABELS[metric])
+    ax.grid(True, alpha=0.3)
+    if series is not None:
+        ax.legend()
+
+
+def _bars(ax, summary, x, metric, labels=None):
+    positions = np.arange(len(summary))
+    ax.bar(positions, summary[f"{metric}_mean"], yerr=summary[f"{metric}_ci"].fillna(0), capsize=4)
+    ax.set_xticks(positions)
+    ax.set_xticklabels(labels if labels is not None else summary[x].astype(str))
+    ax.set_ylabel(LABELS[metric])
+    ax.grid(True, axis="y", alpha=0.3)
+
+
+def _grouped_bars(ax, summary, x, metric, series, series_labels):
+    xs = sorted(summary[x].dropna().unique())
+    keys = list(series_labels)
+    width = 0.8 / len(keys)
+    for i, key in enumerate(keys):
+        group = summary[summary[series] == key].set_index(x).reindex(xs)
+        ax.bar(np.arange(len(xs)) + (i - (len(keys) - 1) / 2) * width, group[f"{metric}_mean"], width,
+               yerr=group[f"{metric}_ci"].fillna(0), capsize=3, label=series_labels[key])
+    ax.set_xticks(np.arange(len(xs)))
+    ax.set_xticklabels([f"{v:g}" if isinstance(v, (int, float, np.number)) else str(v) for v in xs])
+    ax.set_xlabel("Distance (m)" if x == "distance" else x)
+    ax.set_ylabel(LABELS[metric])
+    ax.grid(True, axis="y", alpha=0.3)
+    ax.legend()
+
+
+def _has(df, metric):
+    return not df.empty and df[metric].notna().any()
+
+
+# --- S1: random payload over distance ---
+
+def _s1_over_distance(metric, title):
+    def draw(df, ax):
+        rows = select(df, scenario="s1")
+        if not _has(rows, metric):
+            return False
+        _errorbar_lines(ax, summarize(rows.dropna(subset=[metric]), ["distance"], [metric]), "distance", metric)
+        ax.set_title(title)
+    return draw
+
+
+# --- S2: file types ---
+
+def _s2_by_file_type(df, ax):
+    rows = select(df, scenario="s2", **SINGLE_STREAM)
+    if not _has(rows, "throughput_kbs"):
+        return False
+    summary = summarize(rows, ["file_type"], ["throughput_kbs"])
+    order = [t for t in FILE_TYPES if t in set(summary["file_type"])] + \
+            sorted(set(summary["file_type"]) - set(FILE_TYPES))
+    _bars(ax, summary.set_index("file_type").loc[order].reset_index(), "file_type", "throughput_kbs")
+    ax.set_title("S2 - Average throughput by file type")
+
+
+def _s2_vs_distance(metric, title):
+    def draw(df, ax):
+        rows = select(df, scenario="s2", **SINGLE_STREAM)
+        if not _has(rows, metric):
+            return False
+        _errorbar_lines(ax, summarize(rows, ["file_type", "distance"], [metric]), "distance", metric,
+                        series="file_type")
+        ax.set_title(title)
+    return draw
+
+
+def _s2_striping(df, ax):
+    rows = select(df, scenario="s2", compression="none")
+    if not _has(rows, "throughput_kbs") or rows["stripes"].nunique() < 2:
+        return False
+    summary = speedup(summarize(rows, ["stripes", "distance"], ["throughput_kbs"]))
+    counts = sorted(summary["stripes"].unique())
+    _grouped_bars(ax, summary, "distance", "throughput_kbs", "stripes",
+                  {n: "single stream" if n == 1 else f"{n} stripes" for n in counts})
+    # Speedup over the single stream on top of each striped bar (same layout as _grouped_bars)
+    xs = sorted(summary["distance"].dropna().unique())
+    width = 0.8 / len(counts)
+    for _, r in summary.dropna(subset=["throughput_kbs_speedup"]).iterrows():
+        if r["stripes"] != 1:
+            x = xs.index(r["distance"]) + (counts.index(r["stripes"]) - (len(counts) - 1) / 2) * width
+            ax.annotate(f"x{r['throughput_kbs_speedup']:.2f}", (x, r["throughput_kbs_mean"]), ha="center",
+                        va="bottom", fontsize=7)
+    ax.set_title("S2 - Striped vs single-stream throughput by distance")
+
+
+def _s2_compression(metric, title):
+    def draw(df, ax):
+        rows = select(df, scenario="s2", stripes=1)
+        if not _has(rows, metric) or rows["compression"].nunique() < 2:
+            return False
+        summary = summarize(rows, ["compression", "file_type"], [metric])
+        codecs = ["none"] + sorted(set(summary["compression"]) - {"none"})
+        _grouped_bars(ax, summary, "file_type", metric, "compression", {c: c for c in codecs})
+        ax.set_xlabel("File type")
+        ax.set_title(title)
+    return draw
+
+
+# --- S3: BLE by file size ---
+
+def _s3_ble_rows(df):
+    rows = select(df, scenario="s3")
+    # The historical S3 figures are the synchronous (Write Request) mode
+    if (rows["mode"] == "request").any():
+        rows = rows[rows["mode"].isin(["request", ""])]
+    return rows
+
+
+def _s3_by_size(metric, title):
+    def draw(df, ax):
+        rows = _s3_ble_rows(df)
+        if not _has(rows, metric):
+            return False
+        summary = summarize(rows, ["size_kb"], [metric]).sort_values("size_kb")
+        _bars(ax, summary, "size_kb", metric, [f"{v:g} KB" for v in summary["size_kb"]])
+        ax.set_xlabel("File size")
+        ax.set_title(title)
+    return draw
+
+
+def _s3_linearity(df, ax):
+    rows = _s3_ble_rows(df).dropna(subset=["size_kb", "duration_s"])
+    if rows.empty:
+        return False
+    ax.scatter(rows["size_kb"], rows["duration_s"], label="runs")
+    if rows["size_kb"].nunique() >= 2:
+        slope, intercept = np.polyfit(rows["size_kb"], rows["duration_s"], 1)
+        xs = np.linspace(0, rows["size_kb"].max(), 50)
+        ax.plot(xs, slope * xs + intercept, "--",
+                label=f"fit: {slope:.3f} s/KB ({1 / slope:.2f} KB/s)" if slope else "fit")
+    ax.set_xlabel("File size (KB)")
+    ax.set_ylabel(LABELS["duration_s"])
+    ax.set_title("S3 - BLE transfer duration vs size (synchronous writes)")
+    ax.grid(True, alpha=0.3)
+    ax.legend()
+
+
+# --- S4: Wi-Fi interference ---
+
+def _s4_comparison(metric, title):
+    def draw(df, ax):
+        rows = select(df, scenario="s4")
+        if not _has(rows, metric):
+            return False
+        summary = summarize(rows, ["interference", "distance"], [metric])
+        _grouped_bars(ax, summary, "distance", metric, "interference",
+                      {False: "No interference", True: "Wi-Fi interference"})
+        ax.set_title(title)
+    return draw
+
+
+# --- BLE vs Classic ---
+
+def _comparison(metric, title):
+    def draw(df, ax):
+        # Classic: TXT transfers without interference (S4), BLE: S3 synchronous mode
+        classic = select(df, scenario="s4", interference=False)
+        ble = _s3_ble_rows(df)
+        if not (_has(classic, metric) and _has(ble, metric)):
+            return False
+        values = [(name, rows[metric].dropna()) for name, rows in (("Classic", classic), ("BLE", ble))]
+        means = [v.mean() for _, v in values]
+        errors = [np.nan_to_num(confidence_halfwidth(v)) for _, v in values]
+        ax.bar([name for name, _ in values], means, yerr=errors, capsize=4, color=["tab:blue", "tab:orange"])
+        if max(means) / max(min(means), 1e-9) > 50:
+            ax.set_yscale("log")
+        ax.set_ylabel(LABELS[metric])
+        ax.set_title(title)
+        ax.grid(True, axis="y", alpha=0.3)
+    return draw
+
+
+FIGURES = {
+    "s1_random/old_s1_average_rtt_over_distance.png":
+        _s1_over_distance("rtt_avg_ms", "S1 - Average RTT over distance"),
+    "s1_random/s1_average_throughput_over_distance.png":
+        _s1_over_distance("throughput_kbs", "S1 - Average throughput over distance"),
+    "s1_random/s1_average_transfer_duration_over_distance.png":
+        _s1_over_distance("duration_s", "S1 - Average transfer duration over distance"),
+    "s2_file/s2_average_throughput_by_file_type.png": _s2_by_file_type,
+    "s2_file/s2_throughput_vs_distance_different_file_type.png":
+        _s2_vs_distance("throughput_kbs", "S2 - Throughput vs distance by file type"),
+    "s2_file/s2_transfer_duration_vs_distance_by_file_type.png":
+        _s2_vs_distance("duration_s", "S2 - Transfer duration vs distance by file type"),
+    "s2_file/s2_striped_vs_single_stream_throughput.png": _s2_striping,
+    "s2_file/s2_effective_throughput_by_compression.png":
+        _s2_compression("throughput_kbs", "S2 - Effective throughput (original bytes) by compression"),
+    "s2_file/s2_wire_throughput_by_compression.png":
+        _s2_compression("wire_kbs", "S2 - Wire throughput by compression"),
+    "s3_ble/s3_average_rtt_different_file_size.png":
+        _s3_by_size("rtt_avg_ms", "S3 - BLE average RTT by file size"),
+    "s3_ble/s3_average_throughput_different_file_size.png":
+        _s3_by_size("throughput_kbs", "S3 - BLE average throughput by file size"),
+    "s3_ble/s3_average_transfer_duration_different_file_size.png":
+        _s3_by_size("duration_s", "S3 - BLE average transfer duration by file size"),
+    "s3_ble/s3_ble_transfer_duration_linearity_synchronous_mode.png": _s3_linearity,
+    "s4_interference/s4_average_throughput_interference_comparison.png":
+        _s4_comparison("throughput_kbs", "S4 - Throughput with and without Wi-Fi interference"),
+    "s4_interference/s4_average_transfer_duration_interference_comparison.png":
+        _s4_comparison("duration_s", "S4 - Transfer duration with and without Wi-Fi interference"),
+    "comparison/comp_average_rtt_comparison_ble_classic.png":
+        _comparison("rtt_avg_ms", "Average RTT - BLE vs Classic"),
+    "comparison/comp_average_throughput_comparison_ble_classic.png":
+        _comparison("throughput_kbs", "Average throughput - BLE vs Classic"),
+    "comparison/comp_average_transfer_duration_comparison_ble_classic.png":
+        _comparison("duration_s", "Average transfer duration - BLE vs Classic"),
+}
+
+
+def render_all(df, out_dir):
+    """Draw every figure that has data; returns (written, skipped) paths."""
+    written, skipped = [], []
+    for name, draw in FIGURES.items():
+        fig, ax = plt.subplots(figsize=(8, 5))
+        try:
+            if draw(df, ax) is False:
+                skipped.append(name)
+                continue
+            path = os.path.join(out_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fig.tight_layout()
+            fig.savefig(path, dpi=150)
+            written.append(path)
+        finally:
+            plt.close(fig)
+    return written, skipped
@@ -0,0 +1,354 @@
+"""Per-run rows from raw logs or from the legacy spreadsheets.
+
+Every source is reduced to the same table, one row per run (per trial of a
+--repeat run, and per throughput mode for BLE), with the columns in COLUMNS. Parsed results are kept in a
+pickle cache keyed by file size and mtime, so adding a run to a results
+directory only parses that run.
+"""
+import glob
+import json
+import os
+import pickle
+import re
+
+import numpy as np
+import pandas as pd
+
+from btperf import recorder
+
+COLUMNS = [
+    "technology",       # classic | ble
+    "scenario",         # s1 | s2 | s3 | s4
+    "source",           # results directory or spreadsheet the row came from
+    "distance",         # m
+    "try",
+    "trial",            # trial within the run (--repeat), 0 for single-trial runs
+    "interference",     # bool
+    "file_type",        # TXT, JPG, MP3, MP4, RANDOM
+    "size_kb",
+    "mode",             # BLE write mode (request, command, credit); "" for classic
+    "duration_s",
+    "throughput_kbs",
+    "rtt_avg_ms",
+    "rtt_min_ms",
+    "rtt_max_ms",
+    "rtt_std_ms",
+    "rtt_p50_ms",
+    "rtt_p95_ms",
+    "rtt_p99_ms",
+    "connect_ms",       # setup of the connection opened for this trial; NaN when the trial reused one
+    "stripes",          # parallel connections one S2 file was split over (1 = single stream)
+    "compression",      # --compress of the S2 client (none, auto, codec[:level])
+    "wire_kbs",         # bytes actually sent per second; throughput_kbs counts original bytes
+]
+CACHE_FILE = ".analysis_cache.pickle"
+BLE_MODES = ("request", "command", "credit")   # index order of the BLE client's mode column
+
+
+class Cache:
+    """{key: (signature, rows)}; a stale or missing signature means reparse."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        if path and os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    self.entries = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                self.entries = {}
+        self.hits = self.misses = 0
+
+    def get(self, key, signature, parse):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == signature:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        rows = parse()
+        self.entries[key] = (signature, rows)
+        self.dirty = True
+        return rows
+
+    def save(self):
+        if self.path and self.dirty:
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(self.entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+            self.dirty = False
+
+
+def _signature(paths):
+    return tuple(sorted((os.path.basename(p), st.st_size, st.st_mtime_ns)
+                        for p in paths for st in [os.stat(p)]))
+
+
+def _rtt_columns(rtt_ns):
+    """RTT summary (ms) of one run from its raw samples; lost probes (< 0) are skipped."""
+    rtt = np.asarray(rtt_ns, dtype=np.float64)
+    rtt = rtt[rtt >= 0] / 1e6
+    if not rtt.size:
+        return {}
+    p50, p95, p99 = np.percentile(rtt, [50, 95, 99])
+    return {"rtt_avg_ms": rtt.mean(), "rtt_min_ms": rtt.min(), "rtt_max_ms": rtt.max(),
+            "rtt_std_ms": rtt.std(), "rtt_p50_ms": p50, "rtt_p95_ms": p95, "rtt_p99_ms": p99}
+
+
+def _find_log(run_dir, prefix):
+    matches = sorted(p for p in glob.glob(os.path.join(run_dir, prefix + "_*"))
+                     if recorder.format_of(p) == os.path.splitext(p)[1].lstrip("."))
+    return matches[-1] if matches else None
+
+
+def _file_type(path):
+    return os.path.splitext(str(path))[1].lstrip(".").upper() or "?"
+
+
+def _trials(log, length):
+    """Trial column of a log (all 0 for logs written before --repeat existed)."""
+    return np.asarray(log["trial"]) if "trial" in log else np.zeros(length, dtype=np.int64)
+
+
+def _connect_ms(run_dir):
+    """{trial: setup time in ms} of the connections a run opened."""
+    path = _find_log(run_dir, "connect")
+    if not path:
+        return {}
+    log = recorder.load(path)
+    return {int(trial): ns / 1e6 for trial, ns in zip(log["trial"], log["connect_ns"])}
+
+
+def _parse_classic_random(run_dir, record):
+    log = recorder.load(_find_log(run_dir, "s1"))
+    t_ns, sent = np.asarray(log["t_ns"]), np.asarray(log["sent_bytes"])
+    trials = _trials(log, t_ns.size)
+    connect = _connect_ms(run_dir)
+    rows = []
+    for trial in np.unique(trials):
+        sel = trials == trial
+        duration = t_ns[sel].max() / 1e9     # the last row is written when the server's ACK arrives
+        size = int(sent[sel].max())
+        rows.append({"technology": "classic", "file_type": "RANDOM", "size_kb": size / 1024,
+                     "trial": int(trial), "duration_s": duration,
+                     "throughput_kbs": size / 1024 / duration if duration > 0 else np.nan,
+                     "connect_ms": connect.get(int(trial), np.nan)})
+    return rows
+
+
+def _parse_classic_file(run_dir, record):
+    log = recorder.load(_find_log(run_dir, "s2"))
+    file_type = _file_type(record["params"].get("file", ""))
+    connect = _connect_ms(run_dir)
+    rows = []
+    compression = str(record["params"].get("compress", "none"))
+    # Logs written before --stripes/--compress existed have neither column
+    stripes = log["stripes"] if "stripes" in log else np.ones(len(log["bytes"]), dtype=np.int64)
+    wire = log["wire_bytes"] if "wire_bytes" in log else log["bytes"]
+    for trial, (size, duration_ns, count, sent) in enumerate(zip(log["bytes"], log["duration_ns"], stripes, wire)):
+        duration = duration_ns / 1e9
+        rows.append({"technology": "classic", "file_type": file_type, "size_kb": size / 1024, "trial": trial,
+                     "duration_s": duration, "throughput_kbs": size / 1024 / duration if duration > 0 else np.nan,
+                     "wire_kbs": sent / 1024 / duration if duration > 0 else np.nan,
+                     "connect_ms": connect.get(trial, np.nan), "stripes": int(count), "compression": compression})
+    return rows
+
+
+def _parse_classic_echo(run_dir, record):
+    row = {"technology": "classic", "file_type": "RANDOM", "connect_ms": _connect_ms(run_dir).get(0, np.nan)}
+    latency = _find_log(run_dir, "latency")
+    if latency:
+        row.update(_rtt_columns(recorder.load(latency)["rtt_ns"]))
+    throughput = _find_log(run_dir, "throughput")
+    if throughput:
+        log = recorder.load(throughput)
+        t_ns, recv = np.asarray(log["t_ns"]), np.asarray(log["recv_bytes"])
+        if t_ns.size and t_ns.max() > 0:
+            row["duration_s"] = t_ns.max() / 1e9
+            row["throughput_kbs"] = recv.max() / 1024 / row["duration_s"]
+    return [row]
+
+
+def _parse_ble(run_dir, record):
+    size_kb = float(record["params"].get("size-mb", 1)) * 1024
+    connect = _connect_ms(run_dir)
+    rtt = {}
+    latency = _find_log(run_dir, "ble_latency")
+    if latency:
+        log = recorder.load(latency)
+        rtt_ns = np.asarray(log["rtt_ns"])
+        trials = _trials(log, rtt_ns.size)
+        rtt = {int(trial): _rtt_columns(rtt_ns[trials == trial]) for trial in np.unique(trials)}
+    throughput = _find_log(run_dir, "ble_throughput")
+    if not throughput:
+        return [{"technology": "ble", "file_type": "RANDOM", "size_kb": size_kb, "trial": trial,
+                 "connect_ms": connect.get(trial, np.nan), **columns} for trial, columns in rtt.items()]
+    log = recorder.load(throughput)
+    mode, t_ns = np.asarray(log["mode"]), np.asarray(log["t_ns"])
+    sent, recv = np.asarray(log["sent_bytes"]), np.asarray(log["recv_bytes"])
+    trials = _trials(log, mode.size)
+    rows = []
+    for trial in np.unique(trials):
+        for index in np.unique(mode[trials == trial]):
+            sel = (trials == trial) & (mode == index)
+            duration = t_ns[sel].max() / 1e9
+            received = recv[sel].max()
+            nbytes = received if received >= 0 else sent[sel].max()
+            rows.append({"technology": "ble", "file_type": "RANDOM", "size_kb": size_kb, "trial": int(trial),
+                         "mode": BLE_MODES[int(index)], "duration_s": duration,
+                         "throughput_kbs": nbytes / 1024 / duration if duration > 0 else np.nan,
+                         "connect_ms": connect.get(int(trial), np.nan), **rtt.get(int(trial), {})})
+    return rows
+
+
+PARSERS = {
+    "bluetooth_classic_client.py": _parse_classic_random,
+    "bluetooth_client_file.py": _parse_classic_file,
+    "bluetooth_client.py": _parse_classic_echo,
+    "ble_client_latency_throughput.py": _parse_ble,
+}
+
+
+def _as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("yes", "true", "1", "on")
+    return bool(value)
+
+
+def load_results(results_dir, cache):
+    """Rows for every successful measured repetition listed in <results_dir>/runs.jsonl."""
+    rows = []
+    with open(os.path.join(results_dir, "runs.jsonl")) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    for record in records:
+        if record["kind"] != "rep" or record["returncode"] != 0:
+            continue
+        parser = PARSERS.get(os.path.basename(record["script"]))
+        run_dir = os.path.join(results_dir, record["dir"])
+        if parser is None or not os.path.isdir(run_dir):
+            continue
+        files = [os.path.join(run_dir, n) for n in os.listdir(run_dir)]
+        parsed = cache.get(run_dir, _signature(files), lambda: parser(run_dir, record))
+        conditions = record.get("conditions", {})
+        for row in parsed:
+            rows.append({"scenario": record["scenario"].split("_")[0], "source": results_dir,
+                         "distance": conditions.get("distance", np.nan), "try": record["index"] + 1,
+                         "interference": _as_bool(conditions.get("interference", False)), "mode": "",
+                         "trial": 0, "stripes": 1, "compression": "none", **row})
+    return rows
+
+
+# --- Legacy spreadsheets (raw table on the left of each sheet, summaries on the right) ---
+
+LABEL_COLUMNS = ("File", "File Type", "Interference?", "Source.Name")
+
+
+def _read_block(path, usecols, sheet_name=0):
+    """Raw table of a sheet; merged cells (one label per block of tries) are filled down.
+
+    Summary tables drawn under the raw runs (e.g. "Interference?" / "no" / "yes"
+    in the Try column, "-" for missing values) are dropped: only rows with a
+    numeric Try are kept, and every column but LABEL_COLUMNS is made numeric.
+    """
+    df = pd.read_excel(path, sheet_name=sheet_name, usecols=usecols)
+    df.columns = [re.sub(r"\.\d+$", "", c) for c in df.columns]
+    df = df.dropna(how="all")
+    for column in ("Distance (m)", "File", "File Type", "Interference?", "Size (KB)", "Source.Name"):
+        if column in df.columns:
+            df[column] = df[column].ffill()
+    if "Try" in df.columns:
+        df = df[pd.to_numeric(df["Try"], errors="coerce").notna()].copy()
+    for column in df.columns:
+        if column not in LABEL_COLUMNS:
+            df[column] = pd.to_numeric(df[column], errors="coerce")
+    return df
+
+
+def _read_s1_new(path):
+    df = _read_block(path, "A:E").dropna(subset=["Try"])
+    return [{"technology": "classic", "scenario": "s1", "distance": r["Distance (m)"], "try": r["Try"],
+             "file_type": "RANDOM", "size_kb": r["Size (Bytes)"] / 1024,
+             "duration_s": r["Transfer Duration (s)"], "throughput_kbs": r["Throughput (KB/s)"]}
+            for _, r in df.iterrows()]
+
+
+def _read_s1_old(path):
+    df = _read_block(path, "A:C", sheet_name="latency").dropna(subset=["RTT (ms)"])
+    names = df["Source.Name"].str.extract(r"latency_(\d+)m_try_(\d+)")
+    df["distance"], df["try"] = names[0].astype(float), names[1].astype(int)
+    rows = []
+    for (distance, attempt), group in df.groupby(["distance", "try"]):
+        rtt = group["RTT (ms)"].to_numpy() * 1e6
+        rows.append({"technology": "classic", "scenario": "s1", "distance": distance, "try": attempt,
+                     "file_type": "RANDOM", **_rtt_columns(rtt)})
+    return rows
+
+
+def _read_s2(path):
+    df = _read_block(path, "A:F").dropna(subset=["Try"])
+    return [{"technology": "classic", "scenario": "s2", "distance": r["Distance (m)"], "try": r["Try"],
+             "file_type": str(r["File"]).upper(), "size_kb": r["Received (bytes)"] / 1024,
+             "duration_s": r["Duration (s)"], "throughput_kbs": r["Speed (KB/s)"]}
+            for _, r in df.iterrows()]
+
+
+def _read_s3(path):
+    df = _read_block(path, "A:H").dropna(subset=["Try"])
+    return [{"technology": "ble", "scenario": "s3", "distance": r["Distance (m)"], "try": r["Try"],
+             "file_type": "RANDOM", "size_kb": r["Size (KB)"], "mode": "request",
+             "duration_s": r["Duration (s)"], "throughput_kbs": r["Throughput (KB/s)"],
+             "rtt_avg_ms": r["Average RTT (ms)"], "rtt_min_ms": r["Min RTT (ms)"], "rtt_max_ms": r["Max RTT (ms)"]}
+            for _, r in df.iterrows()]
+
+
+def _read_s4(path):
+    rows = []
+    without = _read_block(path, "A:J").dropna(subset=["Try"])
+    for _, r in without.iterrows():
+        rows.append({"technology": "classic", "scenario": "s4", "distance": r["Distance (m)"], "try": r["Try"],
+                     "interference": _as_bool(r["Interference?"]), "file_type": str(r["File Type"]).upper(),
+                     "size_kb": r["Size (KB)"], "duration_s": r["Duration (s)"],
+                     "throughput_kbs": r["Throughput (KB/s)"], "rtt_avg_ms": r["Average RTT (ms)"],
+                     "rtt_min_ms": r["Min RTT (ms)"], "rtt_max_ms": r["Max RTT (ms)"]})
+    with_wifi = _read_block(path, "L:R").dropna(subset=["Try"])
+    for _, r in with_wifi.iterrows():
+        rows.append({"technology": "classic", "scenario": "s4", "distance": r["Distance (m)"], "try": r["Try"],
+                     "interference": _as_bool(r["Interference?"]), "file_type": str(r["File Type"]).upper(),
+                     "size_kb": r["Size (KB)"], "duration_s": r["Duration (s)"],
+                     "throughput_kbs": r["Throughput (KB/s)"]})
+    return rows
+
+
+SPREADSHEETS = {
+    "s1_random_new.xlsx": _read_s1_new,
+    "s1_random_old.xlsx": _read_s1_old,
+    "s2_file.xlsx": _read_s2,
+    "s3_ble.xlsx": _read_s3,
+    "s4_interference.xlsx": _read_s4,
+}
+
+
+def load_spreadsheets(data_dir, cache):
+    rows = []
+    for name, reader in SPREADSHEETS.items():
+        path = os.path.join(data_dir, name)
+        if not os.path.exists(path):
+            continue
+        for row in cache.get(path, _signature([path]), lambda: reader(path)):
+            rows.append({"source": name, "interference": False, "mode": "", "trial": 0, "stripes": 1,
+                         "compression": "none", **row})
+    return rows
+
+
+def load(results_dirs=(), data_dir=None, cache_path=None):
+    """Per-run DataFrame from results directories and/or the spreadsheets in data_dir."""
+    cache = Cache(cache_path)
+    rows = []
+    if data_dir:
+        rows += load_spreadsheets(data_dir, cache)
+    for results_dir in results_dirs:
+        rows += load_results(results_dir, cache)
+    cache.save()
+    print(f"[ANALYSIS] {len(rows)} rows ({cache.misses} sources parsed, {cache.hits} from cache)")
+    return pd.DataFrame(rows, columns=COLUMNS)
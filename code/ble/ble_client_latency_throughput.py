@@ -1,197 +1,445 @@
 # ble_perf_client_final.py (Sur raspi-a)
-import pexpect
+import argparse
+import asyncio
+import datetime
 import time
 import sys
 import os
-import math
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from btperf import gatt, payload, profiling, recorder, session, stats
 
 # --- CONFIGURATION ---
-SERVER_ADDRESS = "2C:CF:67:27:F7:11" 
-# NOTE: Le même handle 0x0014 est utilisé pour les deux tests.
-HANDLE_WRITE_AND_RTT = "0x0014" 
+SERVER_ADDRESS = "2C:CF:67:27:F7:11"
+# Handle historique (0x0014), utilisé seulement si la découverte par UUID échoue
+HANDLE_WRITE_AND_RTT = "0x0014"
+BACKEND = "gatttool"
 
 # Fichier et réglages
 FILE_SIZE_MB = 1
 FILENAME = "test_data.bin"
-LATENCY_PACKET_SIZE = 10
-LATENCY_TEST_COUNT = 50 
-MAX_WRITE_CHUNK_SIZE = 50 
-
-TIMEOUT_S = 15 
-GATTTOOL_PROMPT = r'\[.{17}\]\[LE\]>' 
+LATENCY_PACKET_SIZE = 20     # au moins gatt.LATENCY_PROBE.size (séquence + horodatage)
+LATENCY_TEST_COUNT = 50
+LATENCY_PIPELINE = 1         # sondes en vol simultanément
+ECHO_TIMEOUT_S = 2
+# Modes du test de débit : request (Write Request, acquitté), command (Write Command, sans réponse),
+# credit (Write Command avec fenêtre de crédits rendue par les ACK du serveur)
+THROUGHPUT_MODES = ("request", "command", "credit")
+CREDIT_WINDOW = 32       # chunks en vol maximum en mode credit
+ACK_EVERY = 8            # le serveur notifie un ACK tous les ACK_EVERY chunks
+ACK_TIMEOUT_S = 2
+# Colonnes des logs (btperf.recorder) ; trial = numéro de l'essai (--repeat), rtt_ns = -1 pour une
+# sonde perdue, mode = index dans THROUGHPUT_MODES, received = -1 tant qu'aucun ACK n'est arrivé
+LATENCY_COLUMNS = (("trial", "q"), ("seq", "q"), ("t_send_ns", "q"), ("rtt_ns", "q"))
+THROUGHPUT_COLUMNS = (("trial", "q"), ("mode", "q"), ("t_ns", "q"), ("sent_bytes", "q"), ("recv_bytes", "q"))
+# La taille des écritures vient du MTU négocié (MTU - 3), plus de MAX_WRITE_CHUNK_SIZE fixe
 
 # --- STATE ---
-RTT_RESULTS = []
+RTT_STATS = stats.LatencyStats()
 
-# --- FONCTIONS GATTTOOL ---
+# --- FONCTIONS ---
+
+def create_dummy_file(filename, size_mb=1, profile=payload.DEFAULT_PROFILE, seed=payload.DEFAULT_SEED):
+    """Création du fichier factice (générateur de payload partagé, reproductible via seed)."""
 
-def create_dummy_file(filename, size_mb=1):
-    """Création du fichier factice."""
-    
     # CONVERSION ENTIÈRE FORCÉE
     # size_bytes doit être un entier
-    size_bytes = int(size_mb * 1024 * 1024) 
-    
+    size_bytes = int(size_mb * 1024 * 1024)
+
     if not os.path.exists(filename) or os.path.getsize(filename) != size_bytes:
         print(f"[{time.strftime('%H:%M:%S')}] Création du fichier factice: {filename} ({size_bytes} octets)...")
         with open(filename, 'wb') as f:
             # size_bytes est garanti d'être un entier ici
-            f.write(os.urandom(size_bytes))
+            for chunk in payload.iter_chunks(payload.make_pool(size_bytes, profile, seed), size_bytes, 1 << 20):
+                f.write(chunk)
         print(f"[{time.strftime('%H:%M:%S')}] Fichier créé.")
     else:
         print(f"[{time.strftime('%H:%M:%S')}] Utilisation du fichier existant: {filename}.")
 
-def connect_gatttool():
-    """Établit la connexion gatttool en mode interactif."""
-    print(f"[{time.strftime('%H:%M:%S')}] Démarrage de la connexion interactive vers {SERVER_ADDRESS}...")
-    
+
+async def connect_client(backend, address):
+    """Établit la connexion GATT (découverte des handles et négociation du MTU)."""
+    print(f"[{time.strftime('%H:%M:%S')}] Démarrage de la connexion ({backend}) vers {address}...")
+
     try:
-        child = pexpect.spawn(
-            f'sudo gatttool -b {SERVER_ADDRESS} -I -t random', 
-            timeout=TIMEOUT_S
-        )
-        child.expect(r'\[.+\]\s*') 
-        child.sendline('connect')
-        child.expect(GATTTOOL_PROMPT, timeout=TIMEOUT_S)
-        print(f"[{time.strftime('%H:%M:%S')}] [SUCCESS] Connexion établie.")
-        return child
+        client = await gatt.create_client(backend, address).connect()
+        print(f"[{time.strftime('%H:%M:%S')}] [SUCCESS] Connexion établie en {client.connect_time:.2f}s "
+              f"(MTU {client.mtu}, écriture max {client.max_write} octets).")
+        return client
 
     except Exception as e:
         print(f"\n[{time.strftime('%H:%M:%S')}] [ERROR] Échec de la connexion. Vérifiez 'advertise on'. Erreur: {e}")
         return None
 
-def run_latency_test(child):
-    global RTT_RESULTS
-    RTT_RESULTS = []
-    print(f"\n[{time.strftime('%H:%M:%S')}] --- STARTING LATENCY TEST (RTT) ---")
-    
+
+def find_characteristic(client, uuid):
+    """Handle de la caractéristique par UUID, sinon handle historique."""
+    try:
+        return client.characteristic(uuid)
+    except gatt.GattError:
+        print(f"[WARN] {uuid} introuvable, utilisation du handle {HANDLE_WRITE_AND_RTT}.")
+        return gatt.Characteristic(uuid, int(HANDLE_WRITE_AND_RTT, 16), ("write",))
+
+
+async def run_latency_test(client, char, count=LATENCY_TEST_COUNT, packet_size=LATENCY_PACKET_SIZE,
+                           pipeline=LATENCY_PIPELINE, log=None, trial=0):
+    """RTT aller-retour : chaque sonde (séquence + horodatage) revient en notification du serveur.
+
+    Jusqu'à `pipeline` sondes sont en vol ; les échos sont associés aux envois par
+    numéro de séquence, une sonde sans écho après ECHO_TIMEOUT_S est comptée perdue.
+    """
+    global RTT_STATS
+    RTT_STATS = stats.LatencyStats()
+    print(f"\n[{time.strftime('%H:%M:%S')}] --- STARTING LATENCY TEST (RTT, {pipeline} en vol) ---")
+
+    # Payloads générés avant la boucle, hors de la mesure ; l'en-tête de sonde est écrit à l'envoi
+    packet_size = max(packet_size, gatt.LATENCY_PROBE.size)
+    phase = profiling.phase
+    with phase("prep"):
+        pool = payload.make_pool(packet_size * count)
+        packets = [bytearray(chunk) for chunk in payload.iter_chunks(pool, len(pool), packet_size)]
+    response = "write-without-response" not in char.properties
+
+    loop = asyncio.get_running_loop()
+    window = asyncio.Semaphore(pipeline)
+    pending = {}                 # séquence -> (timer d'expiration, heure d'envoi)
+    done = asyncio.Event()
+
+    def settle(seq, rtt_ns):
+        timer, t_send = pending.pop(seq)
+        timer.cancel()
+        if log is not None:
+            with phase("log"):
+                log.record(trial, seq, t_send, rtt_ns)
+        window.release()
+        if not pending and sent == count:
+            done.set()
+
+    def on_echo(data, t_ns):
+        if len(data) < gatt.LATENCY_PROBE.size:
+            return
+        seq, t_send = gatt.LATENCY_PROBE.unpack_from(data)
+        if seq in pending:
+            RTT_STATS.add(t_ns - t_send)
+            settle(seq, t_ns - t_send)
+
+    def expire(seq):
+        if seq in pending:
+            RTT_STATS.add_loss()
+            settle(seq, -1)
+
+    await client.start_notify(char, on_echo)
+
     # 1. Boucle de test RTT
-    for i in range(LATENCY_TEST_COUNT):
-        payload = os.urandom(LATENCY_PACKET_SIZE).hex()
-        
-        sys.stdout.write(f"\r[{time.strftime('%H:%M:%S')}] Latency Test: {i+1}/{LATENCY_TEST_COUNT} packets...")
-        sys.stdout.flush()
-
-        # Utilisation de char-write-REQ (Latence fonctionne et RTT est mesurable)
-        time_start_rtt = time.time()
-        child.sendline(f'char-write-req {HANDLE_WRITE_AND_RTT} {payload}')
-        
-        # Attendre le message de confirmation de gatttool
+    sent = 0
+    for seq in range(count):
+        with phase("wait"):
+            await window.acquire()
+        with phase("log"):
+            sys.stdout.write(f"\r[{time.strftime('%H:%M:%S')}] Latency Test: {seq+1}/{count} packets...")
+            sys.stdout.flush()
+
+        packet = packets[seq]
+        t_send = time.perf_counter_ns()
+        with phase("encode"):
+            gatt.LATENCY_PROBE.pack_into(packet, 0, seq, t_send)
+        pending[seq] = (loop.call_later(ECHO_TIMEOUT_S, expire, seq), t_send)
+        sent += 1
         try:
-            child.expect(r'Characteristic value was written successfully|' + GATTTOOL_PROMPT, timeout=2) 
-            time_end_rtt = time.time()
-            
-            rtt = (time_end_rtt - time_start_rtt) * 1000 
-            RTT_RESULTS.append(rtt)
-                
-        except pexpect.exceptions.Timeout:
-            print(f"\n[WARN] RTT timeout for packet {i+1}.")
-            
-        time.sleep(0.01) # Petit délai entre les paquets
-        
+            await client.write(char, packet, response=response)
+        except gatt.GattError as e:
+            print(f"\n[WARN] Envoi de la sonde {seq} impossible: {e}")
+            expire(seq)
+
+        if pipeline == 1:
+            await asyncio.sleep(0.01) # Petit délai entre les paquets
+    if pending:
+        with phase("wait"):
+            await done.wait()
+
     # 2. Afficher les résultats
-    if RTT_RESULTS:
-        avg_rtt = sum(RTT_RESULTS) / len(RTT_RESULTS)
-        min_rtt = min(RTT_RESULTS)
-        max_rtt = max(RTT_RESULTS)
+    if RTT_STATS.count:
+        r = RTT_STATS.to_dict()
         print(f"\n[{time.strftime('%H:%M:%S')}] --- LATENCY TEST COMPLETE ---")
-        print(f"  Total Valid RTTs: {len(RTT_RESULTS)} / {LATENCY_TEST_COUNT}")
-        print(f"  Average RTT: {avg_rtt:.3f} ms")
-        print(f"  Min RTT: {min_rtt:.3f} ms")
-        print(f"  Max RTT: {max_rtt:.3f} ms")
+        print(f"  Total Valid RTTs: {r['count']} / {count} ({r['lost']} lost, "
+              f"{r['loss_bursts']} bursts, longest {r['max_loss_burst']})")
+        print(f"  Average RTT: {r['mean_ms']:.3f} ms (stdev {r['stdev_ms']:.3f} ms)")
+        print(f"  Min RTT: {r['min_ms']:.3f} ms")
+        print(f"  Max RTT: {r['max_ms']:.3f} ms")
+        print(f"  Percentiles: p50 {r['p50_ms']:.3f} / p95 {r['p95_ms']:.3f} / p99 {r['p99_ms']:.3f} "
+              f"/ p99.9 {r['p99.9_ms']:.3f} ms")
+        print(f"  Jitter (RFC 3550): {r['jitter_ms']:.3f} ms")
         print("------------------------------")
     else:
         print("\n[FAIL] Aucune réponse RTT valide reçue.")
 
 
-def run_throughput_test(child):
+async def run_throughput_test(client, char, filename=FILENAME, chunk_size=None, log=None, trial=0):
     print(f"\n[{time.strftime('%H:%M:%S')}] --- STARTING THROUGHPUT TEST ---")
-    print(f"[WARN] Ce test utilise char-write-req pour la fiabilité et prendra environ 17 minutes pour {FILE_SIZE_MB} MB.")
 
-    file_size = FILE_SIZE_MB * 1024 * 1024
-    
+    file_size = os.path.getsize(filename)
+    max_payload_size = chunk_size or client.max_write
+    print(f"[INFO] Write Request de {max_payload_size} octets (MTU {client.mtu}).")
+
     # 1. Envoyer le signal de début de transfert
-    child.sendline(f'char-write-req {HANDLE_WRITE_AND_RTT} {b"START_TRANSFER".hex()}')
-    child.expect(GATTTOOL_PROMPT, timeout=5)
-    
-    start_time = time.time()
+    await client.write(char, b"START_TRANSFER", response=True)
+
+    start_time = time.perf_counter()
+    start_ns = time.perf_counter_ns()
     bytes_sent = 0
-    max_payload_size = MAX_WRITE_CHUNK_SIZE 
-    
+    mode_index = THROUGHPUT_MODES.index("request")
+    phase = profiling.phase
+
     try:
-        with open(FILENAME, 'rb') as f:
-            while True:
-                chunk = f.read(max_payload_size)
-                if not chunk:
-                    break
-                
-                # Utilisation de char-write-REQ (lent, mais fonctionne)
-                child.sendline(f'char-write-req {HANDLE_WRITE_AND_RTT} {chunk.hex()}') 
-                
-                # Attendre la confirmation après chaque paquet (cause la lenteur)
-                child.expect(r'Characteristic value was written successfully|' + GATTTOOL_PROMPT, timeout=10) 
-                
-                bytes_sent += len(chunk)
-                
-                if bytes_sent % (1024 * 100) < len(chunk): 
-                    sys.stdout.write(f"\r[{time.strftime('%H:%M:%S')}] Sending: {bytes_sent / 1024:.2f} KB / {file_size / 1024:.2f} KB...")
-                    sys.stdout.flush()
+        with open(filename, 'rb') as f, phase("prep"):
+            data = memoryview(f.read())
+        for offset in range(0, file_size, max_payload_size):
+            chunk = data[offset:offset + max_payload_size]
+
+            # Write Request: attendre la confirmation après chaque paquet
+            await client.write(char, chunk, response=True)
+
+            bytes_sent += len(chunk)
+            if log is not None:
+                # Write Request acquittée : envoyé == reçu
+                with phase("log"):
+                    log.record(trial, mode_index, time.perf_counter_ns() - start_ns, bytes_sent, bytes_sent)
+
+            if bytes_sent % (1024 * 100) < len(chunk):
+                sys.stdout.write(f"\r[{time.strftime('%H:%M:%S')}] Sending: {bytes_sent / 1024:.2f} KB / {file_size / 1024:.2f} KB...")
+                sys.stdout.flush()
 
         # 2. Envoyer le signal de fin de transfert
-        child.sendline(f'char-write-req {HANDLE_WRITE_AND_RTT} {b"END_TRANSFER".hex()}')
-        child.expect(GATTTOOL_PROMPT, timeout=5)
+        await client.write(char, b"END_TRANSFER", response=True)
 
-        end_time = time.time()
+        end_time = time.perf_counter()
         duration = end_time - start_time
-        
+
         throughput = (bytes_sent / 1024) / duration if duration > 0 else 0
-        
+
         print(f"\n[{time.strftime('%H:%M:%S')}] --- THROUGHPUT TEST COMPLETE ---")
         print(f"  Total Bytes Sent: {bytes_sent} bytes")
         print(f"  Duration: {duration:.2f} seconds")
         print(f"  Client Throughput: {throughput:.2f} KB/s")
         print("------------------------------")
+        # Chaque écriture est acquittée : le serveur a tout reçu
+        return {"trial": trial, "mode": "request", "chunk": max_payload_size, "sent": bytes_sent,
+                "received": bytes_sent, "duration": duration, "stalls": 0}
 
-    except Exception as e:
+    except (asyncio.TimeoutError, gatt.GattError) as e:
+        print(f"\n[{time.strftime('%H:%M:%S')}] Throughput test failed (Timeout likely): {e}")
+        return None
+
+
+async def run_stream_test(client, char, filename=FILENAME, mode="credit", window=CREDIT_WINDOW,
+                          ack_every=ACK_EVERY, log=None, trial=0):
+    """Débit en Write Command (sans réponse), chunks numérotés, dimensionnés au MTU négocié.
+
+    mode 'command' : aucun contrôle de flux, un seul ACK final donne les octets reçus.
+    mode 'credit'  : au plus `window` chunks non acquittés ; le serveur renvoie un ACK
+                     (dernier numéro reçu, octets reçus) tous les `ack_every` chunks.
+    """
+    print(f"\n[{time.strftime('%H:%M:%S')}] --- STARTING THROUGHPUT TEST ({mode.upper()}) ---")
+    ack_every = ack_every if mode == "credit" else 0
+    chunk_size = client.max_write - gatt.STREAM_CHUNK.size
+    print(f"[INFO] Write Command de {client.max_write} octets (MTU {client.mtu}), "
+          + (f"fenêtre {window} chunks, ACK tous les {ack_every}." if mode == "credit" else "sans contrôle de flux."))
+
+    phase = profiling.phase
+    with open(filename, 'rb') as f, phase("prep"):
+        data = memoryview(f.read())
+    file_size = len(data)
+
+    state = {"sent_seq": -1, "acked_seq": -1, "received": None, "missing": 0}
+    ack_event = asyncio.Event()
+    final_event = asyncio.Event()
+
+    def on_ack(value, t_ns):
+        # L'ACK final (après END_TRANSFER) est préfixé pour ne pas le confondre avec un ACK périodique en retard
+        final = value.startswith(gatt.END_TRANSFER)
+        last_seq, received, missing = gatt.STREAM_ACK.unpack_from(value, len(gatt.END_TRANSFER) if final else 0)
+        # Numéro de séquence 16 bits -> compteur local non borné
+        state["acked_seq"] = state["sent_seq"] - ((state["sent_seq"] - last_seq) & 0xFFFF)
+        state["received"], state["missing"] = received, missing
+        (final_event if final else ack_event).set()
+
+    await client.start_notify(char, on_ack)
+    await client.write(char, gatt.START_STREAM + gatt.STREAM_START.pack(ack_every), response=True)
+
+    buf = bytearray(client.max_write)
+    view = memoryview(buf)
+    stalls = 0
+    bytes_sent = 0
+    mode_index = THROUGHPUT_MODES.index(mode)
+    start_ns = time.perf_counter_ns()
+    start_time = time.perf_counter()
+    try:
+        for seq, offset in enumerate(range(0, file_size, chunk_size)):
+            if mode == "credit":
+                while seq - state["acked_seq"] > window:
+                    ack_event.clear()
+                    try:
+                        with phase("wait"):
+                            await asyncio.wait_for(ack_event.wait(), ACK_TIMEOUT_S)
+                    except asyncio.TimeoutError:
+                        # ACK perdu ou serveur saturé : on compte le blocage et on repart
+                        stalls += 1
+                        state["acked_seq"] = seq - window
+            chunk = data[offset:offset + chunk_size]
+            with phase("encode"):
+                gatt.STREAM_CHUNK.pack_into(buf, 0, seq & 0xFFFF)
+                buf[gatt.STREAM_CHUNK.size:gatt.STREAM_CHUNK.size + len(chunk)] = chunk
+            await client.write(char, view[:gatt.STREAM_CHUNK.size + len(chunk)], response=False)
+            state["sent_seq"] = seq
+            bytes_sent += len(chunk)
+            if log is not None:
+                received = state["received"]
+                with phase("log"):
+                    log.record(trial, mode_index, time.perf_counter_ns() - start_ns, bytes_sent,
+                               received if received is not None else -1)
+
+        # Fin de transfert acquittée, puis ACK final avec le total reçu par le serveur
+        await client.write(char, gatt.END_TRANSFER, response=True)
+        try:
+            with phase("wait"):
+                await asyncio.wait_for(final_event.wait(), ACK_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            print("\n[WARN] Pas d'ACK final : octets reçus par le serveur inconnus.")
+            state["received"] = None
+        duration = time.perf_counter() - start_time
+    except (asyncio.TimeoutError, gatt.GattError) as e:
         print(f"\n[{time.strftime('%H:%M:%S')}] Throughput test failed (Timeout likely): {e}")
+        return None
+
+    received = state["received"]
+    throughput = ((received if received is not None else bytes_sent) / 1024) / duration if duration > 0 else 0
+    print(f"[{time.strftime('%H:%M:%S')}] --- THROUGHPUT TEST COMPLETE ({mode.upper()}) ---")
+    print(f"  Total Bytes Sent: {bytes_sent} bytes")
+    print(f"  Server Bytes Received: {received if received is not None else '?'} bytes"
+          f" ({state['missing']} chunks manquants, {stalls} blocages de crédit)")
+    print(f"  Duration: {duration:.2f} seconds")
+    print(f"  Throughput (reçu serveur): {throughput:.2f} KB/s")
+    print("------------------------------")
+    return {"trial": trial, "mode": mode, "chunk": chunk_size, "sent": bytes_sent, "received": received,
+            "duration": duration, "stalls": stalls}
+
+
+def print_throughput_summary(results):
+    """Tableau comparatif des modes de débit."""
+    print(f"\n[{time.strftime('%H:%M:%S')}] --- THROUGHPUT SUMMARY ---")
+    print(f"  {'essai':<6}{'mode':<9}{'chunk':>7}{'sent':>10}{'received':>10}{'loss %':>8}{'duration':>10}{'KB/s':>9}")
+    for r in results:
+        if r is None:
+            continue
+        received = r["received"]
+        loss = 100.0 * (r["sent"] - received) / r["sent"] if received is not None and r["sent"] else float("nan")
+        rate = ((received if received is not None else r["sent"]) / 1024) / r["duration"] if r["duration"] > 0 else 0
+        print(f"  {r['trial'] + 1:<6}{r['mode']:<9}{r['chunk']:>7}{r['sent']:>10}"
+              f"{received if received is not None else '?':>10}"
+              f"{loss:>8.2f}{r['duration']:>9.2f}s{rate:>9.2f}")
+    print("------------------------------")
 
 
 # --- MAIN ---
 
-def disconnect_and_exit(child):
-    if child and child.isalive():
+async def disconnect_and_exit(client):
+    if client:
         print(f"\n[{time.strftime('%H:%M:%S')}] Déconnexion...")
         try:
-            child.sendline('exit')
-            child.expect(pexpect.EOF, timeout=5)
+            await client.disconnect()
         except Exception:
-            child.close()
+            pass
     print(f"[{time.strftime('%H:%M:%S')}] Programme terminé.")
 
 
-def main():
-    create_dummy_file(FILENAME, size_mb=FILE_SIZE_MB) 
-    
-    gatt_session = connect_gatttool()
+async def run(args):
+    with profiling.phase("prep"):
+        create_dummy_file(args.file, size_mb=args.size_mb, profile=args.payload, seed=args.seed)
 
-    if gatt_session:
-        # Les deux tests sont maintenant exécutés dans le même script
-        run_latency_test(gatt_session)
-        run_throughput_test(gatt_session)
-        
-        disconnect_and_exit(gatt_session)
-    else:
+    timestamp = datetime.datetime.now().strftime("%d%m_%H%M")
+    latency_log = recorder.from_args(args, f"ble_latency_{timestamp}", LATENCY_COLUMNS)
+    throughput_log = recorder.from_args(args, f"ble_throughput_{timestamp}", THROUGHPUT_COLUMNS)
+    connect_log = recorder.from_args(args, f"connect_{timestamp}", session.CONNECT_COLUMNS)
+    client = None
+    setups = []
+    results = []
+    with latency_log, throughput_log, connect_log:
+        # Tous les essais partagent la même connexion, sauf avec --reconnect ;
+        # l'établissement de connexion est mesuré à part, jamais dans un essai
+        for trial in range(args.repeat):
+            if client is None:
+                client = await connect_client(args.backend, args.address)
+                if not client:
+                    break
+                setups.append(client.connect_time)
+                connect_log.record(trial, int(client.connect_time * 1e9))
+                write_char = find_characteristic(client, gatt.WRITE_CHAR_UUID)
+                latency_char = find_characteristic(client, gatt.LATENCY_CHAR_UUID)
+            if args.repeat > 1:
+                print(f"\n[{time.strftime('%H:%M:%S')}] === ESSAI {trial + 1}/{args.repeat} ===")
+
+            await run_latency_test(client, latency_char, args.count, args.packet_size, args.pipeline,
+                                   latency_log, trial)
+            for mode in args.modes.split(","):
+                if mode == "request":
+                    results.append(await run_throughput_test(client, write_char, args.file, args.chunk_size,
+                                                             throughput_log, trial))
+                else:
+                    results.append(await run_stream_test(client, write_char, args.file, mode, args.window,
+                                                         args.ack_every, throughput_log, trial))
+            if args.reconnect and trial < args.repeat - 1:
+                await client.disconnect()
+                client = None
+
+    if not setups:
         print(f"[{time.strftime('%H:%M:%S')}] Échec de la connexion. Impossible de continuer les tests.")
+        return
+    print_throughput_summary(results)
+    print(f"[{time.strftime('%H:%M:%S')}] Établissement de connexion : {sum(setups) / len(setups) * 1000:.1f} ms "
+          f"en moyenne ({len(setups)} connexion(s) pour {args.repeat} essai(s)).")
+    print(f"[{time.strftime('%H:%M:%S')}] Logs: {latency_log.path}, {throughput_log.path}, {connect_log.path}")
 
+    await disconnect_and_exit(client)
 
-if __name__ == "__main__":
-    if os.geteuid() != 0:
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BLE latency + throughput client (S3)")
+    parser.add_argument("--backend", choices=gatt.BACKENDS, default=BACKEND,
+                        help="gatttool (pexpect), bleak (BlueZ D-Bus) or mock (no radio)")
+    parser.add_argument("--address", default=SERVER_ADDRESS)
+    parser.add_argument("--file", default=FILENAME)
+    parser.add_argument("--size-mb", type=float, default=FILE_SIZE_MB)
+    parser.add_argument("--count", type=int, default=LATENCY_TEST_COUNT, help="latency packets")
+    parser.add_argument("--packet-size", type=int, default=LATENCY_PACKET_SIZE, help="latency packet size in bytes")
+    parser.add_argument("--pipeline", type=int, default=LATENCY_PIPELINE,
+                        help="latency probes in flight (1 = one at a time)")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="bytes per write (default: negotiated MTU - 3)")
+    parser.add_argument("--modes", default=",".join(THROUGHPUT_MODES),
+                        help=f"throughput modes to run, comma-separated (default: {','.join(THROUGHPUT_MODES)})")
+    parser.add_argument("--window", type=int, default=CREDIT_WINDOW, help="credit mode: chunks in flight")
+    parser.add_argument("--ack-every", type=int, default=ACK_EVERY, help="credit mode: chunks per server ACK")
+    session.add_arguments(parser)
+    payload.add_arguments(parser)
+    recorder.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+    unknown = set(args.modes.split(",")) - set(THROUGHPUT_MODES)
+    if unknown:
+        parser.error(f"unknown mode(s): {', '.join(sorted(unknown))}")
+
+    if args.backend == "gatttool" and os.geteuid() != 0:
         print("Veuillez exécuter le script avec sudo (ex: sudo python3 ble_perf_client_final.py)")
         sys.exit(1)
-        
+
     try:
-        main()
+        with profiling.from_args(args, "[CLIENT]"):
+            asyncio.run(run(args))
     except KeyboardInterrupt:
         print(f"\n[{time.strftime('%H:%M:%S')}] Arrêté par l'utilisateur.")
     except Exception as e:
         print(f"\n[{time.strftime('%H:%M:%S')}] Une erreur fatale est survenue: {e}")
+
+
+if __name__ == "__main__":
+    main()
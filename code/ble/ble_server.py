@@ -1,148 +1,321 @@
 # ble_server.py (Sur raspi-b)
+import argparse
 import os
 import sys
+import threading
 import time
-from pydbus import SystemBus
-from gi.repository import GLib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from btperf import gatt, monitor, profiling
 
 # --- CONFIGURATION ---
-SERVICE_UUID = "12345678-1234-5678-1234-56789abcdef0"
-WRITE_CHAR_UUID = "12345678-1234-5678-1234-56789abcdef1"  # Débit (Write)
-LATENCY_CHAR_UUID = "12345678-1234-5678-1234-56789abcdef2"  # Latence (Write + Notify)
+SERVICE_UUID = gatt.SERVICE_UUID
+WRITE_CHAR_UUID = gatt.WRITE_CHAR_UUID  # Débit (Write / Write Command + Notify pour les ACK)
+LATENCY_CHAR_UUID = gatt.LATENCY_CHAR_UUID  # Latence (Write + Notify)
 ADAPTER_PATH = "/org/bluez/hci0"
 SERVER_NAME = "BLE_SERVER_TEST"
 FILE_PATH = "received_data.bin"
-
-# --- STATE VARIABLES ---
-bytes_received_total = 0
-start_time = 0.0
-is_transferring = False
+APP_PATH = "/org/bluez/btperf"
+SERVICE_PATH = APP_PATH + "/service0"
+ADVERTISEMENT_PATH = APP_PATH + "/advertisement0"
+# Débit échantillonné hors de WriteValue (btperf.monitor) : --rate-interval, ligne console toutes les
+# --rate-display s, échantillons JSON (un par ligne) dans --rate-stream si défini
+# pydbus et GLib (gi) ne sont importés qu'au lancement du serveur (load_dbus) : --help, la CLI
+# (python3 -m btperf) et le mode daemon (btperf.daemon) ne paient pas leur temps d'import
+GLib = None
 
 # =====================================================================
-# D-Bus Interfaces et classes
-# Ces classes sont fournies pour une implémentation pydbus correcte, 
-# mais leur ENREGISTREMENT échoue sur votre système.
-# Nous les gardons pour structurer la logique du serveur.
+# Application GATT exposée à BlueZ (org.bluez.GattManager1) et annonce LE
+# (org.bluez.LEAdvertisingManager1), publiées avec pydbus.
 # =====================================================================
 
 class LatencyCharacteristic:
-    """Caractéristique pour le test de latence (Écho)."""
+    """Caractéristique pour le test de latence : chaque écriture est renvoyée
+    telle quelle par notification (numéro de séquence + horodatage du client)."""
     dbus = """
     <node>
         <interface name="org.bluez.GattCharacteristic1">
             <property name="UUID" type="s" access="read"/>
             <property name="Service" type="o" access="read"/>
             <property name="Flags" type="as" access="read"/>
+            <property name="Value" type="ay" access="read"/>
             <method name="ReadValue">
+                <arg type="a{sv}" name="options" direction="in"/>
                 <arg type="ay" name="value" direction="out"/>
             </method>
             <method name="WriteValue">
                 <arg type="ay" name="value" direction="in"/>
+                <arg type="a{sv}" name="options" direction="in"/>
             </method>
             <method name="StartNotify"/>
             <method name="StopNotify"/>
         </interface>
     </node>
     """
-    
+    PropertiesChanged = None    # signal pydbus, posé par load_dbus()
+
     def __init__(self, bus, path):
         self.bus = bus
         self.path = path
         self.UUID = LATENCY_CHAR_UUID
-        self.Flags = ["write", "notify"] # Écriture pour l'envoi, Notify pour l'écho
-        self.service = self.path[:-5]
+        # Écriture (avec ou sans réponse) pour l'envoi, Notify pour l'écho
+        self.Flags = ["write", "write-without-response", "notify"]
+        self.Service = self.path.rsplit("/", 1)[0]
+        self.Value = b""
+        self.notifying = False
+        self.echoes = 0
+
+    def ReadValue(self, options):
+        return self.Value
+
+    def StartNotify(self):
+        self.notifying = True
+        print(f"[{time.strftime('%H:%M:%S')}] [LATENCY] Notifications activées.")
+
+    def StopNotify(self):
+        self.notifying = False
 
     def WriteValue(self, value, options):
-        """Reçoit un paquet du client et doit renvoyer une notification."""
-        global bytes_received_total
-        
-        # Le paquet de latence est court. Nous allons simuler l'écho.
-        print(f"[{time.strftime('%H:%M:%S')}] [LATENCY] Paquet reçu ({len(value)} bytes). ECHO...")
-        
-        # --- Simuler l'Écho (la notification réelle doit être gérée par l'API BlueZ) ---
-        # Note: L'implémentation de la notification via pydbus est complexe et requiert 
-        # l'enregistrement réussi du service. Ici, nous nous contentons de la réception.
-        
-        # Ici, vous devriez appeler la fonction DBus pour envoyer la notification au client.
-        
-        return 0
+        """Reçoit un paquet du client et le renvoie immédiatement en notification."""
+        self.Value = bytes(value)
+        if self.notifying:
+            # Valeur brute, encodée une seule fois par pydbus (voir WriteCharacteristic.notify)
+            with profiling.phase("syscall"):
+                self.PropertiesChanged("org.bluez.GattCharacteristic1", {"Value": self.Value}, [])
+            self.echoes += 1
+
 
 class WriteCharacteristic:
-    """Caractéristique pour le test de débit (Write)."""
+    """Caractéristique pour le test de débit (Write Request ou Write Command).
+
+    La comptabilité (START/END, numéros de séquence, ACK périodiques) est
+    partagée avec le périphérique simulé : btperf.gatt.StreamReceiver.
+    """
     dbus = """
     <node>
         <interface name="org.bluez.GattCharacteristic1">
             <property name="UUID" type="s" access="read"/>
             <property name="Service" type="o" access="read"/>
             <property name="Flags" type="as" access="read"/>
+            <property name="Value" type="ay" access="read"/>
             <method name="WriteValue">
                 <arg type="ay" name="value" direction="in"/>
+                <arg type="a{sv}" name="options" direction="in"/>
             </method>
+            <method name="StartNotify"/>
+            <method name="StopNotify"/>
         </interface>
     </node>
     """
-    
-    def __init__(self, bus, path):
+    PropertiesChanged = None    # signal pydbus, posé par load_dbus()
+
+    def __init__(self, bus, path, rate=None):
         self.bus = bus
         self.path = path
+        self.rate = rate            # rate(source) -> RateMonitor, None sans échantillonnage
         self.UUID = WRITE_CHAR_UUID
-        self.Flags = ["write"]
-        self.service = self.path[:-5]
+        # write-without-response pour le mode streaming, notify pour les ACK de crédit
+        self.Flags = ["write", "write-without-response", "notify"]
+        self.Service = self.path.rsplit("/", 1)[0]
+        self.Value = b""
+        self.notifying = False
+        self.stream = gatt.StreamReceiver(self.notify)
+        self.monitor = None
+
+    def StartNotify(self):
+        self.notifying = True
+
+    def StopNotify(self):
+        self.notifying = False
+
+    def notify(self, value):
+        """Envoie une notification (ACK de séquence) au client abonné."""
+        if not self.notifying:
+            return
+        self.Value = value
+        # Valeur brute : pydbus l'encode lui-même en GLib.Variant d'après la signature de la propriété
+        with profiling.phase("syscall"):
+            self.PropertiesChanged("org.bluez.GattCharacteristic1", {"Value": value}, [])
 
     def WriteValue(self, value, options):
         """Reçoit les blocs de données du client."""
-        global bytes_received_total, start_time, is_transferring
+        # Décodage et comptabilité ; les ACK notifiés au passage sont comptés en syscall
+        with profiling.phase("encode"):
+            event = self.stream.on_write(value)
 
-        if value == b'START_TRANSFER':
-            bytes_received_total = 0
-            start_time = time.time()
-            is_transferring = True
-            print(f"[{time.strftime('%H:%M:%S')}] [DEBIT] Début du transfert.")
+        if event == "start":
+            mode = f"séquencé, ACK tous les {self.stream.ack_every} chunks" if self.stream.sequenced else "Write Request"
+            print(f"[{time.strftime('%H:%M:%S')}] [DEBIT] Début du transfert ({mode}).")
+            if self.monitor:
+                self.monitor.stop()
+            # Le thread d'échantillonnage lit stream.bytes ; WriteValue ne fait plus aucune sortie
+            self.monitor = self.rate(lambda: self.stream.bytes).start() if self.rate else None
             return
 
-        if value == b'END_TRANSFER':
-            is_transferring = False
-            duration = time.time() - start_time
-            throughput = (bytes_received_total / 1024) / duration if duration > 0 else 0
-            print(f"[{time.strftime('%H:%M:%S')}] [DEBIT] Transfert terminé. Total: {bytes_received_total} bytes.")
+        if event == "end":
+            if self.monitor:
+                self.monitor.stop()
+            duration = self.stream.duration
+            throughput = (self.stream.bytes / 1024) / duration if duration > 0 else 0
+            print(f"[{time.strftime('%H:%M:%S')}] [DEBIT] Transfert terminé. Total: {self.stream.bytes} bytes.")
+            if self.stream.sequenced:
+                print(f"  Chunks reçus: {self.stream.chunks}, manquants: {self.stream.missing}")
             print(f"  Débit serveur: {throughput:.2f} KB/s")
-            
+            if self.monitor:
+                print(f"  Échantillons: {self.monitor.summary()}")
+                self.monitor = None
+
             # Sauvegarde des données reçues (Optionnel)
             # with open(FILE_PATH, 'wb') as f:
             #     f.write(received_data)
-            
+
             return
 
-        # Réception du chunk de données
-        if is_transferring:
-            bytes_received_total += len(value)
-            sys.stdout.write(f"\r[{time.strftime('%H:%M:%S')}] [DEBIT] Reçu: {bytes_received_total / 1024:.2f} KB...")
-            sys.stdout.flush()
+class Service:
+    dbus = """
+    <node>
+        <interface name="org.bluez.GattService1">
+            <property name="UUID" type="s" access="read"/>
+            <property name="Primary" type="b" access="read"/>
+        </interface>
+    </node>
+    """
+
+    def __init__(self, path, characteristics):
+        self.path = path
+        self.UUID = SERVICE_UUID
+        self.Primary = True
+        self.characteristics = characteristics
 
-        return 0
-        
-# Les classes Service et Advertisement sont omises pour la simplification.
+
+class Application:
+    """Racine de l'application GATT : BlueZ lit l'arbre via GetManagedObjects."""
+    dbus = """
+    <node>
+        <interface name="org.freedesktop.DBus.ObjectManager">
+            <method name="GetManagedObjects">
+                <arg type="a{oa{sa{sv}}}" name="objects" direction="out"/>
+            </method>
+        </interface>
+    </node>
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    def GetManagedObjects(self):
+        objects = {
+            self.service.path: {
+                "org.bluez.GattService1": {
+                    "UUID": GLib.Variant("s", self.service.UUID),
+                    "Primary": GLib.Variant("b", self.service.Primary),
+                },
+            },
+        }
+        for char in self.service.characteristics:
+            objects[char.path] = {
+                "org.bluez.GattCharacteristic1": {
+                    "UUID": GLib.Variant("s", char.UUID),
+                    "Service": GLib.Variant("o", char.Service),
+                    "Flags": GLib.Variant("as", char.Flags),
+                },
+            }
+        return objects
+
+
+class Advertisement:
+    dbus = """
+    <node>
+        <interface name="org.bluez.LEAdvertisement1">
+            <property name="Type" type="s" access="read"/>
+            <property name="ServiceUUIDs" type="as" access="read"/>
+            <property name="LocalName" type="s" access="read"/>
+            <method name="Release"/>
+        </interface>
+    </node>
+    """
+
+    def __init__(self):
+        self.Type = "peripheral"
+        self.ServiceUUIDs = [SERVICE_UUID]
+        self.LocalName = SERVER_NAME
+
+    def Release(self):
+        print(f"[{time.strftime('%H:%M:%S')}] [INFO] Annonce libérée par BlueZ.")
 
 # =====================================================================
 
-def main():
-    """Lance la boucle principale du serveur sans enregistrer les services qui échouent."""
-    
-    print("[INFO] Serveur démarré. Le service GATT doit être exposé via le fichier XML.")
-    
-    # Tenter de démarrer la boucle GLib pour écouter les événements D-Bus
-    # C'est la seule partie qui doit rester en vie pour gérer les appels WriteValue
+def load_dbus():
+    """Importe GLib et pydbus au premier appel et crée les signaux PropertiesChanged."""
+    global GLib
+    if GLib is None:
+        from gi.repository import GLib as glib
+        from pydbus.generic import signal
+        LatencyCharacteristic.PropertiesChanged = signal()
+        WriteCharacteristic.PropertiesChanged = signal()
+        GLib = glib
+    return GLib
+
+
+def register(bus, main_loop):
+    """Enregistre l'application GATT et l'annonce auprès de BlueZ.
+
+    BlueZ rappelle GetManagedObjects pendant RegisterApplication : l'appel doit
+    donc partir d'un autre thread que celui de la boucle GLib, sinon les deux
+    s'attendent mutuellement (c'est ce qui faisait échouer l'enregistrement).
+    """
+    try:
+        adapter = bus.get("org.bluez", ADAPTER_PATH)
+        adapter.Powered = True
+        adapter.Alias = SERVER_NAME
+        bus.get("org.bluez", ADAPTER_PATH)["org.bluez.GattManager1"].RegisterApplication(APP_PATH, {})
+        print(f"[{time.strftime('%H:%M:%S')}] [INFO] Application GATT enregistrée ({SERVICE_UUID}).")
+        bus.get("org.bluez", ADAPTER_PATH)["org.bluez.LEAdvertisingManager1"].RegisterAdvertisement(ADVERTISEMENT_PATH, {})
+        print(f"[{time.strftime('%H:%M:%S')}] [INFO] Annonce LE active sous le nom {SERVER_NAME}.")
+    except Exception as e:
+        print(f"[ERROR] Enregistrement BlueZ impossible: {e}")
+        GLib.idle_add(main_loop.quit)
+
+
+def main(argv=None):
+    """Publie le service GATT, lance l'annonce et traite les écritures dans la boucle GLib."""
+    parser = argparse.ArgumentParser(description="Serveur GATT BLE (latence + débit, S3)")
+    monitor.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+    rate = (lambda source: monitor.from_args(args, source, "[DEBIT]")) if args.rate_interval > 0 else None
+    with profiling.from_args(args, "[SERVER]"):
+        serve(rate)
+
+
+def serve(rate=None):
+    load_dbus()
+    from pydbus import SystemBus
+    bus = SystemBus()
+
+    write_char = WriteCharacteristic(bus, SERVICE_PATH + "/char0", rate)
+    latency_char = LatencyCharacteristic(bus, SERVICE_PATH + "/char1")
+    service = Service(SERVICE_PATH, [write_char, latency_char])
+
+    registrations = [
+        bus.register_object(APP_PATH, Application(service), None),
+        bus.register_object(SERVICE_PATH, service, None),
+        bus.register_object(write_char.path, write_char, None),
+        bus.register_object(latency_char.path, latency_char, None),
+        bus.register_object(ADVERTISEMENT_PATH, Advertisement(), None),
+    ]
+
+    main_loop = GLib.MainLoop()
+    threading.Thread(target=register, args=(bus, main_loop), daemon=True).start()
     try:
-        main_loop = GLib.MainLoop()
         print("[INFO] Le script est en écoute. Attente de la connexion du client...")
-        # Laissez l'exécution s'arrêter si une erreur survient, mais essayez de rester en vie
         main_loop.run()
-    except Exception as e:
-        # L'enregistrement D-Bus échoue ici, mais nous ignorons l'erreur
-        print(f"[WARN] Erreur lors du lancement de la boucle GLib: {e}. Le serveur est instable.")
+    except KeyboardInterrupt:
+        print(f"\n[{time.strftime('%H:%M:%S')}] Arrêté par l'utilisateur.")
+    finally:
+        for registration in registrations:
+            registration.unregister()
+        print(f"[{time.strftime('%H:%M:%S')}] Échos de latence envoyés: {latency_char.echoes}")
 
 if __name__ == '__main__':
-    # La logique de gestion des événements D-Bus du WriteValue sera complexe car 
-    # le script n'est pas enregistré formellement.
-    # Nous lançons ce script pour que le système ait un processus Python "actif".
     main()
@@ -0,0 +1 @@
+"""Shared building blocks for the Classic Bluetooth and BLE benchmark scripts."""
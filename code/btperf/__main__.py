@@ -0,0 +1,11 @@
+"""python3 -m btperf COMMAND [options] (see btperf.cli)."""
+import os
+import sys
+
+if not __package__:
+    # Started as `python3 code/btperf`: code/, not the package directory, belongs on the path
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+from btperf import cli
+
+if __name__ == "__main__":
+    sys.exit(cli.main())
@@ -0,0 +1,102 @@
+"""Single entry point for every script: ``python3 -m btperf COMMAND [options]``.
+
+COMMANDS maps a short name to one of the existing scripts, which stay where
+they are (scenario specs and notes point at them) and keep working on their
+own. The script is imported only when its command runs, so one command never
+pays for the imports of the others; the radio backends (bluetooth, pexpect,
+pydbus/GLib) are themselves imported on first use, not at import.
+
+Two commands belong to the CLI itself (btperf.daemon):
+
+    daemon      keep one warm process that imports the scripts once and
+                runs commands sent to it over a unix socket
+    submit      run a command in that daemon, e.g.
+                ``python3 -m btperf submit s1 --transport sim``
+
+From outside code/, ``python3 code/btperf COMMAND`` works too.
+"""
+import importlib
+import os
+import sys
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# name -> script (relative to code/), description
+COMMANDS = {
+    "s1": ("classic/bluetooth_classic_client.py", "S1 random payload client"),
+    "echo": ("classic/bluetooth_client.py", "RTT / throughput echo client"),
+    "echo-server": ("classic/bluetooth_server.py", "echo server"),
+    "file": ("classic/bluetooth_client_file.py", "S2 file transfer client"),
+    "file-server": ("classic/bluetooth_server_file.py", "S1/S2 receiving server"),
+    "ble": ("ble/ble_client_latency_throughput.py", "S3 BLE latency + throughput client"),
+    "ble-server": ("ble/ble_server.py", "S3 GATT server (BlueZ)"),
+    "experiments": ("run_experiments.py", "scenario orchestrator"),
+    "analysis": ("run_analysis.py", "summary tables and figures"),
+    "benchmarks": ("run_benchmarks.py", "harness benchmarks, startup time"),
+    "load": ("run_load.py", "multi-process load generator"),
+}
+BUILTINS = {
+    "daemon": "warm worker process serving commands over a unix socket",
+    "submit": "run a command in the daemon",
+}
+
+
+def usage():
+    lines = ["usage: btperf COMMAND [options]    (btperf COMMAND --help for the options)", "", "commands:"]
+    for name, (script, description) in COMMANDS.items():
+        lines.append(f"  {name:<13}{description} ({script})")
+    for name, description in BUILTINS.items():
+        lines.append(f"  {name:<13}{description}")
+    return "\n".join(lines)
+
+
+def command_for(script):
+    """Command name of a script path relative to code/ (as in a scenario spec), None if it has none."""
+    script = os.path.normpath(script)
+    return next((name for name, (path, _) in COMMANDS.items() if os.path.normpath(path) == script), None)
+
+
+def load(command):
+    """Import the script module of `command` (once per process) and return it."""
+    directory, filename = os.path.split(os.path.join(CODE_DIR, COMMANDS[command][0]))
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    return importlib.import_module(os.path.splitext(filename)[0])
+
+
+def exit_status(code):
+    """Exit status for a SystemExit code, printing a message code the way the interpreter would."""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def run(command, argv):
+    """Run `command` with `argv` in this process; returns its exit status."""
+    module = load(command)
+    saved = sys.argv
+    sys.argv = [f"btperf {command}"] + list(argv)      # argparse takes its prog name from argv[0]
+    try:
+        module.main(list(argv))
+    except SystemExit as e:
+        return exit_status(e.code)
+    finally:
+        sys.argv = saved
+    return 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return 0
+    command, *rest = argv
+    if command in BUILTINS:
+        from btperf import daemon
+        return daemon.main(command, rest)
+    if command not in COMMANDS:
+        print(f"btperf: unknown command '{command}'\n\n{usage()}", file=sys.stderr)
+        return 2
+    return run(command, rest)
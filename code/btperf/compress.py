@@ -0,0 +1,228 @@
+"""Optional streaming compression between the file reader and the socket (S2).
+
+Text shrinks several-fold while JPG/MP3/MP4 are already compressed; on a link
+carrying tens of KB/s every byte saved is time saved, but CPU spent on
+incompressible data is wasted. A codec spec is "none", "auto" or
+"name[:level]":
+
+    zlib   levels 0-9 (stdlib)
+    lzma   presets 0-9 (stdlib)
+    zstd   levels 1-22, needs the `zstandard` package
+    lz4    levels 0-16, needs the `lz4` package
+
+"auto" compresses the first SAMPLE_BLOCKS blocks of a file with the first
+available of AUTO_CODECS and keeps compression only when the sample shrinks
+to AUTO_RATIO of its size or less; the decision is remembered per file type
+(extension) for the rest of the run.
+
+On the wire the compressed stream is cut into frames (btperf.framing.BLOCK
+length prefix, a zero-length frame ends it). Header size, CRC-32 and ACK
+count stay in original bytes, so a compressed transfer is acknowledged like
+a plain one. Decompressing wraps the server's socket so that the receive
+engine (btperf.receiver) stores the decompressed bytes unchanged.
+"""
+import importlib
+import lzma
+import os
+import time
+import zlib
+
+from btperf import framing
+
+BLOCK_SIZE = 64 * 1024      # original bytes handed to the compressor at once
+SAMPLE_BLOCKS = 4           # blocks compressed by "auto" to decide
+AUTO_RATIO = 0.9            # "auto" compresses when the sample shrinks at least this much
+AUTO_CODECS = ("zstd:3", "zlib:6")
+DEFAULT_LEVELS = {"zlib": 6, "lzma": 6, "zstd": 3, "lz4": 0}
+
+
+# --- backends: (compress, flush) and (decompress, flush) callables ---
+
+def _zlib_compressor(level):
+    c = zlib.compressobj(level)
+    return c.compress, c.flush
+
+
+def _zlib_decompressor():
+    d = zlib.decompressobj()
+    return d.decompress, d.flush
+
+
+def _lzma_compressor(level):
+    c = lzma.LZMACompressor(preset=level)
+    return c.compress, c.flush
+
+
+def _lzma_decompressor():
+    return lzma.LZMADecompressor().decompress, bytes
+
+
+def _zstd_compressor(level):
+    import zstandard
+    c = zstandard.ZstdCompressor(level=level).compressobj()
+    return c.compress, c.flush
+
+
+def _zstd_decompressor():
+    import zstandard
+    return zstandard.ZstdDecompressor().decompressobj().decompress, bytes
+
+
+def _lz4_compressor(level):
+    import lz4.frame
+    c = lz4.frame.LZ4FrameCompressor(compression_level=level)
+    begin = [c.begin()]     # frame header goes out with the first output
+
+    def compress(data):
+        return (begin.pop() if begin else b"") + c.compress(data)
+
+    return compress, lambda: (begin.pop() if begin else b"") + c.flush()
+
+
+def _lz4_decompressor():
+    import lz4.frame
+    return lz4.frame.LZ4FrameDecompressor().decompress, bytes
+
+
+# name -> (compressor(level), decompressor(), module needed or None)
+BACKENDS = {
+    "zlib": (_zlib_compressor, _zlib_decompressor, None),
+    "lzma": (_lzma_compressor, _lzma_decompressor, None),
+    "zstd": (_zstd_compressor, _zstd_decompressor, "zstandard"),
+    "lz4": (_lz4_compressor, _lz4_decompressor, "lz4.frame"),
+}
+
+
+def available(name):
+    module = BACKENDS[name][2]
+    if module is None:
+        return True
+    try:
+        importlib.import_module(module)
+    except ImportError:
+        return False
+    return True
+
+
+class Codec:
+    def __init__(self, name, level=None):
+        self.name = name
+        self.level = DEFAULT_LEVELS[name] if level is None else level
+
+    def __str__(self):
+        return f"{self.name}:{self.level}"
+
+    def compressor(self):
+        return BACKENDS[self.name][0](self.level)
+
+    def decompressor(self):
+        return BACKENDS[self.name][1]()
+
+
+def parse(spec):
+    """Codec for "name[:level]", None for "none"; ValueError for unknown or uninstalled codecs."""
+    if not spec or spec == "none":
+        return None
+    name, _, level = spec.partition(":")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown codec '{name}' (expected none, auto or one of {', '.join(BACKENDS)})")
+    if not available(name):
+        raise ValueError(f"Codec '{name}' needs the {BACKENDS[name][2].split('.')[0]} package")
+    return Codec(name, int(level) if level else None)
+
+
+def ratio(data, codec):
+    """Compressed size / original size of `data` with `codec`."""
+    if not len(data):
+        return 1.0
+    compress, flush = codec.compressor()
+    return (len(compress(data)) + len(flush())) / len(data)
+
+
+class Selector:
+    """Codec of every file to send: a fixed one, or ("auto") one decided by sampling, once per file type."""
+
+    def __init__(self, spec="none", threshold=AUTO_RATIO, sample=SAMPLE_BLOCKS * BLOCK_SIZE):
+        self.auto = spec == "auto"
+        if self.auto:
+            spec = next(s for s in AUTO_CODECS if available(s.partition(":")[0]))
+        self.codec = parse(spec)
+        self.threshold = threshold
+        self.sample = sample
+        self.decisions = {}
+
+    def codec_for(self, path):
+        if not self.auto:
+            return self.codec
+        file_type = os.path.splitext(path)[1].lstrip(".").upper() or "?"
+        if file_type not in self.decisions:
+            with open(path, "rb") as f:
+                head = f.read(self.sample)
+            if not head:
+                return None     # nothing to judge the file type by
+            sampled = ratio(head, self.codec)
+            self.decisions[file_type] = self.codec if sampled <= self.threshold else None
+            print(f"[CLIENT] Compression for {file_type}: {self.decisions[file_type] or 'none'} "
+                  f"(sample ratio {sampled:.2f} with {self.codec})")
+        return self.decisions[file_type]
+
+
+class Decompressing:
+    """Socket stand-in whose recv_into() yields the decompressed payload of a compressed transfer.
+
+    `wire` counts the bytes actually received, `cpu_time` the time spent decompressing.
+    """
+
+    def __init__(self, sock, name):
+        try:
+            codec = parse(name)
+        except ValueError as e:
+            raise framing.ProtocolError(str(e))
+        self.sock = sock
+        self.codec = codec
+        self._decompress, self._flush = codec.decompressor()
+        self._pending = memoryview(b"")
+        self.done = False
+        self.wire = 0
+        self.cpu_time = 0.0
+
+    def recv_into(self, view, nbytes=0):
+        while not self._pending:
+            if self.done or not self._next_frame():
+                return 0
+        n = min(nbytes or len(view), len(self._pending))
+        view[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def _next_frame(self):
+        """Decompress the next frame into the pending output; False when the connection closed."""
+        try:
+            (length,) = framing.BLOCK.unpack(framing.recv_exact(self.sock, framing.BLOCK.size))
+            data = framing.recv_exact(self.sock, length) if length else b""
+        except framing.ProtocolError:
+            return False
+        self.wire += framing.BLOCK.size + length
+        t = time.perf_counter()
+        self._pending = memoryview(self._decompress(data) if length else self._flush())
+        self.cpu_time += time.perf_counter() - t
+        self.done = not length
+        return True
+
+    def finish(self):
+        """Read up to the end frame once the announced size has been received."""
+        while not self.done:
+            if not self._next_frame():
+                raise framing.ProtocolError("connection closed inside the compressed stream")
+            if self._pending:
+                raise framing.ProtocolError("compressed stream longer than the announced size")
+
+
+def add_arguments(parser):
+    """Register --compress on a parser."""
+    # Listed statically: available() would import zstandard/lz4 at every start; parse() checks them
+    optional = ", ".join(f"{n} needs {m.split('.')[0]}" for n, (_, _, m) in BACKENDS.items() if m)
+    parser.add_argument("--compress", default="none",
+                        help="none, auto (sample each file type) or codec[:level] among "
+                             f"{', '.join(BACKENDS)} ({optional}; default: %(default)s)")
+    return parser
@@ -0,0 +1,265 @@
+"""Warm worker: one long-lived process runs btperf commands sent over a unix socket.
+
+A new interpreter per repetition pays for its own startup every time: the
+interpreter itself, then argparse, the btperf modules and whatever the script
+imports. `python3 -m btperf daemon` pays it once, importing every script of
+btperf.cli.COMMANDS up front (those whose optional dependencies are missing
+are skipped and fail only when run), and then runs each request in-process
+with btperf.cli.run(). `python3 -m btperf submit COMMAND [options]` or
+submit() sends one.
+
+Protocol: one connection per run, JSON lines both ways:
+
+    client -> daemon    {"argv": ["s1", "--transport", "sim"], "cwd": "/abs/dir"}
+                        {"stop": true}      shut the daemon down
+    daemon -> client    {"out": text} and {"err": text}, as the command writes
+                        {"exit": status, "elapsed_s": seconds}, last
+
+Requests are served one at a time: a run changes the working directory,
+sys.stdout/sys.stderr and module globals, which belong to the whole process.
+A client that goes away does not stop its run; the output is dropped.
+In-process sim peers still serving when a run returns are shut down then
+(btperf.transport.stop_peers).
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from btperf import cli, transport
+
+SOCKET_PATH = os.path.join(tempfile.gettempdir(), "btperf-daemon.sock")
+
+
+class _Channel:
+    """JSON lines to the client, shared by the stdout/stderr streams and their threads."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.open = True
+
+    def send(self, message):
+        data = (json.dumps(message) + "\n").encode()
+        with self.lock:
+            if not self.open:
+                return
+            try:
+                self.conn.sendall(data)
+            except OSError:
+                self.open = False       # client gone: the run goes on, its output is dropped
+
+
+class _Stream(io.TextIOBase):
+    """sys.stdout/sys.stderr of a run: text sent per line (or console redraw), not per write() call.
+
+    The run's own threads (rate monitor, stripes, sim peers) write at the same time as its main thread.
+    """
+
+    def __init__(self, channel, key):
+        self.channel = channel
+        self.key = key
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        with self.lock:
+            self.pending.append(text)
+            if "\n" in text or "\r" in text:
+                self._send()
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            self._send()
+
+    def _send(self):
+        if self.pending:
+            text, self.pending = "".join(self.pending), []
+            self.channel.send({self.key: text})
+
+
+def preload():
+    """Import every command's script now; returns the commands that could not be imported, with the reason."""
+    skipped = {}
+    for command in cli.COMMANDS:
+        try:
+            cli.load(command)
+        except ImportError as e:
+            skipped[command] = str(e)
+    return skipped
+
+
+def handle(conn):
+    """Serve one request on `conn`; False when it asked the daemon to stop."""
+    with conn.makefile("rb") as rfile:
+        request = json.loads(rfile.readline() or b"{}")
+    channel = _Channel(conn)
+    if request.get("stop") or "argv" not in request:
+        channel.send({"exit": 0 if request.get("stop") else 2, "elapsed_s": 0.0})
+        return not request.get("stop")
+    command, *argv = request["argv"]
+    out, err = _Stream(channel, "out"), _Stream(channel, "err")
+    previous = os.getcwd()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                os.chdir(request.get("cwd") or previous)
+                if command in cli.COMMANDS:
+                    status = cli.run(command, argv)
+                else:
+                    print(f"btperf: unknown command '{command}' (the daemon runs {', '.join(cli.COMMANDS)})",
+                          file=sys.stderr)
+                    status = 2
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            finally:
+                # Sim peers left serving (e.g. sessions=0 with --retries) end with their run
+                lingering = transport.stop_peers()
+                out.flush()
+                err.flush()
+    finally:
+        os.chdir(previous)
+    for thread in lingering:
+        print(f"[DAEMON] Warning: peer thread {thread.name} still running after the run", flush=True)
+    elapsed = time.perf_counter() - start
+    channel.send({"exit": status, "elapsed_s": elapsed})
+    print(f"[DAEMON] {' '.join(request['argv'])}: exit {status} in {elapsed:.2f}s", flush=True)
+    return True
+
+
+def listening(path):
+    """Whether a daemon accepts connections on `path`."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+            return True
+        except OSError:
+            return False
+
+
+def serve(path=SOCKET_PATH, warm=True):
+    """Accept and run requests on the unix socket `path` until a stop request or Ctrl-C."""
+    if warm:
+        start = time.perf_counter()
+        skipped = preload()
+        print(f"[DAEMON] {len(cli.COMMANDS) - len(skipped)} command(s) imported in "
+              f"{(time.perf_counter() - start) * 1e3:.0f} ms")
+        for command, reason in skipped.items():
+            print(f"[DAEMON] {command} not preloaded: {reason}")
+    if os.path.exists(path):
+        if listening(path):
+            raise RuntimeError(f"a daemon is already listening on {path}")
+        os.remove(path)         # left over by a killed daemon
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    print(f"[DAEMON] Listening on {path} (pid {os.getpid()})", flush=True)
+    try:
+        running = True
+        while running:
+            conn, _ = server.accept()
+            with conn:
+                running = handle(conn)
+    except KeyboardInterrupt:
+        print("\n[DAEMON] Interrupted.")
+    finally:
+        server.close()
+        os.remove(path)
+    print("[DAEMON] Stopped.")
+
+
+def _messages(sock, deadline):
+    buffer = b""
+    while True:
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("the daemon run timed out")
+            sock.settimeout(remaining)
+        data = sock.recv(65536)
+        if not data:
+            return
+        *lines, buffer = (buffer + data).split(b"\n")
+        for line in lines:
+            yield json.loads(line)
+
+
+def request(message, path=SOCKET_PATH, stdout=None, stderr=None, timeout=None):
+    """Send one request to the daemon at `path`, copy the run's output as it comes; returns the exit status.
+
+    FileNotFoundError / ConnectionRefusedError when no daemon is listening, TimeoutError after `timeout`
+    seconds (the daemon still finishes the run).
+    """
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall((json.dumps(message) + "\n").encode())
+        for reply in _messages(sock, deadline):
+            if "out" in reply:
+                stdout.write(reply["out"])
+                stdout.flush()
+            elif "err" in reply:
+                stderr.write(reply["err"])
+                stderr.flush()
+            elif "exit" in reply:
+                return reply["exit"]
+    raise ConnectionError("the daemon closed the connection before the run ended")
+
+
+def submit(argv, path=SOCKET_PATH, cwd=None, stdout=None, stderr=None, timeout=None):
+    """Run a command (["s1", "--transport", "sim", ...]) in the daemon, from `cwd`; returns its exit status."""
+    return request({"argv": list(argv), "cwd": os.path.abspath(cwd or os.getcwd())}, path, stdout, stderr, timeout)
+
+
+def stop(path=SOCKET_PATH):
+    request({"stop": True}, path)
+
+
+def main(command, argv):
+    """The `daemon` and `submit` commands of btperf.cli."""
+    parser = argparse.ArgumentParser(prog=f"btperf {command}", description=cli.BUILTINS[command])
+    parser.add_argument("--socket", default=SOCKET_PATH, help="unix socket of the daemon (default: %(default)s)")
+    if command == "daemon":
+        parser.add_argument("--no-preload", action="store_true",
+                            help="import each script on its first run instead of at startup")
+        args = parser.parse_args(argv)
+        try:
+            serve(args.socket, not args.no_preload)
+        except RuntimeError as e:
+            parser.error(str(e))
+        return 0
+
+    parser.add_argument("--stop", action="store_true", help="shut the daemon down")
+    parser.add_argument("--timeout", type=float, default=None, help="give up waiting after this many seconds")
+    parser.add_argument("argv", nargs=argparse.REMAINDER, metavar="COMMAND [options]",
+                        help=f"one of {', '.join(cli.COMMANDS)} and its options")
+    args = parser.parse_args(argv)
+    if not args.stop and not args.argv:
+        parser.error("a command is required (or --stop)")
+    try:
+        if args.stop:
+            stop(args.socket)
+            return 0
+        return submit(args.argv, args.socket, timeout=args.timeout)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"btperf submit: no daemon listening on {args.socket} (start one with: python3 -m btperf daemon)",
+              file=sys.stderr)
+        return 1
+    except TimeoutError as e:
+        print(f"btperf submit: {e}", file=sys.stderr)
+        return 1
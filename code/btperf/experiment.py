@@ -0,0 +1,305 @@
+"""Experiment orchestration: expand scenario specs and run them resumably.
+
+A spec (JSON) lists scenarios; each drives one of the existing client
+scripts and never measures anything itself::
+
+    {
+      "output": "results",
+      "repetitions": 5, "warmup": 1, "cooldown": 2.0, "parallel": 1,
+      "scenarios": {
+        "s1_random": {
+          "script": "classic/bluetooth_classic_client.py",
+          "args": {"transport": "rfcomm", "chunk-size": 1024},
+          "matrix": {"total-bytes": [1000000]},
+          "conditions": {"distance": [1, 3, 5, 7, 10]},
+          "server": null
+        }
+      }
+    }
+
+`args` and `matrix` are command-line options of the script (`true` = bare
+flag, lists = several values); the cross product of `matrix` and
+`conditions` gives the cells. Conditions are not passed to the script:
+they label the results and, when they need a person (moving a device,
+switching a Wi-Fi load on), `manual` lists them so the run pauses once per
+change. Top-level settings can be overridden per scenario.
+
+Each cell runs `warmup` discarded repetitions, then `repetitions` measured
+ones, `cooldown` seconds apart; every run gets its own --log-dir and stdout
+log under <output>/<scenario>/<cell>/ and one line in <output>/runs.jsonl.
+Finished repetitions are checkpointed in <output>/checkpoint.json, so a
+crashed campaign restarts where it stopped. Cells that need different
+resources (adapters, stand-in channels, in-process links) run in parallel,
+up to `parallel` at a time; cells sharing a resource are serialized.
+
+With a `daemon` socket (run_experiments.py --daemon), client runs are sent
+to a warm btperf.daemon instead of a new interpreter each; the daemon runs
+them one at a time. Stand-in servers still get their own process.
+"""
+import itertools
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from btperf import cli, daemon, transport
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULTS = {
+    "output": "results",
+    "repetitions": 5,
+    "warmup": 1,
+    "cooldown": 2.0,
+    "parallel": 1,
+    "timeout": 600,
+    "manual": [],
+}
+SERVER_STARTUP = 1.0    # seconds given to a stand-in server before the first client run
+CHECKPOINT = "checkpoint.json"
+RUNS = "runs.jsonl"
+
+
+class Cell:
+    def __init__(self, scenario, settings, params, conditions):
+        self.scenario = scenario
+        self.settings = settings
+        self.params = params
+        self.conditions = conditions
+        label = "_".join(f"{k}-{v}" for k, v in {**conditions, **params}.items()) or "default"
+        self.id = f"{scenario}/{re.sub(r'[^A-Za-z0-9.=_-]+', '-', label)}"
+
+    @property
+    def options(self):
+        return {**self.settings.get("args", {}), **self.params}
+
+    @property
+    def resource(self):
+        """Cells with equal resources must not run at the same time (None = independent)."""
+        if "resource" in self.settings:
+            return self.settings["resource"]
+        spec = self.options.get("transport", transport.DEFAULT_TRANSPORT)
+        if "backend" in self.options:
+            return None if self.options["backend"] == "mock" else "hci0"
+        if transport.in_process(spec):
+            return None
+        kind, _ = transport.parse_spec(spec)
+        return "hci0" if kind == "rfcomm" else f"{kind}:{self.options.get('channel', '')}"
+
+    def command(self, log_dir):
+        return ([sys.executable, os.path.join(CODE_DIR, self.settings["script"])]
+                + to_argv(self.options) + ["--log-dir", log_dir])
+
+    def daemon_argv(self, log_dir):
+        """The run as a btperf.cli command line, for btperf.daemon.submit()."""
+        command = cli.command_for(self.settings["script"])
+        if command is None:
+            raise ValueError(f"{self.settings['script']} has no btperf command, it cannot run in the daemon")
+        return [command] + to_argv(self.options) + ["--log-dir", log_dir]
+
+    def server_command(self):
+        server = self.settings.get("server")
+        if not server:
+            return None
+        return [sys.executable, os.path.join(CODE_DIR, server["script"])] + to_argv(server.get("args", {}))
+
+
+def to_argv(options):
+    argv = []
+    for key, value in options.items():
+        if value is None or value is False:
+            continue
+        flag = f"--{key}"
+        if value is True:
+            argv.append(flag)
+        elif isinstance(value, (list, tuple)):
+            argv += [flag] + [str(v) for v in value]
+        else:
+            argv += [flag, str(value)]
+    return argv
+
+
+def load_spec(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def expand(spec, only=None):
+    """Cells of every selected scenario, manual conditions varying slowest."""
+    cells = []
+    for name, scenario in spec["scenarios"].items():
+        if only and name not in only:
+            continue
+        settings = {**DEFAULTS, **{k: v for k, v in spec.items() if k != "scenarios"}, **scenario}
+        conditions = settings.get("conditions", {})
+        matrix = settings.get("matrix", {})
+        manual = [k for k in settings["manual"] if k in conditions]
+        ordered = manual + [k for k in conditions if k not in manual]
+        for cond_values in itertools.product(*(conditions[k] for k in ordered)):
+            cond = dict(zip(ordered, cond_values))
+            for values in itertools.product(*matrix.values()):
+                cells.append(Cell(name, settings, dict(zip(matrix, values)), cond))
+    return cells
+
+
+class Checkpoint:
+    """Completed repetitions per cell, rewritten atomically after every run."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done = {cell: set(reps) for cell, reps in json.load(f).items()}
+
+    def completed(self, cell_id):
+        return self.done.get(cell_id, set())
+
+    def mark(self, cell_id, rep):
+        with self.lock:
+            self.done.setdefault(cell_id, set()).add(rep)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({cell: sorted(reps) for cell, reps in self.done.items()}, f, indent=1)
+            os.replace(tmp, self.path)
+
+
+class Runner:
+    def __init__(self, spec, only=None, dry_run=False, assume_yes=False, parallel=None, daemon_socket=None):
+        self.spec = spec
+        self.cells = expand(spec, only)
+        self.daemon_socket = daemon_socket
+        missing = sorted({c.settings["script"] for c in self.cells if cli.command_for(c.settings["script"]) is None})
+        if daemon_socket and missing:
+            raise ValueError(f"no btperf command for {', '.join(missing)}, they cannot run in the daemon")
+        self.output = spec.get("output", DEFAULTS["output"])
+        self.dry_run = dry_run
+        self.assume_yes = assume_yes
+        self.parallel = parallel or spec.get("parallel", DEFAULTS["parallel"])
+        self.checkpoint = Checkpoint(os.path.join(self.output, CHECKPOINT))
+        self._resource_locks = {}
+        self._log_lock = threading.Lock()
+
+    def _lock_for(self, resource):
+        if resource is None:
+            return None
+        return self._resource_locks.setdefault(resource, threading.Lock())
+
+    def pending(self, cell):
+        reps = range(cell.settings["repetitions"])
+        return [r for r in reps if r not in self.checkpoint.completed(cell.id)]
+
+    def run(self):
+        if self.daemon_socket and not self.dry_run and not daemon.listening(self.daemon_socket):
+            raise RuntimeError(f"no daemon listening on {self.daemon_socket} "
+                               f"(start one with: python3 -m btperf daemon)")
+        os.makedirs(self.output, exist_ok=True)
+        todo = [c for c in self.cells if self.pending(c)]
+        print(f"[ORCH] {len(self.cells)} cells, {len(todo)} with repetitions left, "
+              f"up to {self.parallel} in parallel")
+        # Cells sharing the values of their manual conditions form one batch, whatever their scenario: sorted
+        # (stably) by those values, each physical setup is prompted once and the first manual condition once
+        # per value
+        todo.sort(key=self._manual_order)
+        for key, batch in itertools.groupby(todo, key=self._manual_key):
+            batch = list(batch)
+            if key and not self.dry_run:
+                self._prompt(dict(key))
+            with ThreadPoolExecutor(max_workers=self.parallel) as pool:
+                for future in [pool.submit(self.run_cell, cell) for cell in batch]:
+                    future.result()
+        print(f"[ORCH] Done. Results in {self.output}/")
+
+    @staticmethod
+    def _manual_key(cell):
+        return tuple((k, cell.conditions[k]) for k in cell.settings["manual"] if k in cell.conditions)
+
+    @classmethod
+    def _manual_order(cls, cell):
+        # Strings and numbers never compared with each other
+        return tuple((k, isinstance(v, str), v) for k, v in cls._manual_key(cell))
+
+    def _prompt(self, conditions):
+        setup = ", ".join(f"{k}={v}" for k, v in conditions.items())
+        if self.assume_yes:
+            print(f"[ORCH] Conditions: {setup}")
+            return
+        input(f"[ORCH] Set up {setup} and press Enter to continue...")
+
+    def run_cell(self, cell):
+        lock = self._lock_for(cell.resource)
+        if lock:
+            lock.acquire()
+        try:
+            self._run_cell(cell)
+        finally:
+            if lock:
+                lock.release()
+
+    def _run_cell(self, cell):
+        reps = self.pending(cell)
+        cell_dir = os.path.join(self.output, cell.id)
+        server = self._start_server(cell, cell_dir)
+        try:
+            # Warm-up runs again whenever a cell (re)starts: link and caches are cold
+            plan = [("warmup", i) for i in range(cell.settings["warmup"])] + [("rep", r) for r in reps]
+            for n, (kind, index) in enumerate(plan):
+                if n and not self.dry_run:
+                    time.sleep(cell.settings["cooldown"])
+                self._run_once(cell, cell_dir, kind, index)
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+    def _start_server(self, cell, cell_dir):
+        command = cell.server_command()
+        if not command:
+            return None
+        if self.dry_run:
+            print(f"[ORCH] {cell.id}: server {shlex.join(command)}")
+            return None
+        os.makedirs(cell_dir, exist_ok=True)
+        log = open(os.path.join(cell_dir, "server.log"), "a")
+        server = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=cell_dir)
+        log.close()
+        time.sleep(SERVER_STARTUP)
+        return server
+
+    def _run_once(self, cell, cell_dir, kind, index):
+        name = f"{kind}{index}"
+        run_dir = os.path.join(cell_dir, name)
+        command = cell.daemon_argv(run_dir) if self.daemon_socket else cell.command(run_dir)
+        if self.dry_run:
+            print(f"[ORCH] {cell.id} {name}: {'daemon ' if self.daemon_socket else ''}{shlex.join(command)}")
+            return
+        os.makedirs(run_dir, exist_ok=True)
+        start = time.time()
+        with open(os.path.join(run_dir, "stdout.log"), "w") as out:
+            try:
+                if self.daemon_socket:
+                    returncode = daemon.submit(command, self.daemon_socket, run_dir, out, out,
+                                               cell.settings["timeout"])
+                else:
+                    result = subprocess.run(command, stdout=out, stderr=subprocess.STDOUT, cwd=run_dir,
+                                            timeout=cell.settings["timeout"])
+                    returncode = result.returncode
+            except (subprocess.TimeoutExpired, TimeoutError):
+                returncode = None
+        duration = time.time() - start
+        status = "ok" if returncode == 0 else ("timeout" if returncode is None else f"exit {returncode}")
+        print(f"[ORCH] {cell.id} {name}: {status} in {duration:.1f}s")
+        record = {"scenario": cell.scenario, "cell": cell.id, "kind": kind, "index": index,
+                  "params": cell.params, "conditions": cell.conditions, "script": cell.settings["script"],
+                  "returncode": returncode, "start": start, "duration": duration,
+                  "dir": os.path.relpath(run_dir, self.output)}
+        with self._log_lock, open(os.path.join(self.output, RUNS), "a") as f:
+            f.write(json.dumps(record) + "\n")
+        # Failed repetitions are not checkpointed: a resume runs them again
+        if kind == "rep" and returncode == 0:
+            self.checkpoint.mark(cell.id, index)
@@ -0,0 +1,265 @@
+"""Lightweight framing for classic file/payload transfers.
+
+    client -> server   HEADER  magic "BTPF", version, flags, payload size, name length
+                       name    UTF-8 file name (may be empty)
+                       payload exactly `size` bytes
+                       TRAILER magic "BTPE", CRC-32 of the payload
+    server -> client   ACK     magic "BTPA", status, bytes received, server CRC-32,
+                               server time of first and last payload byte
+
+Both sides update the CRC-32 incrementally over the chunks they already hold
+in memory, so there is no separate hashing pass. The client stops its timer
+on the ACK, which makes durations end-to-end rather than "last send()
+returned", and a transfer only counts when the server confirms every byte.
+
+A server reading a stream that does not start with the header magic treats it
+as a legacy unframed transfer.
+
+Several transfers (trials) can share one connection: a header with
+FLAG_SESSION tells the server to read the next header after its ACK, and the
+client closes the session with a BYE record once its last trial is
+acknowledged. Each trial is still bounded by its own header and ACK, so
+connection setup never falls inside a trial's timer.
+
+A striped transfer sends one file as contiguous ranges over several
+connections at once: each range is an ordinary header/payload/trailer/ACK
+exchange whose header has FLAG_STRIPE and is followed by a STRIPE record
+(transfer id, offset, file size, stripe count), so the server can place the
+bytes and knows when every range of the file has arrived. Stripe k listens on
+channel + k, or under the SDP name stripe_service(k) on rfcomm.
+
+A compressed transfer (btperf.compress) has FLAG_COMPRESSED and a CODEC record
+(name length, codec name) after the header (and stripe record); its payload
+is a sequence of BLOCK frames (length, compressed bytes) ended by a
+zero-length frame. Size, CRC-32 and the ACK count remain in original bytes.
+
+Resumable transfers (btperf.resume) start with a QUERY (transfer id, file
+size, chunk size, name) answered by MISSING (the ranges the server has not
+verified yet). Each missing range is then sent as a header with
+FLAG_RESUME, a RESUME record (transfer id, offset, file size, chunk size)
+and a payload of chunks, each followed by its own CHUNK_CRC, so the server
+can keep every intact chunk of a range cut short by a dropped link.
+"""
+import struct
+import time
+import zlib
+
+MAGIC_HEADER = b"BTPF"
+MAGIC_TRAILER = b"BTPE"
+MAGIC_ACK = b"BTPA"
+MAGIC_BYE = b"BTPQ"
+MAGIC_QUERY = b"BTPR"
+MAGIC_MISSING = b"BTPM"
+VERSION = 1
+SERVICE_NAME = "BTFileServer"    # SDP name advertised by bluetooth_server_file.py
+
+FLAG_CHECKSUM = 0x01
+FLAG_SESSION = 0x02     # another header (or BYE) follows the ACK on this connection
+FLAG_STRIPE = 0x04      # a STRIPE record follows the header
+FLAG_COMPRESSED = 0x08  # a CODEC record follows; the payload is BLOCK frames
+FLAG_RESUME = 0x10      # a RESUME record follows; the payload is chunks + CHUNK_CRC
+
+HEADER = struct.Struct("!4sBBQH")
+TRAILER = struct.Struct("!4sI")
+ACK = struct.Struct("!4sBQIdd")
+STRIPE = struct.Struct("!QQQH")
+CODEC = struct.Struct("!B")
+BLOCK = struct.Struct("!I")
+RESUME = struct.Struct("!QQQI")
+CHUNK_CRC = struct.Struct("!I")
+QUERY = struct.Struct("!4sQQIH")
+MISSING = struct.Struct("!4sI")
+RANGE = struct.Struct("!QQ")
+
+STATUS_OK = 0
+STATUS_SHORT = 1
+STATUS_CHECKSUM = 2
+STATUS_TEXT = {STATUS_OK: "ok", STATUS_SHORT: "short transfer", STATUS_CHECKSUM: "checksum mismatch"}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Stripe:
+    def __init__(self, transfer_id, offset, total, count):
+        self.transfer_id = transfer_id
+        self.offset = offset
+        self.total = total
+        self.count = count
+
+    def pack(self):
+        return STRIPE.pack(self.transfer_id, self.offset, self.total, self.count)
+
+
+class Resume:
+    def __init__(self, transfer_id, offset, total, chunk_size):
+        self.transfer_id = transfer_id
+        self.offset = offset
+        self.total = total
+        self.chunk_size = chunk_size
+
+    def pack(self):
+        return RESUME.pack(self.transfer_id, self.offset, self.total, self.chunk_size)
+
+
+class Header:
+    def __init__(self, size, name="", flags=FLAG_CHECKSUM, stripe=None, codec=None, resume=None):
+        self.size = size
+        self.name = name
+        self.flags = (flags | (FLAG_STRIPE if stripe else 0) | (FLAG_COMPRESSED if codec else 0)
+                      | (FLAG_RESUME if resume else 0))
+        self.stripe = stripe
+        self.codec = codec      # codec name (btperf.compress), None = plain payload
+        self.resume = resume
+
+    def pack(self):
+        name = self.name.encode("utf-8")
+        record = HEADER.pack(MAGIC_HEADER, VERSION, self.flags, self.size, len(name)) + name
+        if self.stripe:
+            record += self.stripe.pack()
+        if self.resume:
+            record += self.resume.pack()
+        if self.codec:
+            codec = self.codec.encode("ascii")
+            record += CODEC.pack(len(codec)) + codec
+        return record
+
+
+class Ack:
+    def __init__(self, status, received, crc, t_first, t_last):
+        self.status = status
+        self.received = received
+        self.crc = crc
+        self.t_first = t_first
+        self.t_last = t_last
+
+    @property
+    def ok(self):
+        return self.status == STATUS_OK
+
+    @property
+    def server_duration(self):
+        return max(self.t_last - self.t_first, 0.0)
+
+    def pack(self):
+        return ACK.pack(MAGIC_ACK, self.status, self.received, self.crc, self.t_first, self.t_last)
+
+
+def stripe_service(index):
+    """SDP service name of stripe `index` (stripe 0 is the ordinary service)."""
+    return SERVICE_NAME if index == 0 else f"{SERVICE_NAME}-{index}"
+
+
+def checksum(data, crc=0):
+    """Fold one more chunk into a running CRC-32."""
+    return zlib.crc32(data, crc)
+
+
+def recv_exact(sock, size):
+    """Read exactly `size` bytes (for the small protocol records)."""
+    buf = bytearray(size)
+    view = memoryview(buf)
+    filled = 0
+    while filled < size:
+        n = sock.recv_into(view[filled:])
+        if not n:
+            raise ProtocolError(f"connection closed after {filled}/{size} bytes of a protocol record")
+        filled += n
+    return bytes(buf)
+
+
+# ---------------------------------------------------------------------------
+# Client side
+# ---------------------------------------------------------------------------
+
+def send_header(sock, size, name="", session=False, stripe=None, codec=None, resume=None):
+    flags = FLAG_CHECKSUM | (FLAG_SESSION if session else 0)
+    sock.sendall(Header(size, name, flags, stripe, codec, resume).pack())
+
+
+def query_missing(sock, transfer_id, total, chunk_size, name=""):
+    """Ask a server which (offset, length) ranges of a resumable transfer it still lacks."""
+    name = name.encode("utf-8")
+    sock.sendall(QUERY.pack(MAGIC_QUERY, transfer_id, total, chunk_size, len(name)) + name)
+    magic, count = MISSING.unpack(recv_exact(sock, MISSING.size))
+    if magic != MAGIC_MISSING:
+        raise ProtocolError(f"bad MISSING magic {magic!r}")
+    data = recv_exact(sock, count * RANGE.size)
+    return [RANGE.unpack_from(data, i * RANGE.size) for i in range(count)]
+
+
+def end_session(sock):
+    """Tell a session-mode server that no more trials follow."""
+    sock.sendall(MAGIC_BYE)
+
+
+def finish(sock, crc):
+    """Send the trailer and block until the server's ACK arrives."""
+    sock.sendall(TRAILER.pack(MAGIC_TRAILER, crc & 0xFFFFFFFF))
+    magic, status, received, server_crc, t_first, t_last = ACK.unpack(recv_exact(sock, ACK.size))
+    if magic != MAGIC_ACK:
+        raise ProtocolError(f"bad ACK magic {magic!r}")
+    return Ack(status, received, server_crc, t_first, t_last)
+
+
+# ---------------------------------------------------------------------------
+# Server side
+# ---------------------------------------------------------------------------
+
+def read_header(sock):
+    """Return (Header, None) for a framed stream, or (None, prefix) for a legacy one.
+
+    `prefix` holds the bytes already consumed while sniffing the magic.
+    """
+    buf = bytearray(len(MAGIC_HEADER))
+    view = memoryview(buf)
+    filled = 0
+    while filled < len(buf):
+        n = sock.recv_into(view[filled:])
+        if not n:
+            return None, bytes(buf[:filled])
+        filled += n
+    if bytes(buf) != MAGIC_HEADER:
+        return None, bytes(buf)
+    _, version, flags, size, name_len = HEADER.unpack(bytes(buf) + recv_exact(sock, HEADER.size - len(buf)))
+    if version != VERSION:
+        raise ProtocolError(f"unsupported protocol version {version}")
+    name = recv_exact(sock, name_len).decode("utf-8", "replace") if name_len else ""
+    stripe = Stripe(*STRIPE.unpack(recv_exact(sock, STRIPE.size))) if flags & FLAG_STRIPE else None
+    resume = Resume(*RESUME.unpack(recv_exact(sock, RESUME.size))) if flags & FLAG_RESUME else None
+    codec = None
+    if flags & FLAG_COMPRESSED:
+        (codec_len,) = CODEC.unpack(recv_exact(sock, CODEC.size))
+        codec = recv_exact(sock, codec_len).decode("ascii", "replace")
+    return Header(size, name, flags, stripe, codec, resume), None
+
+
+def read_query(sock):
+    """(transfer id, size, chunk size, name) of a QUERY whose magic read_header() already consumed."""
+    _, transfer_id, total, chunk_size, name_len = QUERY.unpack(MAGIC_QUERY + recv_exact(sock, QUERY.size - 4))
+    name = recv_exact(sock, name_len).decode("utf-8", "replace") if name_len else ""
+    return transfer_id, total, chunk_size, name
+
+
+def send_missing(sock, ranges):
+    sock.sendall(MISSING.pack(MAGIC_MISSING, len(ranges)) + b"".join(RANGE.pack(*r) for r in ranges))
+
+
+def read_trailer(sock):
+    magic, crc = TRAILER.unpack(recv_exact(sock, TRAILER.size))
+    if magic != MAGIC_TRAILER:
+        raise ProtocolError(f"bad trailer magic {magic!r}")
+    return crc
+
+
+def send_ack(sock, header, received, crc, client_crc, t_first, t_last=None):
+    if received < header.size:
+        status = STATUS_SHORT
+    elif header.flags & FLAG_CHECKSUM and crc != client_crc:
+        status = STATUS_CHECKSUM
+    else:
+        status = STATUS_OK
+    ack = Ack(status, received, crc, t_first, t_last if t_last is not None else time.time())
+    sock.sendall(ack.pack())
+    return ack
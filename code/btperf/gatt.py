@@ -0,0 +1,470 @@
+"""Asynchronous GATT client engine for the BLE benchmark.
+
+One interface, several backends:
+
+    gatttool  drives ``gatttool -I`` through pexpect's asyncio support; a single
+              reader task parses its output and resolves pending writes,
+              notifications, MTU and discovery results
+    bleak     direct BlueZ D-Bus access through the ``bleak`` library
+              (optional dependency, imported only when selected)
+    mock      in-process MockPeripheral that models connection intervals,
+              for tests and for measuring the harness without a radio
+
+Characteristic handles come from service discovery by UUID, the ATT MTU from
+an MTU exchange, and the largest write per operation is derived from it
+(ATT_MTU - 3) instead of being hard-coded.
+"""
+import asyncio
+import random
+import re
+import struct
+import time
+
+from btperf import profiling
+
+# Must match the GATT application registered by code/ble/ble_server.py
+SERVICE_UUID = "12345678-1234-5678-1234-56789abcdef0"
+WRITE_CHAR_UUID = "12345678-1234-5678-1234-56789abcdef1"    # Débit (Write)
+LATENCY_CHAR_UUID = "12345678-1234-5678-1234-56789abcdef2"  # Latence (Write + Notify)
+
+BACKENDS = ("gatttool", "bleak", "mock")
+DEFAULT_MTU = 23          # ATT default before any exchange
+REQUESTED_MTU = 247       # largest MTU that fits one LE data PDU with DLE
+ATT_WRITE_OVERHEAD = 3    # opcode + handle
+
+# --- Throughput stream protocol (write characteristic) ---
+# Control values are sent as acknowledged writes. START_TRANSFER opens a legacy
+# transfer of raw chunks. START_STREAM + STREAM_START opens a sequenced stream:
+# every chunk is STREAM_CHUNK (sequence number) + data, and the server notifies
+# STREAM_ACK (last sequence seen, bytes received) every `ack_every` chunks and
+# once more, prefixed with END_TRANSFER, after END_TRANSFER.
+START_TRANSFER = b"START_TRANSFER"
+START_STREAM = b"START_STREAM"
+END_TRANSFER = b"END_TRANSFER"
+STREAM_START = struct.Struct("<H")     # ack_every (0 = final ACK only)
+STREAM_CHUNK = struct.Struct("<H")     # sequence number, wraps at 65536
+STREAM_ACK = struct.Struct("<HIH")     # last sequence, bytes received, chunks missing (mod 65536)
+
+# --- Latency probes (latency characteristic) ---
+# Every probe starts with the client's sequence number and its send time
+# (time.perf_counter_ns); the server echoes the value unchanged as a
+# notification, so replies can be matched to sends even when pipelined.
+LATENCY_PROBE = struct.Struct("<IQ")   # sequence, client send time in ns
+
+
+class StreamReceiver:
+    """Server-side accounting for the write characteristic.
+
+    Shared by ble_server.py and MockPeripheral. `notify(bytes)` sends a
+    notification on the same characteristic.
+    """
+
+    def __init__(self, notify=None):
+        self.notify = notify
+        self.active = False
+        self.sequenced = False
+        self.ack_every = 0
+        self.bytes = 0
+        self.chunks = 0
+        self.missing = 0
+        self.last_seq = None
+        self.start_time = 0.0
+        self.duration = 0.0
+
+    def on_write(self, value):
+        """Handle one write; returns 'start', 'end' or 'data'."""
+        value = bytes(value)
+        if value == START_TRANSFER or value.startswith(START_STREAM):
+            self.__init__(self.notify)
+            self.active = True
+            self.start_time = time.time()
+            if value.startswith(START_STREAM):
+                self.sequenced = True
+                self.ack_every, = STREAM_START.unpack_from(value, len(START_STREAM))
+            return "start"
+        if value == END_TRANSFER:
+            self.active = False
+            self.duration = time.time() - self.start_time
+            if self.sequenced:
+                self._ack(final=True)
+            return "end"
+        if not self.active:
+            return "data"
+        if self.sequenced:
+            seq, = STREAM_CHUNK.unpack_from(value)
+            if self.last_seq is not None:
+                self.missing += (seq - self.last_seq - 1) & 0xFFFF
+            self.last_seq = seq
+            self.bytes += len(value) - STREAM_CHUNK.size
+            self.chunks += 1
+            if self.ack_every and self.chunks % self.ack_every == 0:
+                self._ack()
+        else:
+            self.bytes += len(value)
+        return "data"
+
+    def _ack(self, final=False):
+        if self.notify:
+            self.notify((END_TRANSFER if final else b"") + STREAM_ACK.pack(self.last_seq or 0, self.bytes & 0xFFFFFFFF, self.missing & 0xFFFF))
+
+
+_PROPERTY_BITS = {
+    0x02: "read",
+    0x04: "write-without-response",
+    0x08: "write",
+    0x10: "notify",
+    0x20: "indicate",
+}
+
+
+class GattError(Exception):
+    pass
+
+
+class Characteristic:
+    def __init__(self, uuid, handle, properties=()):
+        self.uuid = uuid.lower()
+        self.handle = handle
+        self.properties = set(properties)
+        self.native = None   # backend object (bleak), if any
+
+    def __repr__(self):
+        return f"Characteristic({self.uuid}, handle=0x{self.handle:04x}, {sorted(self.properties)})"
+
+
+class GattClient:
+    """Backend-independent client API. Subclasses implement the _methods."""
+
+    def __init__(self, address, requested_mtu=REQUESTED_MTU):
+        self.address = address
+        self.requested_mtu = requested_mtu
+        self.mtu = DEFAULT_MTU
+        self.characteristics = {}
+        self.connect_time = None
+
+    @property
+    def max_write(self):
+        """Largest value that fits in a single ATT write at the negotiated MTU."""
+        return self.mtu - ATT_WRITE_OVERHEAD
+
+    async def connect(self):
+        t = time.perf_counter()
+        await self._connect()
+        self.mtu = await self._exchange_mtu(self.requested_mtu)
+        for char in await self._discover():
+            self.characteristics[char.uuid] = char
+        self.connect_time = time.perf_counter() - t
+        return self
+
+    async def disconnect(self):
+        await self._disconnect()
+
+    def characteristic(self, uuid):
+        try:
+            return self.characteristics[uuid.lower()]
+        except KeyError:
+            raise GattError(f"Characteristic {uuid} not found on {self.address}") from None
+
+    async def write(self, char, data, response=True):
+        """ATT Write Request (acknowledged) or Write Command (response=False)."""
+        await self._write(char, data, response)
+
+    async def start_notify(self, char, callback):
+        """callback(data: bytes, t_ns: int) runs for every notification."""
+        await self._start_notify(char, callback)
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.disconnect()
+
+
+# ---------------------------------------------------------------------------
+# gatttool backend
+# ---------------------------------------------------------------------------
+
+_ANSI = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+_PROMPT = re.compile(r"\[[0-9A-Fa-f:]{17}\]\[LE\]>\s*")
+_CHAR_LINE = re.compile(r"handle: 0x([0-9a-f]+), char properties: 0x([0-9a-f]+), "
+                        r"char value handle: 0x([0-9a-f]+), uuid: ([0-9a-f-]+)", re.I)
+_NOTIFY_LINE = re.compile(r"(?:Notification|Indication)\s+handle = 0x([0-9a-f]+) value: ([0-9a-f ]*)", re.I)
+_MTU_LINE = re.compile(r"MTU was exchanged successfully: (\d+)")
+
+
+class GatttoolClient(GattClient):
+    TIMEOUT_S = 15
+    DISCOVERY_QUIET_S = 0.5
+
+    def __init__(self, address, requested_mtu=REQUESTED_MTU, address_type="random", sudo=True):
+        super().__init__(address, requested_mtu)
+        self.address_type = address_type
+        self.sudo = sudo
+        self.child = None
+        self._reader = None
+        self._pending_writes = []
+        self._mtu_future = None
+        self._discovered = None
+        self._last_discovery = 0.0
+        self._callbacks = {}
+
+    async def _connect(self):
+        import pexpect
+        cmd = f"gatttool -b {self.address} -I -t {self.address_type}"
+        self.child = pexpect.spawn(("sudo " if self.sudo else "") + cmd, timeout=self.TIMEOUT_S,
+                                   encoding="utf-8", codec_errors="replace")
+        await self.child.expect(r"\[.+\]\s*", async_=True)
+        self.child.sendline("connect")
+        index = await self.child.expect([r"Connection successful", r"Error: .*|connect error: .*"], async_=True)
+        if index:
+            raise GattError(f"gatttool could not connect: {self.child.after.strip()}")
+        self._reader = asyncio.ensure_future(self._read_loop())
+
+    async def _read_loop(self):
+        import pexpect
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await self.child.expect(r"\r?\n", timeout=None, async_=True)
+            except (pexpect.EOF, pexpect.TIMEOUT):
+                for fut in self._pending_writes:
+                    if not fut.done():
+                        fut.set_exception(GattError("gatttool exited"))
+                return
+            now_ns = time.perf_counter_ns()
+            with profiling.phase("encode"):
+                line = _PROMPT.sub("", _ANSI.sub("", self.child.before)).strip()
+                m = _NOTIFY_LINE.search(line)
+                callback = self._callbacks.get(int(m.group(1), 16)) if m else None
+                data = bytes.fromhex(m.group(2)) if callback else None
+            if not line:
+                continue
+            if m:
+                if callback:
+                    callback(data, now_ns)
+            elif "written successfully" in line:
+                self._resolve_write(None)
+            elif "Write Request failed" in line or line.startswith("Error"):
+                self._resolve_write(GattError(line))
+            elif (m := _MTU_LINE.search(line)) and self._mtu_future:
+                self._mtu_future.set_result(int(m.group(1)))
+            elif (m := _CHAR_LINE.search(line)) and self._discovered is not None:
+                properties = [name for bit, name in _PROPERTY_BITS.items() if int(m.group(2), 16) & bit]
+                self._discovered.append(Characteristic(m.group(4), int(m.group(3), 16), properties))
+                self._last_discovery = loop.time()
+
+    def _resolve_write(self, error):
+        while self._pending_writes:
+            fut = self._pending_writes.pop(0)
+            if not fut.done():
+                fut.set_exception(error) if error else fut.set_result(None)
+                return
+
+    async def _exchange_mtu(self, mtu):
+        self._mtu_future = asyncio.get_running_loop().create_future()
+        self.child.sendline(f"mtu {mtu}")
+        try:
+            return await asyncio.wait_for(self._mtu_future, 5)
+        except asyncio.TimeoutError:
+            return DEFAULT_MTU     # peer refused the exchange, keep the ATT default
+        finally:
+            self._mtu_future = None
+
+    async def _discover(self):
+        loop = asyncio.get_running_loop()
+        self._discovered = []
+        self._last_discovery = loop.time()
+        self.child.sendline("characteristics")
+        # gatttool prints no end marker: stop once the listing has gone quiet
+        while loop.time() - self._last_discovery < self.DISCOVERY_QUIET_S or not self._discovered:
+            await asyncio.sleep(0.05)
+            if loop.time() - self._last_discovery > self.TIMEOUT_S:
+                break
+        found, self._discovered = self._discovered, None
+        return found
+
+    async def _write(self, char, data, response):
+        phase = profiling.phase
+        with phase("encode"):
+            command = f"char-write-{'req' if response else 'cmd'} 0x{char.handle:04x} {bytes(data).hex()}"
+        if response:
+            fut = asyncio.get_running_loop().create_future()
+            self._pending_writes.append(fut)
+            with phase("syscall"):
+                self.child.sendline(command)
+            with phase("wait"):
+                await asyncio.wait_for(fut, self.TIMEOUT_S)
+        else:
+            with phase("syscall"):
+                self.child.sendline(command)
+
+    async def _start_notify(self, char, callback):
+        self._callbacks[char.handle] = callback
+        # Enable notifications through the CCCD right after the value handle
+        await self._write(Characteristic("cccd", char.handle + 1), b"\x01\x00", True)
+
+    async def _disconnect(self):
+        if self._reader:
+            self._reader.cancel()
+        if self.child and self.child.isalive():
+            self.child.sendline("exit")
+            self.child.close()
+
+
+# ---------------------------------------------------------------------------
+# bleak (BlueZ D-Bus) backend
+# ---------------------------------------------------------------------------
+
+class BleakGattClient(GattClient):
+    def __init__(self, address, requested_mtu=REQUESTED_MTU):
+        super().__init__(address, requested_mtu)
+        self.client = None
+
+    async def _connect(self):
+        try:
+            from bleak import BleakClient
+        except ImportError:
+            raise GattError("The bleak backend needs 'pip install bleak'") from None
+        self.client = BleakClient(self.address)
+        await self.client.connect()
+
+    async def _exchange_mtu(self, mtu):
+        # BlueZ negotiates the MTU itself when the link comes up
+        return self.client.mtu_size
+
+    async def _discover(self):
+        found = []
+        for service in self.client.services:
+            for native in service.characteristics:
+                char = Characteristic(native.uuid, native.handle, native.properties)
+                char.native = native
+                found.append(char)
+        return found
+
+    async def _write(self, char, data, response):
+        # One D-Bus round trip to bluetoothd, acknowledged or not
+        with profiling.phase("syscall"):
+            await self.client.write_gatt_char(char.native, data, response=response)
+
+    async def _start_notify(self, char, callback):
+        await self.client.start_notify(char.native,
+                                       lambda _sender, data: callback(bytes(data), time.perf_counter_ns()))
+
+    async def _disconnect(self):
+        if self.client:
+            await self.client.disconnect()
+
+
+# ---------------------------------------------------------------------------
+# Mock peripheral
+# ---------------------------------------------------------------------------
+
+class MockPeripheral:
+    """In-process stand-in for ble_server.py.
+
+    Models the link with a connection interval: an acknowledged write costs
+    one interval, unacknowledged writes and notifications share
+    `packets_per_event` slots per interval, and `loss` drops that fraction of
+    unacknowledged writes (a full host queue). The write characteristic runs
+    the same StreamReceiver as the real server; the latency characteristic
+    echoes every write as a notification.
+    """
+
+    def __init__(self, mtu=REQUESTED_MTU, conn_interval=0.0075, packets_per_event=4, connect_delay=0.05,
+                 loss=0.0, seed=0):
+        self.mtu = mtu
+        self.conn_interval = conn_interval
+        self.packets_per_event = packets_per_event
+        self.connect_delay = connect_delay
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.handlers = {}
+        self.characteristics = []
+        self.stream = StreamReceiver(lambda data: self.notify(WRITE_CHAR_UUID, data))
+        self.writes = 0
+        self.client = None
+        next_handle = 0x000b
+        for uuid, properties in ((WRITE_CHAR_UUID, ("write", "write-without-response", "notify")),
+                                 (LATENCY_CHAR_UUID, ("write", "write-without-response", "notify"))):
+            self.characteristics.append(Characteristic(uuid, next_handle, properties))
+            next_handle += 3
+        self.on_write(WRITE_CHAR_UUID, lambda peripheral, data: self.stream.on_write(data))
+        self.on_write(LATENCY_CHAR_UUID, lambda peripheral, data: self.notify(LATENCY_CHAR_UUID, data))
+
+    def on_write(self, uuid, handler):
+        """handler(peripheral, data) runs for every write to uuid."""
+        self.handlers[uuid.lower()] = handler
+
+    def notify(self, uuid, data):
+        if self.client:
+            self.client._deliver(uuid.lower(), bytes(data))
+
+    def receive(self, uuid, data):
+        self.writes += 1
+        handler = self.handlers.get(uuid)
+        if handler:
+            handler(self, bytes(data))
+
+
+class MockGattClient(GattClient):
+    def __init__(self, address="mock", requested_mtu=REQUESTED_MTU, peripheral=None):
+        super().__init__(address, requested_mtu)
+        self.peripheral = peripheral or MockPeripheral()
+        self._callbacks = {}
+        self._next_slot = 0.0
+
+    async def _connect(self):
+        await asyncio.sleep(self.peripheral.connect_delay)
+        self.peripheral.client = self
+
+    async def _exchange_mtu(self, mtu):
+        return min(mtu, self.peripheral.mtu)
+
+    async def _discover(self):
+        return list(self.peripheral.characteristics)
+
+    async def _slot(self):
+        """Wait for the next free packet slot of the modelled link."""
+        loop = asyncio.get_running_loop()
+        spacing = self.peripheral.conn_interval / self.peripheral.packets_per_event
+        self._next_slot = max(self._next_slot, loop.time()) + spacing
+        await asyncio.sleep(self._next_slot - loop.time())
+
+    async def _write(self, char, data, response):
+        if len(data) > self.max_write:
+            raise GattError(f"{len(data)}-byte write exceeds ATT MTU {self.mtu}")
+        if response:
+            # Queued behind the unacknowledged writes already in flight
+            loop = asyncio.get_running_loop()
+            self._next_slot = max(self._next_slot, loop.time()) + self.peripheral.conn_interval
+            with profiling.phase("wait"):
+                await asyncio.sleep(self._next_slot - loop.time())
+        else:
+            with profiling.phase("wait"):
+                await self._slot()
+            if self.peripheral.loss and self.peripheral.rng.random() < self.peripheral.loss:
+                return
+        self.peripheral.receive(char.uuid, data)
+
+    async def _start_notify(self, char, callback):
+        self._callbacks[char.uuid] = callback
+
+    def _deliver(self, uuid, data):
+        callback = self._callbacks.get(uuid)
+        if callback:
+            loop = asyncio.get_running_loop()
+            loop.call_later(self.peripheral.conn_interval / 2,
+                            lambda: callback(data, time.perf_counter_ns()))
+
+    async def _disconnect(self):
+        self.peripheral.client = None
+
+
+def create_client(backend, address, requested_mtu=REQUESTED_MTU, **options):
+    if backend == "gatttool":
+        return GatttoolClient(address, requested_mtu, **options)
+    if backend == "bleak":
+        return BleakGattClient(address, requested_mtu)
+    if backend == "mock":
+        return MockGattClient(address, requested_mtu, **options)
+    raise ValueError(f"Unknown GATT backend '{backend}' (expected one of {', '.join(BACKENDS)})")
@@ -0,0 +1,313 @@
+"""Load generator: many peers driving one server at once, one process per peer.
+
+Every worker connects on its own, waits for a common start time (connection
+setup is never measured) and then sends fixed-size messages for `duration`
+seconds following a load profile:
+
+    closed              next message as soon as the previous one is answered
+    open:RATE           RATE messages/s per worker on a fixed schedule, whatever
+                        the replies do
+    ramp:START:END      open loop, rate rising linearly from START to END
+                        messages/s per worker over the duration
+
+Open-loop latency runs from the message's scheduled send time, not from the
+moment it actually left, so a server that falls behind shows up as queueing
+delay instead of silently lowering the offered load (coordinated omission).
+
+Targets:
+
+    echo    bluetooth_server.py-style echo server over any transport but sim
+            (rfcomm, tcp, unix); every message carries its scheduled time
+            (PROBE) and comes back unchanged
+    ble     the WriteCharacteristic of ble_server.py through a btperf.gatt
+            backend; every message is a Write Request and its latency is the
+            time to the write response. With the mock backend each worker has
+            its own MockPeripheral, so only the client side is loaded
+
+Each worker returns a WorkerResult holding a btperf.stats.LatencyStats;
+LevelResult merges the workers of one run, and a list of levels (1, 2, 4...
+workers) is the server's scaling curve.
+"""
+import asyncio
+import math
+import multiprocessing
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from btperf import payload, stats, transport
+
+TARGETS = ("echo", "ble")
+PROFILES = ("closed", "open", "ramp")
+PROBE = struct.Struct("!Q")     # scheduled send time, perf_counter_ns of the worker
+STARTUP = 1.0                   # seconds between launching the workers and the common start
+STARTUP_PER_WORKER = 0.05       # ... plus this per worker (process start and connection setup)
+DRAIN_TIMEOUT = 5.0             # seconds to wait for the last replies after the duration
+# One row per (message size, worker count); latencies in ns
+LOAD_COLUMNS = (("size", "q"), ("workers", "q"), ("messages", "q"), ("bytes", "q"), ("duration_ns", "q"),
+                ("mean_ns", "q"), ("p50_ns", "q"), ("p99_ns", "q"), ("lost", "q"), ("errors", "q"))
+
+
+class Profile:
+    def __init__(self, kind="closed", rate=0.0, end_rate=None):
+        if kind not in PROFILES:
+            raise ValueError(f"Unknown load profile '{kind}' (expected one of {', '.join(PROFILES)})")
+        self.kind = kind
+        self.rate = rate
+        self.end_rate = rate if end_rate is None else end_rate
+
+    def __str__(self):
+        if self.kind == "closed":
+            return "closed"
+        if self.kind == "open":
+            return f"open:{self.rate:g}"
+        return f"ramp:{self.rate:g}:{self.end_rate:g}"
+
+    @property
+    def open(self):
+        return self.kind != "closed"
+
+    def send_time(self, k, duration):
+        """Scheduled time (s from the start) of the k-th message, math.inf past the duration."""
+        # Messages sent by t: rate * t + (end_rate - rate) * t**2 / (2 * duration); solved for t
+        a = (self.end_rate - self.rate) / (2 * duration) if duration > 0 else 0.0
+        b = self.rate
+        if a:
+            disc = b * b + 4 * a * k
+            t = (-b + math.sqrt(disc)) / (2 * a) if disc >= 0 else math.inf
+        else:
+            t = k / b if b > 0 else math.inf
+        return t if 0 <= t < duration else math.inf
+
+
+def parse_profile(spec):
+    """Profile for "closed", "open:RATE" or "ramp:START:END"; ValueError otherwise."""
+    kind, *rates = spec.split(":")
+    try:
+        rates = [float(r) for r in rates]
+    except ValueError:
+        raise ValueError(f"Malformed load profile '{spec}'") from None
+    expected = {"closed": 0, "open": 1, "ramp": 2}.get(kind)
+    if expected is None or len(rates) != expected or any(r < 0 for r in rates) or (rates and max(rates) <= 0):
+        raise ValueError(f"Malformed load profile '{spec}' (expected closed, open:RATE or ramp:START:END)")
+    return Profile(kind, *rates)
+
+
+class WorkerResult:
+    def __init__(self, worker):
+        self.worker = worker
+        self.latency = stats.LatencyStats()
+        self.messages = 0       # answered
+        self.bytes = 0          # answered, both directions counted once
+        self.start = 0.0        # time.time() of the first / after the last message
+        self.end = 0.0
+        self.late = 0.0         # seconds the worker started after the common start
+        self.error = None
+
+
+class LevelResult:
+    """Workers of one run at one concurrency level, merged."""
+
+    def __init__(self, size, workers, results):
+        self.size = size
+        self.workers = workers
+        self.latency = stats.LatencyStats()
+        self.messages = self.bytes = 0
+        self.errors = [r.error for r in results if r.error]
+        for r in results:
+            self.latency.merge(r.latency.close())       # independent streams: no burst spans two workers
+            self.messages += r.messages
+            self.bytes += r.bytes
+        started = [r.start for r in results if r.start]
+        self.duration = max(r.end for r in results) - min(started) if started else 0.0
+        self.late = max((r.late for r in results), default=0.0)
+
+    @property
+    def rate(self):
+        return self.messages / self.duration if self.duration > 0 else 0.0
+
+    @property
+    def throughput(self):
+        return self.bytes / self.duration / 1024 if self.duration > 0 else 0.0     # KB/s
+
+    def to_dict(self):
+        return {"size": self.size, "workers": self.workers, "messages": self.messages, "bytes": self.bytes,
+                "duration_s": self.duration, "rate": self.rate, "throughput_kbs": self.throughput,
+                "late_s": self.late, "errors": self.errors, "latency": self.latency.to_dict()}
+
+
+# --- echo target ---
+
+def _recv_exact(sock, view):
+    filled = 0
+    while filled < len(view):
+        n = sock.recv_into(view[filled:])
+        if not n:
+            raise ConnectionError("server closed the connection")
+        filled += n
+
+
+def _echo_closed(sock, message, result, deadline):
+    clock = time.perf_counter_ns
+    reply = memoryview(bytearray(len(message)))
+    while (t_send := clock()) < deadline:
+        PROBE.pack_into(message, 0, t_send)
+        sock.sendall(message)
+        _recv_exact(sock, reply)
+        result.latency.add(clock() - PROBE.unpack_from(reply)[0])
+        result.messages += 1
+        result.bytes += len(message)
+
+
+def _echo_open(sock, message, result, t0, profile, duration):
+    """Sender thread on the schedule, replies read here; unanswered messages count as lost."""
+    clock = time.perf_counter_ns
+    sent = 0
+    done = threading.Event()
+
+    def sender():
+        nonlocal sent
+        try:
+            while (offset := profile.send_time(sent, duration)) != math.inf:
+                scheduled = t0 + int(offset * 1e9)
+                delay = (scheduled - clock()) / 1e9
+                if delay > 0:
+                    time.sleep(delay)
+                PROBE.pack_into(message, 0, scheduled)
+                sock.sendall(message)
+                sent += 1
+        except OSError:
+            pass
+        finally:
+            done.set()
+
+    thread = threading.Thread(target=sender, daemon=True)
+    thread.start()
+    reply = memoryview(bytearray(len(message)))
+    sock.settimeout(DRAIN_TIMEOUT)
+    try:
+        while not done.is_set() or result.messages < sent:
+            try:
+                _recv_exact(sock, reply)
+            except TimeoutError:
+                if done.is_set():
+                    break       # the last replies are not coming
+                continue
+            result.latency.add(clock() - PROBE.unpack_from(reply)[0])
+            result.messages += 1
+            result.bytes += len(message)
+    finally:
+        thread.join()
+        for _ in range(sent - result.messages):
+            result.latency.add_loss()
+
+
+def _wait_until(start_at, result):
+    delay = start_at - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    result.late = max(0.0, -delay)
+
+
+def echo_worker(worker, spec, address, channel, size, profile, duration, start_at, seed):
+    result = WorkerResult(worker)
+    message = bytearray(payload.make_pool(max(size, PROBE.size), seed=seed + worker))
+    try:
+        sock = transport.connect(spec, address, channel)
+    except OSError as e:
+        result.error = f"worker {worker}: {e}"
+        return result
+    try:
+        _wait_until(start_at, result)
+        t0 = time.perf_counter_ns()
+        result.start = time.time()
+        if profile.open:
+            _echo_open(sock, message, result, t0, profile, duration)
+        else:
+            _echo_closed(sock, message, result, t0 + int(duration * 1e9))
+    except OSError as e:
+        result.error = f"worker {worker}: {e}"
+    finally:
+        result.end = time.time()
+        sock.close()
+    return result
+
+
+# --- ble target ---
+
+async def _ble_run(worker, backend, address, size, profile, duration, start_at, seed):
+    from btperf import gatt
+    result = WorkerResult(worker)
+    client = await gatt.create_client(backend, address).connect()
+    try:
+        char = client.characteristic(gatt.WRITE_CHAR_UUID)
+        # Plain data writes: a START/END pair would reset the handler's shared stream for every peer
+        message = bytes(payload.make_pool(max(1, min(size, client.max_write)), seed=seed + worker))
+        clock = time.perf_counter_ns
+
+        async def write(scheduled):
+            try:
+                await client.write(char, message, response=True)
+            except gatt.GattError:
+                result.latency.add_loss()
+                return
+            result.latency.add(clock() - scheduled)
+            result.messages += 1
+            result.bytes += len(message)
+
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+        result.late = max(0.0, time.time() - start_at)
+        t0 = clock()
+        result.start = time.time()
+        if profile.open:
+            tasks = []
+            k = 0
+            while (offset := profile.send_time(k, duration)) != math.inf:
+                scheduled = t0 + int(offset * 1e9)
+                await asyncio.sleep(max(0.0, (scheduled - clock()) / 1e9))
+                tasks.append(asyncio.ensure_future(write(scheduled)))
+                k += 1
+            if tasks:
+                done, pending = await asyncio.wait(tasks, timeout=DRAIN_TIMEOUT)
+                for task in pending:
+                    task.cancel()
+                    result.latency.add_loss()
+        else:
+            deadline = t0 + int(duration * 1e9)
+            while (t_send := clock()) < deadline:
+                await write(t_send)
+    finally:
+        result.end = time.time()
+        await client.disconnect()
+    return result
+
+
+def ble_worker(worker, backend, address, size, profile, duration, start_at, seed):
+    try:
+        return asyncio.run(_ble_run(worker, backend, address, size, profile, duration, start_at, seed))
+    except Exception as e:     # connection refused, adapter busy, gatttool missing...
+        result = WorkerResult(worker)
+        result.error = f"worker {worker}: {e}"
+        return result
+
+
+# --- driver ---
+
+def run_level(target, workers, size, profile, duration, spec=None, address=None, channel=None, backend="mock",
+              seed=payload.DEFAULT_SEED):
+    """Run `workers` worker processes against one server at once; returns the merged LevelResult."""
+    if target not in TARGETS:
+        raise ValueError(f"Unknown load target '{target}' (expected one of {', '.join(TARGETS)})")
+    if target == "echo" and transport.in_process(spec):
+        raise ValueError("the sim transport lives in one process: use tcp or unix for a load test")
+    start_at = time.time() + STARTUP + STARTUP_PER_WORKER * workers
+    context = multiprocessing.get_context("spawn")     # no inherited threads or sockets
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        if target == "echo":
+            futures = [pool.submit(echo_worker, w, spec, address, channel, size, profile, duration, start_at, seed)
+                       for w in range(workers)]
+        else:
+            futures = [pool.submit(ble_worker, w, backend, address, size, profile, duration, start_at, seed)
+                       for w in range(workers)]
+        return LevelResult(size, workers, [f.result() for f in futures])
@@ -0,0 +1,171 @@
+"""Throughput time series sampled beside a transfer, not inside it.
+
+The transfer loop only keeps a running byte count (an attribute it already
+updates, or RateMonitor.count); a sampler thread reads it every `interval`
+seconds and derives
+
+    rate    instantaneous rate over the last interval (B/s)
+    ewma    exponentially weighted rate, time constant `tau` seconds
+    stall   1 while the rate is below `stall_ratio` x the EWMA (or zero);
+            consecutive stalled samples form one stall period
+
+Samples go to a btperf.recorder log (RATE_COLUMNS), to an optional
+machine-readable stream (one JSON object per line, e.g. a FIFO or "-" for
+stdout) and to a console line redrawn at most every `display` seconds. A
+throughput collapse in the middle of a transfer (Wi-Fi interference in S4)
+shows up as a stall period instead of disappearing into the final average.
+"""
+import json
+import math
+import sys
+import threading
+import time
+
+INTERVAL = 0.1          # seconds between samples
+TAU = 1.0               # EWMA time constant (s)
+STALL_RATIO = 0.1       # rate below this fraction of the EWMA counts as stalled
+DISPLAY = 1.0           # seconds between console updates (0 = no console line)
+RATE_COLUMNS = (("t_ns", "q"), ("bytes", "q"), ("rate_bps", "d"), ("ewma_bps", "d"), ("stall", "q"))
+
+
+class Stall:
+    def __init__(self, start, end, bytes_before):
+        self.start = start
+        self.end = end
+        self.bytes_before = bytes_before
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class RateMonitor:
+    """Samples `source()` (cumulative bytes; default: the `count` attribute) from a background thread."""
+
+    def __init__(self, source=None, interval=INTERVAL, tau=TAU, stall_ratio=STALL_RATIO, display=DISPLAY,
+                 label="[RATE]", log=None, stream=None):
+        self.count = 0
+        self.source = source or (lambda: self.count)
+        self.interval = interval
+        self.tau = tau
+        self.stall_ratio = stall_ratio
+        self.display = display
+        self.label = label
+        self.log = log
+        self.stream = stream
+        self.rate = 0.0
+        self.ewma = 0.0
+        self.peak = 0.0
+        self.stalls = []
+        self.samples = 0
+        self._stall_start = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- lifecycle ---
+
+    def start(self):
+        self._t0 = self._t_last = time.perf_counter_ns()
+        self._bytes_last = self.source()
+        self._next_display = self._t0 + int(self.display * 1e9)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Take a last sample, close any open stall and end the console line."""
+        if self._thread is None:
+            return self
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._sample(final=True)
+        if self.display:
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+        if self.stream not in (None, sys.stdout):
+            self.stream.close()
+            self.stream = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    # --- sampling (sampler thread) ---
+
+    def _sample(self, final=False):
+        t = time.perf_counter_ns()
+        total = self.source()
+        dt = (t - self._t_last) / 1e9
+        if dt <= 0:
+            return
+        self.rate = (total - self._bytes_last) / dt
+        # Weight of the new sample grows with its length, so irregular wake-ups stay consistent
+        weight = 1.0 - math.exp(-dt / self.tau) if self.samples else 1.0
+        stalled = self.samples > 0 and self.ewma > 0 and self.rate <= self.stall_ratio * self.ewma
+        self.ewma += weight * (self.rate - self.ewma)
+        self.peak = max(self.peak, self.rate)
+        self.samples += 1
+        elapsed = t - self._t0
+        if stalled and self._stall_start is None:
+            self._stall_start = (self._t_last - self._t0, self._bytes_last)
+        elif self._stall_start is not None and (not stalled or final):
+            start, before = self._stall_start
+            end = elapsed if stalled else self._t_last - self._t0
+            self.stalls.append(Stall(start / 1e9, end / 1e9, before))
+            self._stall_start = None
+        self._t_last, self._bytes_last = t, total
+
+        if self.log is not None:
+            self.log.record(elapsed, total, self.rate, self.ewma, int(stalled))
+        if self.stream is not None:
+            self.stream.write(json.dumps({"t": round(elapsed / 1e9, 3), "bytes": total,
+                                          "rate_bps": round(self.rate), "ewma_bps": round(self.ewma),
+                                          "stall": stalled}) + "\n")
+            self.stream.flush()
+        if self.display and (t >= self._next_display or final):
+            self._next_display = t + int(self.display * 1e9)
+            sys.stdout.write(f"\r{self.label} {self.rate / 1024:9.2f} KB/s (EWMA {self.ewma / 1024:.2f} KB/s), "
+                             f"{total / 1024:.0f} KB{'  STALL' if stalled else '       '}")
+            sys.stdout.flush()
+
+    # --- report ---
+
+    def summary(self):
+        stalled = sum(s.duration for s in self.stalls)
+        longest = max((s.duration for s in self.stalls), default=0.0)
+        return (f"peak {self.peak / 1024:.2f} KB/s, {len(self.stalls)} stall(s) totalling {stalled:.2f}s "
+                f"(longest {longest:.2f}s)")
+
+
+def open_stream(path):
+    """Machine-readable sample stream: None, "-" (stdout) or a file/FIFO path."""
+    if not path:
+        return None
+    return sys.stdout if path == "-" else open(path, "a", buffering=1)
+
+
+def add_arguments(parser):
+    """Register --rate-interval/--rate-display/--rate-stream on a parser."""
+    parser.add_argument("--rate-interval", type=float, default=INTERVAL,
+                        help="seconds between throughput samples (0 = no sampler)")
+    parser.add_argument("--rate-display", type=float, default=DISPLAY,
+                        help="seconds between live rate lines on the console (0 = none)")
+    parser.add_argument("--rate-stream", default=None,
+                        help="also write every sample as a JSON line to this file or FIFO ('-' = stdout)")
+    return parser
+
+
+def from_args(args, source=None, label="[RATE]", log=None):
+    """RateMonitor for the options of add_arguments, or None with --rate-interval 0."""
+    if args.rate_interval <= 0:
+        return None
+    return RateMonitor(source, args.rate_interval, display=args.rate_display, label=label, log=log,
+                       stream=open_stream(args.rate_stream))
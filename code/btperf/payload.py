@@ -0,0 +1,86 @@
+"""Payload generation shared by the classic and BLE clients.
+
+Payload bytes are produced once, before any timer starts, into a pool that
+the timed loops only slice (``memoryview``, no copies, no RNG calls). A seed
+makes runs reproducible. Profiles:
+
+    random        incompressible bytes from a seeded Mersenne Twister
+                  (not cryptographic, it does not need to be)
+    compressible  text-like stream of words from a small vocabulary (~3-4x with zlib)
+    file          contents of an existing file (e.g. one of the S2 resources)
+"""
+import random
+
+PROFILES = ("random", "compressible", "file")
+DEFAULT_PROFILE = "random"
+DEFAULT_SEED = 1
+POOL_SIZE = 1 << 20        # default pool when the run length is open-ended
+MAX_POOL_SIZE = 64 << 20   # larger payloads cycle through a pool of this size
+
+_VOCABULARY_SIZE = 512
+
+
+def _random_bytes(rng, size):
+    return bytearray(rng.randbytes(size))
+
+
+def _compressible_bytes(rng, size):
+    vocabulary = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 10)))
+                  for _ in range(_VOCABULARY_SIZE)]
+    out = bytearray()
+    while len(out) < size:
+        out += (" ".join(rng.choices(vocabulary, k=4096)) + "\n").encode("ascii")
+    del out[size:]
+    return out
+
+
+def _file_bytes(path, size):
+    with open(path, "rb") as f:
+        data = bytearray(f.read(size))
+    if not data:
+        raise ValueError(f"Payload file {path} is empty")
+    while len(data) < size:
+        data += data[:size - len(data)]
+    return data
+
+
+def make_pool(size=POOL_SIZE, profile=DEFAULT_PROFILE, seed=DEFAULT_SEED, path=None):
+    """Generate `size` payload bytes (capped at MAX_POOL_SIZE) and return a memoryview."""
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown payload profile '{profile}' (expected one of {', '.join(PROFILES)})")
+    size = max(1, min(size, MAX_POOL_SIZE))
+    rng = random.Random(seed)
+    if profile == "random":
+        data = _random_bytes(rng, size)
+    elif profile == "compressible":
+        data = _compressible_bytes(rng, size)
+    else:
+        if not path:
+            raise ValueError("The 'file' payload profile needs a path")
+        data = _file_bytes(path, size)
+    return memoryview(data)
+
+
+def iter_chunks(pool, total, chunk_size):
+    """Yield `total` bytes as memoryview slices of the pool, wrapping around it."""
+    pool_size = len(pool)
+    offset = 0
+    remaining = total
+    while remaining > 0:
+        n = min(chunk_size, remaining, pool_size - offset)
+        yield pool[offset:offset + n]
+        offset = (offset + n) % pool_size
+        remaining -= n
+
+
+def add_arguments(parser):
+    """Register --payload/--seed/--payload-file on a parser."""
+    parser.add_argument("--payload", choices=PROFILES, default=DEFAULT_PROFILE,
+                        help="payload profile (default: random)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="payload RNG seed")
+    parser.add_argument("--payload-file", default=None, help="source file for --payload file")
+    return parser
+
+
+def from_args(args, size=POOL_SIZE):
+    return make_pool(size, args.payload, args.seed, args.payload_file)
@@ -0,0 +1,217 @@
+"""Where the harness's own time goes.
+
+Every client and server entry point accepts the options of add_arguments():
+
+    --profile           per-phase wall time of the instrumented code paths:
+                          prep     payload generation, file reads
+                          encode   struct packing, .hex()/fromhex, compression, CRCs
+                          syscall  send/sendfile/write calls, pexpect sendline
+                          wait     blocked for the peer: recv, echo, ACK, notification
+                          log      recorder rows and console lines
+                        the remainder of the run is reported as "other"
+    --profile-cprofile  deterministic cProfile of the main thread, dumped as pstats
+    --profile-memory N  tracemalloc: the N allocation sites holding the most memory
+    --profile-flame     folded stacks ("a;b;c count" per line) sampled from every
+                        thread, ready for flamegraph.pl, speedscope or inferno
+    --profile-json      the phase table as JSON (used by code/run_benchmarks.py)
+
+phase(name) returns a shared no-op context manager unless a Profiler is
+running, so the hooks stay in the hot loops for the cost of one global
+lookup. Phase times are exclusive (a nested phase is not counted in its
+parent) and kept per thread / asyncio task; concurrent threads can add up
+to more than the wall time.
+"""
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+PHASES = ("prep", "encode", "syscall", "wait", "log")
+FLAME_INTERVAL = 0.005      # seconds between stack samples
+MEMORY_FRAMES = 25          # traceback depth kept by tracemalloc
+
+_active = None
+_NULL = contextlib.nullcontext()
+_stack = contextvars.ContextVar("btperf_phase_stack", default=())
+
+
+def phase(name):
+    """Time the enclosed block under `name` when profiling, else do nothing."""
+    return _active.phase(name) if _active is not None else _NULL
+
+
+def active():
+    return _active
+
+
+class _Frame:
+    __slots__ = ("profiler", "name", "start", "child", "token")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.child = 0
+
+    def __enter__(self):
+        self.token = _stack.set(_stack.get() + (self,))
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter_ns() - self.start
+        _stack.reset(self.token)
+        parent = _stack.get()
+        if parent:
+            parent[-1].child += elapsed
+        self.profiler._add(self.name, elapsed - self.child)
+
+
+class Profiler:
+    def __init__(self, label="[PROFILE]", cprofile=None, memory=0, flame=None, json_path=None,
+                 flame_interval=FLAME_INTERVAL):
+        self.label = label
+        self.cprofile_path = cprofile
+        self.memory = memory
+        self.flame_path = flame
+        self.json_path = json_path
+        self.flame_interval = flame_interval
+        self.totals = collections.Counter()
+        self.calls = collections.Counter()
+        self.stacks = collections.Counter()
+        self.wall = 0.0
+        self._lock = threading.Lock()
+        self._profile = None
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def phase(self, name):
+        return _Frame(self, name)
+
+    def _add(self, name, ns):
+        with self._lock:
+            self.totals[name] += ns
+            self.calls[name] += 1
+
+    # --- lifecycle ---
+
+    def start(self):
+        global _active
+        _active = self
+        if self.memory:
+            import tracemalloc
+            tracemalloc.start(MEMORY_FRAMES)
+        if self.flame_path:
+            self._sampler = threading.Thread(target=self._sample_stacks, daemon=True)
+            self._sampler.start()
+        if self.cprofile_path:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._t0 = time.perf_counter()
+        return self
+
+    def stop(self):
+        global _active
+        self.wall = time.perf_counter() - self._t0
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.cprofile_path)
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            with open(self.flame_path, "w") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        top = []
+        if self.memory:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            top = snapshot.statistics("lineno")[:self.memory]
+        if _active is self:
+            _active = None
+        self.report(top)
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- flame graph sampler ---
+
+    def _sample_stacks(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.flame_interval):
+            names.update((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    # --- report ---
+
+    def summary(self):
+        """{"wall_s": ..., "phases": {name: {"s": ..., "calls": ..., "share": ...}}}."""
+        measured = sum(self.totals.values()) / 1e9
+        phases = {name: {"s": self.totals[name] / 1e9, "calls": self.calls[name],
+                         "share": self.totals[name] / 1e9 / self.wall if self.wall > 0 else 0.0}
+                  for name in list(PHASES) + sorted(set(self.totals) - set(PHASES)) if self.calls[name]}
+        other = max(self.wall - measured, 0.0)
+        phases["other"] = {"s": other, "calls": 0, "share": other / self.wall if self.wall > 0 else 0.0}
+        return {"wall_s": self.wall, "phases": phases}
+
+    def report(self, top=()):
+        summary = self.summary()
+        print(f"{self.label} Harness profile over {summary['wall_s']:.3f}s wall time:")
+        for name, p in summary["phases"].items():
+            per_call = f", {p['s'] / p['calls'] * 1e6:9.2f} us/call x {p['calls']}" if p["calls"] else ""
+            print(f"{self.label}   {name:<8} {p['s']:9.3f}s {p['share']:7.1%}{per_call}")
+        if sum(self.totals.values()) / 1e9 > summary["wall_s"]:
+            print(f"{self.label}   (several threads were busy at once, e.g. an in-process peer: shares add up "
+                  f"to more than 100%)")
+        for stat in top:
+            frame = stat.traceback[0]
+            print(f"{self.label}   memory {stat.size / 1024:9.1f} KB in {stat.count} blocks at "
+                  f"{os.path.basename(frame.filename)}:{frame.lineno}")
+        written = [p for p in (self.cprofile_path, self.flame_path, self.json_path) if p]
+        if self.json_path:
+            with open(self.json_path, "w") as f:
+                json.dump(summary, f, indent=1)
+        if written:
+            print(f"{self.label} Profile written: {', '.join(written)}")
+
+
+def add_arguments(parser):
+    """Register the --profile* options on a parser."""
+    parser.add_argument("--profile", action="store_true",
+                        help="time the harness itself per phase (prep, encode, syscall, wait, log)")
+    parser.add_argument("--profile-cprofile", metavar="PATH", default=None,
+                        help="also dump a cProfile of the run (pstats format) to PATH")
+    parser.add_argument("--profile-memory", metavar="N", type=int, default=0,
+                        help="also list the N allocation sites holding the most memory (tracemalloc)")
+    parser.add_argument("--profile-flame", metavar="PATH", default=None,
+                        help="also write sampled folded stacks (flame graph input) to PATH")
+    parser.add_argument("--profile-json", metavar="PATH", default=None,
+                        help="also write the phase timings as JSON to PATH")
+    return parser
+
+
+def from_args(args, label="[PROFILE]"):
+    """A Profiler when any --profile* option is set, else a no-op context manager."""
+    if not (args.profile or args.profile_cprofile or args.profile_memory or args.profile_flame
+            or args.profile_json):
+        return contextlib.nullcontext()
+    return Profiler(label, args.profile_cprofile, args.profile_memory, args.profile_flame, args.profile_json)
@@ -0,0 +1,304 @@
+"""Receive engine for the file servers.
+
+Bytes land straight in preallocated buffers through ``recv_into``; nothing is
+allocated per chunk. Two disk strategies:
+
+* size unknown: a pool of large blocks is filled from the socket and handed
+  to a writer thread through a bounded queue, so ``f.write`` never runs
+  between two receives and is issued once per block instead of per packet;
+* size known: the output file is preallocated and memory-mapped, and the
+  socket writes directly into the mapping;
+* striped: an Assembly maps the output once and every stripe connection
+  receives its range straight into the mapping at its offset (``os.pwrite``
+  from a block buffer when the output cannot be mapped, e.g. /dev/null);
+* resumable: receive_chunks() checks every chunk against the CRC-32 sent
+  after it and stores the intact ones in a btperf.resume.ChunkIndex.
+
+ReceiveStats splits the wall time into network wait (blocked in recv_into),
+disk write (writer thread or final msync) and stall (receiver waiting for
+the writer to hand back a free block); `progress` follows every recv call so
+a btperf.monitor sampler can read it mid-block. With checksum=True a CRC-32 of the
+payload is folded in block by block (on the writer thread when streaming), for
+the framed protocol in btperf.framing.
+"""
+import mmap
+import os
+import queue
+import threading
+import time
+import zlib
+
+from btperf import framing, profiling
+
+BLOCK_SIZE = 256 * 1024   # bytes per buffer handed to the writer thread
+QUEUE_DEPTH = 8           # buffers in the pool (bounds memory to BLOCK_SIZE * QUEUE_DEPTH)
+
+
+class ReceiveStats:
+    def __init__(self):
+        self.bytes = 0
+        self.progress = 0       # bytes so far, updated per recv call (bytes is per block)
+        self.duration = 0.0
+        self.net_wait = 0.0
+        self.disk_time = 0.0
+        self.stall_time = 0.0
+        self.recv_calls = 0
+        self.eof = False
+        self.crc = 0
+        self.rejected = 0       # resumable chunks whose CRC did not match
+
+    def summary(self):
+        return (f"network wait {self.net_wait:.2f}s, disk write {self.disk_time:.2f}s, "
+                f"writer stall {self.stall_time:.2f}s, {self.recv_calls} recv calls")
+
+
+class BlockWriter:
+    """Writes filled blocks to a file object from a background thread."""
+
+    def __init__(self, f, block_size=BLOCK_SIZE, depth=QUEUE_DEPTH, checksum=False, crc=0):
+        self.f = f
+        self.block_size = block_size
+        self.checksum = checksum
+        self.crc = crc
+        self.disk_time = 0.0
+        self.stall_time = 0.0
+        self._free = queue.Queue()
+        for _ in range(depth):
+            self._free.put(bytearray(block_size))
+        self._full = queue.Queue(maxsize=depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def get_buffer(self):
+        t = time.perf_counter()
+        buf = self._free.get()
+        self.stall_time += time.perf_counter() - t
+        return buf
+
+    def submit(self, buf, length):
+        if length:
+            self._full.put((buf, length))
+        else:
+            self._free.put(buf)
+
+    def close(self):
+        self._full.put(None)
+        self._thread.join()
+        if self._error:
+            raise self._error
+
+    def _run(self):
+        while (item := self._full.get()) is not None:
+            buf, length = item
+            view = memoryview(buf)[:length]
+            if self.checksum:
+                with profiling.phase("encode"):
+                    self.crc = zlib.crc32(view, self.crc)
+            if self._error is None:
+                t = time.perf_counter()
+                try:
+                    with profiling.phase("syscall"):
+                        self.f.write(view)
+                except OSError as e:
+                    self._error = e
+                self.disk_time += time.perf_counter() - t
+            self._free.put(buf)
+
+
+def recv_into_exact(sock, view, stats=None):
+    """Fill view from sock; return the byte count (short only at EOF)."""
+    filled = 0
+    size = len(view)
+    while filled < size:
+        t = time.perf_counter()
+        with profiling.phase("wait"):
+            n = sock.recv_into(view[filled:])
+        if stats is not None:
+            stats.net_wait += time.perf_counter() - t
+            stats.recv_calls += 1
+            stats.progress += n
+        if not n:
+            if stats is not None:
+                stats.eof = True
+            break
+        filled += n
+    return filled
+
+
+def receive_stream(sock, f, limit=None, block_size=BLOCK_SIZE, depth=QUEUE_DEPTH, stats=None,
+                   checksum=False):
+    """Copy sock to the file object f until EOF or `limit` bytes."""
+    stats = stats or ReceiveStats()
+    writer = BlockWriter(f, block_size, depth, checksum, stats.crc)
+    start = time.perf_counter()
+    try:
+        while limit is None or stats.bytes < limit:
+            buf = writer.get_buffer()
+            want = block_size if limit is None else min(block_size, limit - stats.bytes)
+            n = recv_into_exact(sock, memoryview(buf)[:want], stats)
+            stats.bytes += n
+            writer.submit(buf, n)
+            if stats.eof:
+                break
+    finally:
+        writer.close()
+        stats.duration += time.perf_counter() - start
+        stats.disk_time += writer.disk_time
+        stats.stall_time += writer.stall_time
+        stats.crc = writer.crc
+    return stats
+
+
+def receive_mapped(sock, path, size, stats=None, checksum=False, block_size=BLOCK_SIZE):
+    """Receive exactly `size` bytes straight into a memory-mapped output file."""
+    stats = stats or ReceiveStats()
+    start = time.perf_counter()
+    with open(path, "w+b") as f:
+        if size == 0:
+            return stats
+        f.truncate(size)
+        with mmap.mmap(f.fileno(), size) as mm:
+            view = memoryview(mm)
+            try:
+                while stats.bytes < size and not stats.eof:
+                    with view[stats.bytes:stats.bytes + block_size] as window:
+                        n = recv_into_exact(sock, window, stats)
+                        if checksum:
+                            with profiling.phase("encode"):
+                                stats.crc = zlib.crc32(window[:n], stats.crc)
+                    stats.bytes += n
+            finally:
+                view.release()
+            t = time.perf_counter()
+            mm.flush()
+            stats.disk_time += time.perf_counter() - t
+        if stats.bytes < size:
+            f.truncate(stats.bytes)
+    stats.duration += time.perf_counter() - start
+    return stats
+
+
+class Assembly:
+    """One striped transfer: the output preallocated once, filled range by range from several connections."""
+
+    def __init__(self, path, size, stripes):
+        self.size = size
+        self.stripes = stripes
+        self.remaining = stripes
+        self.bytes = 0
+        self.start = time.time()
+        self.end = None
+        self._lock = threading.Lock()
+        self.f = open(path, "w+b")
+        self.map = None
+        if size and os.path.isfile(path):
+            self.f.truncate(size)
+            self.map = mmap.mmap(self.f.fileno(), size)
+
+    def receive(self, sock, offset, length, stats=None, checksum=False, block_size=BLOCK_SIZE):
+        """Receive the range [offset, offset + length) from sock into place."""
+        stats = stats or ReceiveStats()
+        start = time.perf_counter()
+        end = offset + length
+        pos = offset
+        buf = None if self.map is not None else bytearray(block_size)
+        with memoryview(self.map if self.map is not None else buf) as view:
+            while pos < end and not stats.eof:
+                want = min(block_size, end - pos)
+                with (view[pos:pos + want] if buf is None else view[:want]) as window:
+                    n = recv_into_exact(sock, window, stats)
+                    if checksum:
+                        with profiling.phase("encode"):
+                            stats.crc = zlib.crc32(window[:n], stats.crc)
+                    if buf is not None and n:
+                        t = time.perf_counter()
+                        with profiling.phase("syscall"):
+                            os.pwrite(self.f.fileno(), window[:n], pos)
+                        stats.disk_time += time.perf_counter() - t
+                pos += n
+                stats.bytes += n
+        stats.duration += time.perf_counter() - start
+        return stats
+
+    def finish_stripe(self, received):
+        """Account one finished stripe; True (and the output flushed and closed) once all have arrived."""
+        with self._lock:
+            self.remaining -= 1
+            self.bytes += received
+            if self.remaining:
+                return False
+        self.end = time.time()
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+        self.f.close()
+        return True
+
+
+_assemblies = {}
+_assemblies_lock = threading.Lock()
+
+
+def assembly(transfer_id, path, size, stripes):
+    """The Assembly of a striped transfer, created by whichever stripe arrives first."""
+    with _assemblies_lock:
+        if transfer_id not in _assemblies:
+            _assemblies[transfer_id] = Assembly(path, size, stripes)
+        return _assemblies[transfer_id]
+
+
+def release(transfer_id):
+    with _assemblies_lock:
+        _assemblies.pop(transfer_id, None)
+
+
+def receive_chunks(sock, index, offset, length, stats=None):
+    """Receive [offset, offset + length) sent as chunks + CHUNK_CRC; store the verified chunks in `index`.
+
+    A chunk cut short by the end of the connection is dropped (it stays missing).
+    """
+    stats = stats or ReceiveStats()
+    start = time.perf_counter()
+    buf = bytearray(index.chunk_size + framing.CHUNK_CRC.size)
+    pos, end = offset, offset + length
+    with memoryview(buf) as view:
+        while pos < end:
+            n = min(index.chunk_size, end - pos)
+            with view[:n + framing.CHUNK_CRC.size] as window:
+                if recv_into_exact(sock, window, stats) < len(window):
+                    break
+                data = window[:n]
+                with profiling.phase("encode"):
+                    stats.crc = zlib.crc32(data, stats.crc)
+                    intact = zlib.crc32(data) == framing.CHUNK_CRC.unpack_from(window, n)[0]
+                if intact:
+                    t = time.perf_counter()
+                    with profiling.phase("syscall"):
+                        index.store(pos, data)
+                    stats.disk_time += time.perf_counter() - t
+                else:
+                    stats.rejected += 1
+                data.release()
+            stats.bytes += n
+            pos += n
+    stats.duration += time.perf_counter() - start
+    return stats
+
+
+def receive_file(sock, path, size=None, block_size=BLOCK_SIZE, depth=QUEUE_DEPTH, checksum=False,
+                 prefix=b"", stats=None):
+    """Receive a file to `path`: mmap when the size is known, writer thread otherwise.
+
+    `prefix` is data already read from the socket that belongs at the start.
+    """
+    stats = stats or ReceiveStats()
+    if size is not None and path != os.devnull and not prefix:
+        return receive_mapped(sock, path, size, stats, checksum, block_size)
+    with open(path, "wb") as f:
+        if prefix:
+            f.write(prefix)
+            stats.bytes = stats.progress = len(prefix)
+            stats.crc = zlib.crc32(prefix)
+        limit = None if size is None else size + len(prefix)
+        return receive_stream(sock, f, limit, block_size, depth, stats, checksum)
@@ -0,0 +1,269 @@
+"""Measurement recorder for the timed loops of every client.
+
+Samples go into preallocated ``array`` columns (one block of `block_size`
+rows at a time); the hot path only stores numbers at an index, no
+formatting, no I/O. Full blocks are handed to a writer thread through a
+bounded queue and a free block is taken back from a small pool, the same
+scheme as btperf.receiver.BlockWriter. With background=False blocks are kept
+in memory and written only by close(), after the run.
+
+Output is columnar:
+
+    csv       header row + one row per sample
+    bin       compact native-endian dump: header, then per block a row count
+              followed by each column's raw array (see load())
+    parquet   one row group per block (needs pyarrow)
+
+Columns are names (typecode 'd') or (name, typecode) pairs; integer columns
+('q') keep counters and perf_counter_ns timestamps exact.
+"""
+import array
+import csv
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+FORMATS = ("csv", "bin", "parquet")
+DEFAULT_FORMAT = "csv"
+BLOCK_SIZE = 65536     # rows per block
+QUEUE_DEPTH = 4        # blocks in the pool
+
+BIN_MAGIC = b"BTPR"
+BIN_VERSION = 1
+_BIN_HEADER = struct.Struct("<4sBBH")   # magic, version, little-endian flag, column count
+_BIN_COLUMN = struct.Struct("<cB")      # typecode, name length
+_BIN_BLOCK = struct.Struct("<I")        # rows in block
+
+
+def now_ns():
+    return time.perf_counter_ns()
+
+
+def _parse_columns(columns):
+    names, typecodes = [], []
+    for column in columns:
+        name, typecode = (column, "d") if isinstance(column, str) else column
+        names.append(name)
+        typecodes.append(typecode)
+    return tuple(names), tuple(typecodes)
+
+
+class _CsvSink:
+    def __init__(self, path, names, typecodes):
+        self.f = open(path, "w", newline="")
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(names)
+
+    def write(self, columns, rows):
+        self.writer.writerows(zip(*(column[:rows] for column in columns)))
+
+    def close(self):
+        self.f.close()
+
+
+class _BinSink:
+    def __init__(self, path, names, typecodes):
+        self.f = open(path, "wb")
+        self.f.write(_BIN_HEADER.pack(BIN_MAGIC, BIN_VERSION, sys.byteorder == "little", len(names)))
+        for name, typecode in zip(names, typecodes):
+            encoded = name.encode()
+            self.f.write(_BIN_COLUMN.pack(typecode.encode(), len(encoded)) + encoded)
+
+    def write(self, columns, rows):
+        self.f.write(_BIN_BLOCK.pack(rows))
+        for column in columns:
+            with memoryview(column)[:rows] as view:
+                self.f.write(view)
+
+    def close(self):
+        self.f.close()
+
+
+class _ParquetSink:
+    def __init__(self, path, names, typecodes):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("The parquet log format needs pyarrow (pip install pyarrow)") from None
+        self.pa = pyarrow
+        self.names = names
+        types = {"d": pyarrow.float64(), "f": pyarrow.float32(), "q": pyarrow.int64(), "Q": pyarrow.uint64(),
+                 "i": pyarrow.int32(), "I": pyarrow.uint32()}
+        self.schema = pyarrow.schema([(n, types[t]) for n, t in zip(names, typecodes)])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, columns, rows):
+        arrays = [self.pa.array(memoryview(column)[:rows], type=field.type)
+                  for column, field in zip(columns, self.schema)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+_SINKS = {"csv": _CsvSink, "bin": _BinSink, "parquet": _ParquetSink}
+
+
+def format_of(path):
+    ext = os.path.splitext(path)[1].lstrip(".").lower()
+    return ext if ext in FORMATS else DEFAULT_FORMAT
+
+
+class Recorder:
+    """Append-only sample log: record(*values) in the timed loop, close() afterwards."""
+
+    def __init__(self, path, columns, fmt=None, block_size=BLOCK_SIZE, depth=QUEUE_DEPTH, background=True):
+        self.path = path
+        self.names, self.typecodes = _parse_columns(columns)
+        self.fmt = fmt or format_of(path)
+        if self.fmt not in FORMATS:
+            raise ValueError(f"Unknown log format '{self.fmt}' (expected one of {', '.join(FORMATS)})")
+        self.block_size = block_size
+        self.background = background
+        self.rows = 0
+        self.write_time = 0.0
+        self.stall_time = 0.0
+        self._sink = _SINKS[self.fmt](path, self.names, self.typecodes)
+        self._pending = []
+        self._free = queue.Queue()
+        for _ in range(depth if background else 1):
+            self._free.put(self._new_block())
+        self._full = queue.Queue(maxsize=depth)
+        self._error = None
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._block = self._free.get()
+        self._index = 0
+
+    def _new_block(self):
+        return [array.array(t, bytes(array.array(t).itemsize * self.block_size)) for t in self.typecodes]
+
+    def record(self, *values):
+        i = self._index
+        for column, value in zip(self._block, values):
+            column[i] = value
+        i += 1
+        self._index = i
+        if i == self.block_size:
+            self._rotate()
+
+    def _rotate(self):
+        rows, block = self._index, self._block
+        self.rows += rows
+        if self.background:
+            self._full.put((block, rows))
+            t = time.perf_counter()
+            self._block = self._free.get()
+            self.stall_time += time.perf_counter() - t
+        else:
+            self._pending.append((block, rows))
+            self._block = self._new_block()
+        self._index = 0
+
+    def column(self, name):
+        """Samples of the current, not yet flushed block (e.g. for a live summary)."""
+        return self._block[self.names.index(name)][:self._index]
+
+    def close(self):
+        """Flush every sample to disk; returns the number of rows written."""
+        if self._block is None:
+            return self.rows
+        if self._index:
+            self._rotate()
+        self._block = None
+        if self.background:
+            self._full.put(None)
+            self._thread.join()
+        else:
+            for block, rows in self._pending:
+                self._write(block, rows)
+            self._pending = []
+        self._sink.close()
+        if self._error:
+            raise self._error
+        return self.rows
+
+    def _write(self, block, rows):
+        if self._error is None:
+            t = time.perf_counter()
+            try:
+                self._sink.write(block, rows)
+            except OSError as e:
+                self._error = e
+            self.write_time += time.perf_counter() - t
+
+    def _run(self):
+        while (item := self._full.get()) is not None:
+            block, rows = item
+            self._write(block, rows)
+            self._free.put(block)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load(path):
+    """Read a log written by Recorder; returns {column name: array}."""
+    fmt = format_of(path)
+    if fmt == "bin":
+        with open(path, "rb") as f:
+            magic, version, little, count = _BIN_HEADER.unpack(f.read(_BIN_HEADER.size))
+            if magic != BIN_MAGIC or version != BIN_VERSION:
+                raise ValueError(f"{path} is not a btperf binary log")
+            columns = {}
+            for _ in range(count):
+                typecode, length = _BIN_COLUMN.unpack(f.read(_BIN_COLUMN.size))
+                columns[f.read(length).decode()] = array.array(typecode.decode())
+            while header := f.read(_BIN_BLOCK.size):
+                rows, = _BIN_BLOCK.unpack(header)
+                for column in columns.values():
+                    column.frombytes(f.read(rows * column.itemsize))
+        if bool(little) != (sys.byteorder == "little"):
+            for column in columns.values():
+                column.byteswap()
+        return columns
+    if fmt == "parquet":
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path)
+        return {name: array.array("q" if str(table.schema.field(name).type).startswith(("int", "uint")) else "d",
+                                  table.column(name).to_pylist())
+                for name in table.column_names}
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        names = next(reader)
+        rows = list(reader)
+    columns = {}
+    for i, name in enumerate(names):
+        values = [row[i] for row in rows]
+        try:
+            columns[name] = array.array("q", map(int, values))
+        except ValueError:
+            columns[name] = array.array("d", map(float, values))
+    return columns
+
+
+def add_arguments(parser):
+    """Register --log-dir/--log-format on a parser."""
+    parser.add_argument("--log-dir", default=".", help="directory for the per-run sample logs")
+    parser.add_argument("--log-format", choices=FORMATS, default=DEFAULT_FORMAT,
+                        help="sample log format: csv, compact binary, or parquet (needs pyarrow)")
+    return parser
+
+
+def log_path(args, stem):
+    """<log dir>/<stem>.<format extension> for the options of add_arguments."""
+    os.makedirs(args.log_dir, exist_ok=True)
+    return os.path.join(args.log_dir, f"{stem}.{args.log_format}")
+
+
+def from_args(args, stem, columns, **options):
+    return Recorder(log_path(args, stem), columns, args.log_format, **options)
@@ -0,0 +1,158 @@
+"""Cached device and service resolution for the classic clients.
+
+A device inquiry costs ~8 s and an SDP query about one more; both used to
+run on every launch. The resolver keeps what they found in a small JSON
+file shared by every client and process:
+
+    names     device name -> address, valid for ADDRESS_TTL
+    services  (address, SDP service name) -> RFCOMM channel, valid for SERVICE_TTL
+
+Inquiry and SDP run only on a miss or an expired entry. When a connection
+made from cached values fails, those entries are dropped and resolution is
+retried once from scratch (the server may have moved to another channel or
+another adapter).
+"""
+import json
+import os
+import threading
+import time
+
+from btperf import transport
+
+CACHE_PATH = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                          "btperf", "resolver.json")
+ADDRESS_TTL = 7 * 24 * 3600     # addresses of the Pis do not change
+SERVICE_TTL = 3600              # PORT_ANY channels can change when the server restarts
+INQUIRY_DURATION = 8
+
+
+def _now():
+    return time.time()
+
+
+class Resolver:
+    def __init__(self, path=CACHE_PATH, address_ttl=ADDRESS_TTL, service_ttl=SERVICE_TTL, enabled=True):
+        self.path = path
+        self.address_ttl = address_ttl
+        self.service_ttl = service_ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._data = {"names": {}, "services": {}}
+        if enabled and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                self._data = {"names": data.get("names", {}), "services": data.get("services", {})}
+            except (OSError, ValueError):
+                pass
+
+    def _save(self):
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._data, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def _get(self, table, key, ttl):
+        entry = self._data[table].get(key)
+        if entry and _now() - entry["time"] < ttl:
+            return entry["value"]
+        return None
+
+    def _put(self, table, key, value):
+        with self._lock:
+            self._data[table][key] = {"value": value, "time": _now()}
+            self._save()
+
+    # --- lookups ---
+
+    def cached_address(self, name):
+        return self._get("names", name, self.address_ttl) if self.enabled else None
+
+    def address(self, name, duration=INQUIRY_DURATION):
+        """Address advertising `name`; inquiry only on a cache miss."""
+        address = self.cached_address(name)
+        if address:
+            return address
+        print(f"[RESOLVER] Inquiry for '{name}' ({duration}s)...")
+        address = transport.lookup_address(name, duration)
+        if address:
+            self._put("names", name, address)
+        return address
+
+    def cached_channel(self, address, service):
+        return self._get("services", f"{address}/{service}", self.service_ttl) if self.enabled else None
+
+    def channel(self, address, service):
+        """RFCOMM channel of SDP service `service` on `address` (None if not advertised)."""
+        channel = self.cached_channel(address, service)
+        if channel:
+            return channel
+        import bluetooth
+        for record in bluetooth.find_service(name=service, address=address):
+            if record.get("protocol") == "RFCOMM" and record.get("port"):
+                self._put("services", f"{address}/{service}", record["port"])
+                return record["port"]
+        return None
+
+    def invalidate(self, name=None, address=None):
+        """Drop the entries for a device name and/or everything cached for an address."""
+        with self._lock:
+            if name:
+                self._data["names"].pop(name, None)
+            if address:
+                self._data["names"] = {n: e for n, e in self._data["names"].items() if e["value"] != address}
+                self._data["services"] = {k: e for k, e in self._data["services"].items()
+                                          if not k.startswith(address + "/")}
+            self._save()
+
+    # --- connection ---
+
+    def connect(self, spec, name=None, address=None, channel=None, service=None, timeout=None):
+        """transport.connect() with the address and channel resolved through the cache.
+
+        Stand-in transports connect directly. For rfcomm, `address` defaults to
+        the device called `name` and `service` (if given) overrides `channel`
+        with the advertised SDP channel; a failure with cached values
+        invalidates them and retries once with fresh lookups.
+        """
+        if not transport.needs_discovery(spec):
+            return transport.connect(spec, address, channel, timeout)
+        for attempt in (0, 1):
+            target = address
+            used_cache = False
+            if target is None:
+                if name is None:
+                    raise ValueError("rfcomm needs a device address or name")
+                used_cache = self.cached_address(name) is not None
+                target = self.address(name)
+                if target is None:
+                    raise LookupError(f"device '{name}' not found")
+            port = channel
+            if service:
+                used_cache = used_cache or self.cached_channel(target, service) is not None
+                port = self.channel(target, service) or channel
+            try:
+                return transport.connect(spec, target, port, timeout)
+            except OSError:
+                if attempt or not used_cache:
+                    raise
+                print(f"[RESOLVER] Connection to {target} channel {port} failed, refreshing cache...")
+                self.invalidate(name=name if address is None else None, address=target)
+
+
+def add_arguments(parser):
+    """Register --no-resolver-cache/--refresh on a parser."""
+    parser.add_argument("--no-resolver-cache", action="store_true",
+                        help="always run inquiry/SDP instead of using the resolver cache")
+    parser.add_argument("--refresh", action="store_true", help="drop cached entries for this server first")
+    return parser
+
+
+def from_args(args, name=None):
+    resolver = Resolver(enabled=not args.no_resolver_cache)
+    if args.refresh:
+        resolver.invalidate(name=name, address=getattr(args, "address", None))
+    return resolver
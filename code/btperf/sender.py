@@ -0,0 +1,229 @@
+"""File-send engine for the classic file clients.
+
+The source file is never copied through Python ``bytes``:
+
+* sendfile: ``os.sendfile`` pushes page-cache pages to the socket in
+  `chunk_size` pieces (falls back to mmap when the socket type refuses it);
+* mmap: the file is memory-mapped and ``memoryview`` slices go out with
+  ``sendall``, which also guarantees nothing is silently dropped.
+
+With checksum=True the CRC-32 for btperf.framing is folded in chunk by chunk
+from the mapping while sending, not in a separate pass over the file. A
+`progress` object (btperf.monitor.RateMonitor) has its `count` advanced after
+every send call. `offset`/`length` send one range of the file (a stripe).
+With a btperf.compress codec the range goes through a streaming compressor
+instead and out as BLOCK frames (the CRC is still over the original bytes).
+With `frame` (resumable transfers) every `frame` bytes are followed by their
+own CRC-32 (btperf.framing.CHUNK_CRC).
+
+StripedLink drives several connections at once for striped transfers: the
+file is split into contiguous ranges (split_ranges) and each connection's
+range is sent from a thread pool. The stripes share one progress object
+through share_progress(), which adds their counts under a lock.
+"""
+import mmap
+import os
+import threading
+import time
+import zlib
+
+from btperf import compress, framing, profiling
+
+CHUNK_SIZE = 1024
+MODES = ("auto", "sendfile", "mmap")
+
+
+class _Crc:
+    def __init__(self, view):
+        self.view = view
+        self.value = 0
+
+    def update(self, start, end):
+        if self.view is not None:
+            self.value = zlib.crc32(self.view[start:end], self.value)
+
+
+def _send_mapped(sock, view, start, end, chunk_size, crc, progress):
+    for pos in range(start, end, chunk_size):
+        # Scoped slice: a failed send must not leave the mapping exported (mm.close() would refuse)
+        with view[pos:min(pos + chunk_size, end)] as chunk:
+            if crc.view is not None:
+                with profiling.phase("encode"):
+                    crc.value = zlib.crc32(chunk, crc.value)
+            with profiling.phase("syscall"):
+                sock.sendall(chunk)
+            if progress is not None:
+                progress.count += len(chunk)
+    return end - start
+
+
+def _send_sendfile(sock, f, start, end, chunk_size, crc, progress):
+    out_fd, in_fd = sock.fileno(), f.fileno()
+    offset = start
+    while offset < end:
+        try:
+            with profiling.phase("syscall"):
+                sent = os.sendfile(out_fd, in_fd, offset, min(chunk_size, end - offset))
+        except BlockingIOError:
+            continue
+        except OSError:
+            if offset == start:
+                return None     # socket family without sendfile support
+            raise
+        if sent == 0:
+            break
+        with profiling.phase("encode"):
+            crc.update(offset, offset + sent)
+        offset += sent
+        if progress is not None:
+            progress.count += sent
+    return offset - start
+
+
+def _send_framed(sock, view, start, end, chunk_size, crc, progress, frame):
+    for pos in range(start, end, frame):
+        stop = min(pos + frame, end)
+        with view[pos:stop] as chunk, profiling.phase("encode"):
+            chunk_crc = zlib.crc32(chunk)
+            if crc.view is not None:
+                crc.value = zlib.crc32(chunk, crc.value)
+        _send_mapped(sock, view, pos, stop, chunk_size, _Crc(None), progress)
+        with profiling.phase("syscall"):
+            sock.sendall(framing.CHUNK_CRC.pack(chunk_crc))
+    return end - start
+
+
+def _send_compressed(sock, view, start, end, chunk_size, crc, progress, codec):
+    compressor, flush = codec.compressor()
+    wire = 0
+
+    def frame(data):
+        nonlocal wire
+        if not data:
+            return
+        with profiling.phase("syscall"):
+            sock.sendall(framing.BLOCK.pack(len(data)))
+        for pos in range(0, len(data), chunk_size):
+            chunk = data[pos:pos + chunk_size]
+            with profiling.phase("syscall"):
+                sock.sendall(chunk)
+            if progress is not None:
+                progress.count += len(chunk)
+        wire += framing.BLOCK.size + len(data)
+
+    for pos in range(start, end, compress.BLOCK_SIZE):
+        with view[pos:min(pos + compress.BLOCK_SIZE, end)] as block, profiling.phase("encode"):
+            if crc.view is not None:
+                crc.value = zlib.crc32(block, crc.value)
+            data = compressor(block)
+        frame(data)
+    with profiling.phase("encode"):
+        data = flush()
+    frame(data)
+    sock.sendall(framing.BLOCK.pack(0))
+    return wire + framing.BLOCK.size
+
+
+class StripedLink:
+    """Several connections used together; one worker thread per connection.
+
+    Records meant for the whole link (btperf.framing.end_session) go out on
+    every connection through sendall().
+    """
+
+    def __init__(self, socks):
+        from concurrent.futures import ThreadPoolExecutor     # striped runs only: kept out of startup
+        self.socks = list(socks)
+        self.pool = ThreadPoolExecutor(max_workers=len(self.socks))
+
+    def __len__(self):
+        return len(self.socks)
+
+    def map(self, fn):
+        """fn(index, sock) on every connection in parallel; returns the results in order."""
+        return list(self.pool.map(fn, range(len(self.socks)), self.socks))
+
+    def sendall(self, data):
+        for sock in self.socks:
+            sock.sendall(data)
+
+    def close(self):
+        self.pool.shutdown()
+        for sock in self.socks:
+            sock.close()
+
+
+class _StripeProgress:
+    """One stripe's view of a shared progress object: `count += n` adds n to it under a lock.
+
+    The stripe's own count is only touched by its thread; the shared one by every stripe.
+    """
+
+    def __init__(self, progress, lock):
+        self._progress = progress
+        self._lock = lock
+        self._count = 0
+
+    @property
+    def count(self):
+        return self._count
+
+    @count.setter
+    def count(self, value):
+        delta = value - self._count
+        self._count = value
+        with self._lock:
+            self._progress.count += delta
+
+
+def share_progress(progress, count):
+    """`count` progress objects for concurrent stripes, all adding up into `progress` (Nones without one)."""
+    if progress is None:
+        return [None] * count
+    lock = threading.Lock()
+    return [_StripeProgress(progress, lock) for _ in range(count)]
+
+
+def split_ranges(size, count, align=CHUNK_SIZE):
+    """`count` contiguous (offset, length) ranges covering `size` bytes, boundaries on multiples of `align`."""
+    step = -(-size // count)
+    step = -(-step // align) * align if align > 0 else step
+    return [(min(k * step, size), max(0, min(step, size - k * step))) for k in range(count)]
+
+
+def send_file(sock, path, chunk_size=CHUNK_SIZE, mode="auto", checksum=False, progress=None, offset=0,
+              length=None, codec=None, frame=None):
+    """Send the file (or `length` bytes from `offset`), compressed with `codec` or in CRC'd `frame`s if given.
+
+    Returns (bytes sent on the wire, duration in seconds, mode or codec used, CRC-32 or None).
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown send mode '{mode}' (expected one of {', '.join(MODES)})")
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else None
+        view = memoryview(mm) if mm is not None else memoryview(b"")
+        end = size if length is None else min(size, offset + length)
+        crc = _Crc(view if checksum else None)
+        try:
+            start = time.perf_counter()
+            sent = None
+            if codec is not None:
+                sent = _send_compressed(sock, view, offset, end, chunk_size, crc, progress, codec)
+                used = str(codec)
+            elif frame:
+                sent = _send_framed(sock, view, offset, end, chunk_size, crc, progress, frame)
+                used = "resumable"
+            elif mode in ("auto", "sendfile") and hasattr(os, "sendfile"):
+                sent = _send_sendfile(sock, f, offset, end, chunk_size, crc, progress)
+                used = "sendfile"
+            if sent is None:
+                sent = _send_mapped(sock, view, offset, end, chunk_size, crc, progress)
+                used = "mmap"
+            duration = time.perf_counter() - start
+        finally:
+            crc.view = None
+            view.release()
+            if mm is not None:
+                mm.close()
+    return sent, duration, used, (crc.value if checksum else None)
@@ -0,0 +1,88 @@
+"""Repeated trials over one connection (session mode) or one connection each.
+
+Connection setup (inquiry/SDP aside, see resolver.py: the RFCOMM or GATT
+connect itself) used to be inside every run, which dominates short
+transfers. Clients now run `--repeat` trials over a single connection and
+time its setup separately; `--reconnect` restores one connection per trial
+to measure exactly that cost.
+
+Every connection opened is logged as one row of CONNECT_COLUMNS
+(connect_<timestamp> log): the first trial it carried and its setup time.
+With `retries`, a trial whose connection breaks is run again over a new
+connection (the file client's --resume then only resends what is missing).
+"""
+import time
+
+from btperf import framing
+
+REPETITIONS = 1
+RETRY_DELAY = 1.0       # seconds before reconnecting after a broken connection
+CONNECT_COLUMNS = (("trial", "q"), ("connect_ns", "q"))
+
+
+def timed(connect):
+    """(connection, setup time in ns) of connect()."""
+    t = time.perf_counter_ns()
+    conn = connect()
+    return conn, time.perf_counter_ns() - t
+
+
+def connections(trials, reconnect):
+    """Connections a server must accept for `trials` trials."""
+    return trials if reconnect else 1
+
+
+def run_trials(connect, trials, run, reconnect=False, framed=True, log=None, retries=0):
+    """Call run(sock, trial, session) for every trial; returns the setup times (ns).
+
+    Without `reconnect` all trials share one connection: framed trials are
+    sent in session mode (`session` is True) and the session ends with BYE.
+    A trial failing with a connection or protocol error is retried over a
+    new connection up to `retries` times.
+    """
+    session = framed and not reconnect and trials > 1
+    setups = []
+    sock = None
+    try:
+        for trial in range(trials):
+            attempt = 0
+            while True:
+                try:
+                    if sock is None:
+                        sock, setup = timed(connect)
+                        setups.append(setup)
+                        print(f"[CLIENT] Connection setup: {setup / 1e6:.1f} ms")
+                        if log is not None:
+                            log.record(trial, setup)
+                    run(sock, trial, session)
+                    break
+                except (OSError, framing.ProtocolError) as e:
+                    if attempt >= retries:
+                        raise
+                    attempt += 1
+                    print(f"[CLIENT] Trial {trial} failed ({e}); reconnecting, retry {attempt}/{retries}")
+                    if sock is not None:
+                        sock.close()
+                        sock = None
+                    time.sleep(RETRY_DELAY)
+            if reconnect:
+                sock.close()
+                sock = None
+        if session:
+            framing.end_session(sock)
+    finally:
+        if sock is not None:
+            sock.close()
+    if trials > 1:
+        mean = sum(setups) / len(setups) / 1e6
+        print(f"[CLIENT] {trials} trials over {len(setups)} connection(s), setup {mean:.1f} ms on average")
+    return setups
+
+
+def add_arguments(parser):
+    """Register --repeat/--reconnect on a parser."""
+    parser.add_argument("--repeat", type=int, default=REPETITIONS,
+                        help="trials to run back to back (default: %(default)s)")
+    parser.add_argument("--reconnect", action="store_true",
+                        help="open a new connection for every trial instead of reusing one")
+    return parser
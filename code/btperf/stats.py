@@ -0,0 +1,289 @@
+"""Streaming latency statistics in constant memory.
+
+Nothing here keeps the samples themselves, so a soak test of millions of
+pings costs the same memory as ten:
+
+    Histogram      HDR-style log-bucketed counts of integer values (ns):
+                   exact below 2**SUB_BUCKET_BITS, then every power of two is
+                   split into 2**(SUB_BUCKET_BITS-1) linear sub-buckets, so a
+                   percentile is within 1/128 (0.8 %) of the true value
+    Welford        running mean / variance / min / max
+    Jitter         RFC 3550 interarrival jitter estimator, J += (|D| - J) / 16
+    LossTracker    losses and loss bursts (runs of consecutive lost probes)
+    LatencyStats   all of the above for one stream of RTTs
+
+Every class has merge(other), so per-interval snapshots can be folded into a
+per-run total, and per-run or per-worker results into a campaign total.
+"""
+import array
+import copy
+import math
+
+SUB_BUCKET_BITS = 8
+MAX_VALUE_BITS = 44          # ~4.9 hours in ns; larger values land in the top bucket
+PERCENTILES = (50.0, 95.0, 99.0, 99.9)
+
+
+class Histogram:
+    def __init__(self, sub_bucket_bits=SUB_BUCKET_BITS, max_value_bits=MAX_VALUE_BITS):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.max_value_bits = max_value_bits
+        self._sub_count = 1 << sub_bucket_bits
+        self._half = self._sub_count >> 1
+        size = self._sub_count + (max_value_bits - sub_bucket_bits) * self._half
+        self.counts = array.array("Q", bytes(8 * size))
+        self.count = 0
+        self.overflow = 0
+
+    def _index(self, value):
+        if value < self._sub_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self._sub_count + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def _bounds(self, index):
+        """(lowest, highest) value counted in bucket `index`."""
+        if index < self._sub_count:
+            return index, index
+        shift, sub = divmod(index - self._sub_count, self._half)
+        shift += 1
+        low = (sub + self._half) << shift
+        return low, low + (1 << shift) - 1
+
+    def record(self, value, count=1):
+        value = max(0, int(value))
+        index = self._index(value)
+        if index >= len(self.counts):
+            index = len(self.counts) - 1
+            self.overflow += count
+        self.counts[index] += count
+        self.count += count
+
+    def percentile(self, p):
+        """Value below which p % of the recorded values fall (bucket midpoint)."""
+        if not self.count:
+            return math.nan
+        rank = max(1, math.ceil(p / 100.0 * self.count))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                low, high = self._bounds(index)
+                return (low + high) / 2
+        return self._bounds(len(self.counts) - 1)[1]
+
+    def merge(self, other):
+        if (other.sub_bucket_bits, other.max_value_bits) != (self.sub_bucket_bits, self.max_value_bits):
+            raise ValueError("cannot merge histograms with different bucket layouts")
+        for index, n in enumerate(other.counts):
+            if n:
+                self.counts[index] += n
+        self.count += other.count
+        self.overflow += other.overflow
+        return self
+
+    def buckets(self):
+        """Yield (low, high, count) for every non-empty bucket."""
+        for index, n in enumerate(self.counts):
+            if n:
+                yield (*self._bounds(index), n)
+
+
+class Welford:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else math.nan
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance) if self.count else math.nan
+
+    def merge(self, other):
+        """Chan et al. parallel combination of two running moments."""
+        if not other.count:
+            return self
+        n = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / n
+        self.mean += delta * other.count / n
+        self.count = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+
+class Jitter:
+    """RFC 3550 section 6.4.1 estimator fed with transit times (or RTTs)."""
+
+    def __init__(self):
+        self.value = 0.0
+        self.samples = 0
+        self._last = None
+
+    def add(self, transit):
+        if self._last is not None:
+            self.value += (abs(transit - self._last) - self.value) / 16.0
+            self.samples += 1
+        self._last = transit
+
+    def merge(self, other):
+        # The estimator is a running filter; combine intervals weighted by samples
+        total = self.samples + other.samples
+        if total:
+            self.value = (self.value * self.samples + other.value * other.samples) / total
+        self.samples = total
+        if other._last is not None:
+            self._last = other._last
+        return self
+
+
+class LossTracker:
+    def __init__(self):
+        self.received = 0
+        self.lost = 0
+        self.bursts = 0
+        self.max_burst = 0
+        self.burst_lengths = {}    # burst length -> occurrences (closed bursts)
+        self._run = 0              # open burst: losses since the last received probe
+        self._lead = 0             # losses before the first received probe
+
+    def add(self, ok):
+        if ok:
+            self.received += 1
+            self._end_burst()
+        else:
+            self.lost += 1
+            self._run += 1
+            if not self.received:
+                self._lead += 1
+            if self._run == 1:
+                self.bursts += 1
+            self.max_burst = max(self.max_burst, self._run)
+
+    def _end_burst(self):
+        if self._run:
+            self.burst_lengths[self._run] = self.burst_lengths.get(self._run, 0) + 1
+            self._run = 0
+
+    @property
+    def loss_rate(self):
+        total = self.received + self.lost
+        return self.lost / total if total else 0.0
+
+    def close(self):
+        """End the open burst: the stream is over (e.g. before merging it with an independent one)."""
+        self._end_burst()
+        return self
+
+    def merge(self, other):
+        """Append `other`, the continuation of this stream: an open burst runs on into its leading losses."""
+        lengths = dict(other.burst_lengths)
+        joined = self._run + other._lead
+        bursts = self.bursts + other.bursts
+        if self._run and other._lead:
+            bursts -= 1                 # one burst across the boundary, counted on both sides
+            if other.received:          # ... that `other` saw closed at its first received probe
+                lengths[other._lead] -= 1
+                if not lengths[other._lead]:
+                    del lengths[other._lead]
+        if self._run and other.received:
+            lengths[joined] = lengths.get(joined, 0) + 1
+        if not self.received:
+            self._lead += other._lead
+        self._run = other._run if other.received else joined
+        self.received += other.received
+        self.lost += other.lost
+        self.bursts = bursts
+        self.max_burst = max(self.max_burst, other.max_burst, joined)
+        for length, n in lengths.items():
+            self.burst_lengths[length] = self.burst_lengths.get(length, 0) + n
+        return self
+
+
+class LatencyStats:
+    """RTT distribution, moments, jitter and losses of one probe stream (values in ns)."""
+
+    def __init__(self):
+        self.histogram = Histogram()
+        self.moments = Welford()
+        self.jitter = Jitter()
+        self.loss = LossTracker()
+
+    def add(self, rtt_ns):
+        self.histogram.record(rtt_ns)
+        self.moments.add(rtt_ns)
+        self.jitter.add(rtt_ns)
+        self.loss.add(True)
+
+    def add_loss(self):
+        self.loss.add(False)
+
+    @property
+    def count(self):
+        return self.moments.count
+
+    def percentile(self, p):
+        return self.histogram.percentile(p)
+
+    def snapshot(self):
+        """Independent copy, e.g. to keep an interval before reset()."""
+        return copy.deepcopy(self)
+
+    def reset(self):
+        self.__init__()
+
+    def close(self):
+        """End the stream's open loss burst (see LossTracker.close)."""
+        self.loss.close()
+        return self
+
+    def merge(self, other):
+        self.histogram.merge(other.histogram)
+        self.moments.merge(other.moments)
+        self.jitter.merge(other.jitter)
+        self.loss.merge(other.loss)
+        return self
+
+    def to_dict(self):
+        """Plain summary in milliseconds."""
+        ms = 1e-6
+        out = {
+            "count": self.count,
+            "lost": self.loss.lost,
+            "loss_rate": self.loss.loss_rate,
+            "loss_bursts": self.loss.bursts,
+            "max_loss_burst": self.loss.max_burst,
+            "mean_ms": self.moments.mean * ms if self.count else math.nan,
+            "stdev_ms": self.moments.stdev * ms,
+            "min_ms": self.moments.min * ms if self.count else math.nan,
+            "max_ms": self.moments.max * ms if self.count else math.nan,
+            "jitter_ms": self.jitter.value * ms,
+        }
+        for p in PERCENTILES:
+            out[f"p{p:g}_ms"] = self.percentile(p) * ms
+        return out
+
+    def summary(self):
+        d = self.to_dict()
+        percentiles = " ".join(f"p{p:g}={d[f'p{p:g}_ms']:.2f}" for p in PERCENTILES)
+        return (f"n={d['count']} mean={d['mean_ms']:.2f} ms {percentiles} ms "
+                f"min={d['min_ms']:.2f} max={d['max_ms']:.2f} stdev={d['stdev_ms']:.2f} "
+                f"jitter={d['jitter_ms']:.2f} ms lost={d['lost']} ({d['loss_rate'] * 100:.2f} %, "
+                f"{d['loss_bursts']} bursts, longest {d['max_loss_burst']})")
@@ -0,0 +1,414 @@
+"""Pluggable transport layer for the classic client/server scripts.
+
+A transport is selected with a spec string: a kind, optionally followed by
+``:key=value,...`` options.
+
+    rfcomm      real Bluetooth RFCOMM link (default, needs PyBluez on the server)
+    tcp         TCP on localhost, port TCP_BASE_PORT + channel
+    unix        AF_UNIX stream socket, one path per channel
+    sim         in-process socketpair, client and server roles in one process
+    sim:rate=20000,latency=0.01,loss=0.02
+                in-process link shaped to 20000 B/s, 10 ms one-way latency and
+                2 % of segments retransmitted (RFCOMM is reliable, so loss shows
+                up as extra delay, never as missing bytes)
+    sim:drop=500000
+                link cut after 500000 bytes from client to server on every
+                connection, like an RFCOMM link lost at the edge of range
+
+connect() and accept() always hand back a standard ``socket.socket`` so the
+scripts can use recv_into, sendall, sendfile and selectors on any link.
+Running the same script over tcp/sim gives the harness's own ceiling, which
+tells a slow link apart from slow Python.
+"""
+import collections
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+
+KINDS = ("rfcomm", "tcp", "unix", "sim")
+DEFAULT_TRANSPORT = "rfcomm"
+TCP_BASE_PORT = 50000
+LOCALHOST = "127.0.0.1"
+PEER_STOP_TIMEOUT = 5.0     # seconds stop_peers() waits for the peer threads
+
+# Options understood by the sim transport and their defaults
+SIM_DEFAULTS = {
+    "rate": 0.0,         # bytes/s, 0 = unlimited
+    "latency": 0.0,      # one-way delay in seconds
+    "loss": 0.0,         # probability that a segment is retransmitted
+    "rto": 0.0,          # retransmission penalty, defaults to max(2*latency, 10 ms)
+    "mtu": 1011.0,       # segment size (default RFCOMM MTU on BlueZ)
+    "buffer": 65536.0,   # bytes queued in the link before the sender blocks
+    "seed": 0.0,         # loss RNG seed
+    "drop": 0.0,         # bytes client -> server after which each connection is cut, 0 = never
+}
+
+
+def parse_spec(spec):
+    """Split 'kind:key=value,...' into (kind, options)."""
+    kind, _, rest = (spec or DEFAULT_TRANSPORT).partition(":")
+    kind = kind.strip().lower()
+    if kind not in KINDS:
+        raise ValueError(f"Unknown transport '{kind}' (expected one of {', '.join(KINDS)})")
+    options = {}
+    for item in filter(None, (p.strip() for p in rest.split(","))):
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"Malformed transport option '{item}' in '{spec}'")
+        options[key.strip()] = float(value)
+    if kind == "sim":
+        unknown = set(options) - set(SIM_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown sim option(s): {', '.join(sorted(unknown))}")
+        options = {**SIM_DEFAULTS, **options}
+    return kind, options
+
+
+def in_process(spec):
+    """True when both roles must live in the same process (sim transport)."""
+    return parse_spec(spec)[0] == "sim"
+
+
+def needs_discovery(spec):
+    """Only a real RFCOMM link needs a device inquiry to find the peer."""
+    return parse_spec(spec)[0] == "rfcomm"
+
+
+def unix_path(channel):
+    return os.path.join(tempfile.gettempdir(), f"btperf-{channel}.sock")
+
+
+# ---------------------------------------------------------------------------
+# Client side
+# ---------------------------------------------------------------------------
+
+def connect(spec, address, channel, timeout=None):
+    """Open a client connection and return a standard socket."""
+    kind, options = parse_spec(spec)
+    if kind == "rfcomm":
+        if hasattr(socket, "AF_BLUETOOTH"):
+            sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+        else:
+            import bluetooth
+            sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+        sock.settimeout(timeout)
+        sock.connect((address, channel))
+        sock.settimeout(None)
+        return sock
+    if kind == "tcp":
+        sock = socket.create_connection((address or LOCALHOST, TCP_BASE_PORT + channel), timeout=timeout)
+        sock.settimeout(None)
+        # RFCOMM has no Nagle; keep small echoes from being held back
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+    if kind == "unix":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address if address and os.sep in address else unix_path(channel))
+        sock.settimeout(None)
+        return sock
+    return _sim_connect(channel, options, timeout)
+
+
+def lookup_address(target_name, duration=8):
+    """Run a device inquiry and return the address advertising target_name."""
+    import bluetooth
+    nearby_devices = bluetooth.discover_devices(duration=duration, lookup_names=True)
+    for addr, name in nearby_devices:
+        if name == target_name:
+            return addr
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Server side
+# ---------------------------------------------------------------------------
+
+def listen(spec, channel, backlog=1, advertise=None):
+    """Bind a listening socket for the given transport.
+
+    For rfcomm, channel may be bluetooth.PORT_ANY (0) and advertise is the SDP
+    service name to publish (needs PyBluez). The stand-in transports map
+    PORT_ANY to channel 1, the first channel BlueZ hands out.
+    """
+    kind, options = parse_spec(spec)
+    if kind != "rfcomm" and channel == 0:
+        channel = 1
+    if kind == "rfcomm":
+        import bluetooth
+        server_sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+        server_sock.bind(("", channel))
+        server_sock.listen(backlog)
+        if advertise:
+            bluetooth.advertise_service(server_sock, advertise,
+                                        service_classes=[bluetooth.SERIAL_PORT_CLASS],
+                                        profiles=[bluetooth.SERIAL_PORT_PROFILE])
+        return server_sock
+    if kind == "tcp":
+        server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_sock.bind(("", TCP_BASE_PORT + channel))
+        server_sock.listen(backlog)
+        return server_sock
+    if kind == "unix":
+        path = unix_path(channel)
+        if os.path.exists(path):
+            os.unlink(path)
+        server_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_sock.bind(path)
+        server_sock.listen(backlog)
+        return server_sock
+    return _SimListener(channel, options)
+
+
+def accept(server_sock):
+    """Accept a connection and return (standard socket, peer info)."""
+    client_sock, client_info = server_sock.accept()
+    if isinstance(client_sock, socket.socket):
+        if client_sock.family == socket.AF_INET:
+            client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return client_sock, client_info
+    if hasattr(socket, "AF_BLUETOOTH"):
+        # PyBluez sockets lack recv_into/sendfile: re-wrap the fd natively
+        native = socket.fromfd(client_sock.fileno(), socket.AF_BLUETOOTH,
+                               socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+        client_sock.close()
+        return native, client_info
+    return client_sock, client_info
+
+
+def stripe_channel(spec, channel, index):
+    """Channel of stripe `index` when stripes listen side by side from `channel`.
+
+    PORT_ANY (0) stays PORT_ANY on rfcomm (stripes are then found by SDP
+    name); stand-ins map it to channel 1 like listen() does.
+    """
+    if channel == 0:
+        return 0 if parse_spec(spec)[0] == "rfcomm" else 1 + index
+    return channel + index
+
+
+def channel_of(server_sock):
+    """Channel/port a listening socket is bound to, for log lines."""
+    name = server_sock.getsockname()
+    return name[1] if isinstance(name, tuple) else name
+
+
+def spawn_peer(target, *args, **kwargs):
+    """Run the other role in a daemon thread (used with the sim transport)."""
+    thread = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
+    thread.start()
+    _peers.append(thread)
+    return thread
+
+
+def stop_peers(timeout=PEER_STOP_TIMEOUT):
+    """Shut every sim listener down and wait for the spawn_peer() threads; returns those still running.
+
+    A process exits with its peer threads; a long-lived one (btperf.daemon) calls this after each run,
+    so peers serving an open-ended number of connections (sessions=0) do not pile up.
+    """
+    with _sim_cond:
+        listeners = list(_sim_listeners.values())
+    for listener in listeners:
+        listener.shutdown()
+    deadline = time.monotonic() + timeout
+    for thread in _peers:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    _peers[:] = [thread for thread in _peers if thread.is_alive()]
+    return list(_peers)
+
+
+def add_arguments(parser, channel):
+    """Register the --transport/--address/--channel options on a parser."""
+    parser.add_argument("--transport", default=DEFAULT_TRANSPORT,
+                        help="rfcomm | tcp | unix | sim[:rate=B/s,latency=s,loss=p] (default: rfcomm)")
+    parser.add_argument("--address", default=None,
+                        help="peer address (MAC for rfcomm, host for tcp, path for unix)")
+    parser.add_argument("--channel", type=int, default=channel,
+                        help=f"RFCOMM channel, or port offset for tcp/unix/sim (default: {channel})")
+    return parser
+
+
+# ---------------------------------------------------------------------------
+# In-process simulated link
+# ---------------------------------------------------------------------------
+
+_sim_cond = threading.Condition()
+_sim_listeners = {}
+_peers = []             # spawn_peer() threads, see stop_peers()
+
+
+class ListenerClosed(OSError):
+    """accept() on a sim listener that was shut down (stop_peers): the server should stop."""
+
+
+class _SimListener:
+    """Listening endpoint of the sim transport, registered per channel.
+
+    A socketpair carries one byte per pending connection so the listener has
+    a fileno() and can sit in a selector next to real sockets.
+    """
+
+    def __init__(self, channel, options):
+        self.channel = channel
+        self.options = options
+        self._pending = collections.deque()
+        self._closed = False
+        self._wake_rx, self._wake_tx = socket.socketpair()
+        with _sim_cond:
+            _sim_listeners[channel] = self
+            _sim_cond.notify_all()
+
+    def getsockname(self):
+        return ("sim", self.channel)
+
+    def fileno(self):
+        return self._wake_rx.fileno()
+
+    def _enqueue(self, sock):
+        self._pending.append(sock)
+        self._wake_tx.send(b"\0")
+
+    def accept(self, timeout=None):
+        with _sim_cond:
+            if not _sim_cond.wait_for(lambda: self._pending or self._closed, timeout):
+                raise socket.timeout("sim accept timed out")
+            if not self._pending:
+                raise ListenerClosed("sim listener closed")
+            sock = self._pending.popleft()
+        self._wake_rx.recv(1)
+        return sock, ("sim", self.channel)
+
+    def shutdown(self):
+        """Wake accept() and any selector watching fileno() with ListenerClosed; close() still frees it."""
+        with _sim_cond:
+            self._closed = True
+            if _sim_listeners.get(self.channel) is self:
+                del _sim_listeners[self.channel]
+            _sim_cond.notify_all()
+        self._wake_tx.close()       # fileno() turns readable (EOF)
+
+    def close(self):
+        self.shutdown()
+        self._wake_rx.close()
+
+
+def _sim_connect(channel, options, timeout):
+    with _sim_cond:
+        if not _sim_cond.wait_for(lambda: channel in _sim_listeners, timeout or 5.0):
+            raise ConnectionRefusedError(f"No sim listener on channel {channel}")
+        listener = _sim_listeners[channel]
+        client_sock, server_sock = _sim_pair(options)
+        listener._enqueue(server_sock)
+        _sim_cond.notify_all()
+    return client_sock
+
+
+def _sim_pair(options):
+    """Return (client, server) sockets, with a shaping relay when asked for."""
+    if not (options["rate"] or options["latency"] or options["loss"] or options["drop"]):
+        return socket.socketpair()
+    client_sock, client_relay = socket.socketpair()
+    server_relay, server_sock = socket.socketpair()
+    rng = random.Random(options["seed"])
+    closer = _RelayCloser((client_relay, server_relay))
+    _ShapedPipe(client_relay, server_relay, options, rng, closer, drop=int(options["drop"]))
+    _ShapedPipe(server_relay, client_relay, options, rng, closer)
+    return client_sock, server_sock
+
+
+class _RelayCloser:
+    """Close the relay sockets once both directions have drained."""
+
+    def __init__(self, socks):
+        self._socks = socks
+        self._remaining = 2
+        self._lock = threading.Lock()
+
+    def done(self):
+        with self._lock:
+            self._remaining -= 1
+            if self._remaining:
+                return
+        for sock in self._socks:
+            sock.close()
+
+
+class _ShapedPipe:
+    """One direction of a sim link: paces segments to rate, adds latency and
+    retransmission delay, and keeps at most `buffer` bytes in flight. With
+    `drop` the link is cut (both ends see it close) after that many bytes."""
+
+    def __init__(self, src, dst, options, rng, closer, drop=0):
+        self.src = src
+        self.dst = dst
+        self.rate = options["rate"]
+        self.latency = options["latency"]
+        self.loss = options["loss"]
+        self.rto = options["rto"] or max(2 * self.latency, 0.01)
+        self.mtu = int(options["mtu"])
+        self.buffer = int(options["buffer"])
+        self.rng = rng
+        self.closer = closer
+        self.drop = drop
+        self._queue = collections.deque()
+        self._queued = 0
+        self._cond = threading.Condition()
+        threading.Thread(target=self._read, daemon=True).start()
+        threading.Thread(target=self._deliver, daemon=True).start()
+
+    def _read(self):
+        busy_until = last_due = 0.0
+        forwarded = 0
+        while True:
+            try:
+                data = self.src.recv(self.mtu)
+            except OSError:
+                data = b""
+            if self.drop and forwarded + len(data) >= self.drop:
+                # Link lost: deliver up to the cut, then close towards the sender too
+                data = data[:self.drop - forwarded]
+                self.src.shutdown(socket.SHUT_RDWR)
+            forwarded += len(data)
+            now = time.perf_counter()
+            due = now
+            if data:
+                start = max(now, busy_until)
+                busy_until = start + (len(data) / self.rate if self.rate else 0.0)
+                due = busy_until + self.latency
+                if self.loss and self.rng.random() < self.loss:
+                    due += self.rto
+            # A reliable link delivers in order: a retransmission stalls what follows
+            due = last_due = max(due, last_due)
+            with self._cond:
+                self._cond.wait_for(lambda: self._queued < self.buffer)
+                self._queue.append((due, data))
+                self._queued += len(data)
+                self._cond.notify_all()
+            if not data:
+                return
+
+    def _deliver(self):
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._queue)
+                    due, data = self._queue.popleft()
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if not data:
+                    self.dst.shutdown(socket.SHUT_WR)
+                    return
+                self.dst.sendall(data)
+                with self._cond:
+                    self._queued -= len(data)
+                    self._cond.notify_all()
+        except OSError:
+            pass
+        finally:
+            self.closer.done()
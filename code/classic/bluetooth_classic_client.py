@@ -1,48 +1,137 @@
 #!/usr/bin/env python3
-import bluetooth
+import argparse
+import contextlib
+import datetime
+import os
+import sys
 import time
-import secrets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from btperf import framing, monitor, payload, profiling, recorder, resolver, session, transport
 
 # ----------------------------
 # Scenario 1 settings (random payload)
 # ----------------------------
 TOTAL_BYTES = 1_000_000   # change this (e.g., 50_000, 1_048_576, 5_000_000, ...)
 CHUNK_SIZE = 1024
+CHANNEL = 1
+# One row per chunk handed to the socket, plus a last row when the server's ACK arrives;
+# t_ns counts from the start of the trial
+LOG_COLUMNS = (("trial", "q"), ("t_ns", "q"), ("sent_bytes", "q"))
 
 target_name = "raspi-b"   # Adapt to device name
-target_address = None
-
-print("[CLIENT] Searching for server...")
-nearby_devices = bluetooth.discover_devices(duration=8, lookup_names=True)
-for addr, name in nearby_devices:
-    if name == target_name:
-        target_address = addr
-        break
-
-if target_address is None:
-    print("[CLIENT] Could not find target device.")
-    exit()
-
-print(f"[CLIENT] Connecting to {target_address}...")
-sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-sock.connect((target_address, 1))
-
-print(f"[CLIENT] Sending random payload: {TOTAL_BYTES} bytes")
-start = time.time()
-total_bytes = 0
-remaining = TOTAL_BYTES
-
-while remaining > 0:
-    n = CHUNK_SIZE if remaining >= CHUNK_SIZE else remaining
-    chunk = secrets.token_bytes(n)     # random bytes
-    sock.send(chunk)
-    total_bytes += n
-    remaining -= n
-
-end = time.time()
-
-duration = end - start if end > start else 1e-9
-throughput = total_bytes / duration / 1024  # KB/s
-print(f"[CLIENT] Sent {total_bytes} bytes in {duration:.2f}s ({throughput:.2f} KB/s)")
-
-sock.close()
+
+
+def send_random_payload(sock, total=TOTAL_BYTES, chunk_size=CHUNK_SIZE, framed=True, pool=None, log=None,
+                        trial=0, session=False, progress=None):
+    # Payload is generated before the timer starts; the loop only slices it
+    phase = profiling.phase
+    if pool is None:
+        with phase("prep"):
+            pool = payload.make_pool(total)
+    with phase("log"):
+        print(f"[CLIENT] Sending random payload: {total} bytes")
+    record = log.record if log is not None else None
+    clock = time.perf_counter_ns
+    start = clock()
+    total_bytes = 0
+    crc = 0
+    if framed:
+        with phase("syscall"):
+            framing.send_header(sock, total, session=session)
+
+    for chunk in payload.iter_chunks(pool, total, chunk_size):
+        if framed:
+            with phase("encode"):
+                crc = framing.checksum(chunk, crc)
+        with phase("syscall"):
+            sock.sendall(chunk)
+        total_bytes += len(chunk)
+        if progress is not None:
+            progress.count += len(chunk)
+        if record:
+            with phase("log"):
+                record(trial, clock() - start, total_bytes)
+
+    # End-to-end: wait for the server to confirm it holds every byte
+    with phase("wait"):
+        ack = framing.finish(sock, crc) if framed else None
+    end = clock()
+    if record:
+        with phase("log"):
+            record(trial, end - start, total_bytes)
+
+    duration = (end - start) / 1e9 if end > start else 1e-9
+    throughput = total_bytes / duration / 1024  # KB/s
+    print(f"[CLIENT] Sent {total_bytes} bytes in {duration:.2f}s ({throughput:.2f} KB/s)")
+    if ack:
+        print(f"[CLIENT] Server ACK: {framing.STATUS_TEXT[ack.status]}, {ack.received} bytes in {ack.server_duration:.2f}s")
+    return total_bytes, duration
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scenario S1: random payload over RFCOMM")
+    transport.add_arguments(parser, CHANNEL)
+    parser.add_argument("--total-bytes", type=int, default=TOTAL_BYTES)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--name", default=target_name, help="server device name to look up")
+    parser.add_argument("--raw", action="store_true", help="legacy unframed stream (no ACK)")
+    parser.add_argument("--service", default=framing.SERVICE_NAME,
+                        help="SDP service giving the RFCOMM channel ('' = use --channel)")
+    resolver.add_arguments(parser)
+    session.add_arguments(parser)
+    payload.add_arguments(parser)
+    recorder.add_arguments(parser)
+    monitor.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+    with profiling.from_args(args, "[CLIENT]"):
+        run(args)
+
+
+def run(args):
+    with profiling.phase("prep"):
+        pool = payload.from_args(args, args.total_bytes)
+
+    peer = None
+    if transport.in_process(args.transport):
+        import bluetooth_server_file
+        peer = transport.spawn_peer(bluetooth_server_file.serve, args.transport, args.channel, os.devnull,
+                                    sessions=session.connections(args.repeat, args.reconnect or args.raw))
+
+    # Inquiry/SDP only when the resolver cache misses
+    resolve = resolver.from_args(args, args.name)
+    print(f"[CLIENT] Connecting to {args.address or args.name}...")
+    connect = lambda: resolve.connect(args.transport, args.name, args.address, args.channel, args.service)
+
+    timestamp = datetime.datetime.now().strftime('%d%m_%H%M')
+    with contextlib.ExitStack() as stack:
+        log = stack.enter_context(recorder.from_args(args, f"s1_{args.total_bytes}_{timestamp}", LOG_COLUMNS))
+        connect_log = stack.enter_context(recorder.from_args(args, f"connect_{timestamp}", session.CONNECT_COLUMNS))
+        logs = [log.path, connect_log.path]
+        sampler = None
+        if args.rate_interval > 0:
+            # Rate time series sampled beside the send loop (live line, rate_<timestamp> log)
+            rate_log = stack.enter_context(recorder.from_args(args, f"rate_{timestamp}", monitor.RATE_COLUMNS))
+            sampler = stack.enter_context(monitor.from_args(args, label="[CLIENT]", log=rate_log))
+            logs.append(rate_log.path)
+        try:
+            # A raw stream ends with the connection: one connection per trial
+            session.run_trials(connect, args.repeat,
+                               lambda sock, trial, reuse: send_random_payload(
+                                   sock, args.total_bytes, args.chunk_size, not args.raw, pool, log, trial, reuse,
+                                   sampler),
+                               args.reconnect or args.raw, not args.raw, connect_log)
+        except LookupError:
+            print("[CLIENT] Could not find target device.")
+            sys.exit(1)
+    if sampler:
+        print(f"[CLIENT] Rate: {sampler.summary()}")
+    print(f"[CLIENT] Logs written: {', '.join(logs)}")
+
+    if peer:
+        peer.join()
+
+
+if __name__ == "__main__":
+    main()
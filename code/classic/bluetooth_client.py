@@ -1,92 +1,243 @@
 #!/usr/bin/env python3
-from bluetooth import BluetoothSocket, RFCOMM
-import time, struct, csv, secrets, statistics, datetime
+import argparse, os, sys, select, threading
+import time, struct, datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from btperf import payload, profiling, recorder, resolver, session, stats, transport
 
 server_mac = "2C:CF:67:27:F7:11"   # MAC du Pi serveur
 
 # Config
+CHANNEL = 3                  # canal RFCOMM du serveur
 THROUGHPUT_DURATION = 60     # durée en secondes pour le test débit
 PAYLOAD_SIZE = 1024          # taille des paquets (octets) pour débit
 LATENCY_PINGS = 200          # nombre de pings pour latence/jitter
 LAT_PAYLOAD = 64             # taille des paquets pour latence
+LAT_REPORT_EVERY = 0         # pings par résumé intermédiaire (0 = résumé final seulement)
+WINDOW_KB = 0                # octets en vol (KB) pour le mode pipeline, 0 = lock-step
+DRAIN_TIMEOUT = 10           # attente max des derniers échos (s)
+
+# Colonnes des logs (btperf.recorder), temps en ns depuis le début du test
+THROUGHPUT_COLUMNS = (("t_ns", "q"), ("sent_bytes", "q"), ("recv_bytes", "q"))
+LATENCY_COLUMNS = (("seq", "q"), ("t_send_ns", "q"), ("rtt_ns", "q"))
 
-# Connection to RFCOMM server on channel 3
-print("[CLIENT] Connecting to", server_mac)
-sock = BluetoothSocket(RFCOMM)
-sock.connect((server_mac, 3))
-print("[CLIENT] Connected.")
 
 # ---------- THROUGHPUT TEST ----------
-# Create random packet, initialize counters send/received, start timer
-print("[CLIENT] Starting throughput test...")
-buf = secrets.token_bytes(PAYLOAD_SIZE)
-sent = recv = 0
-t0 = time.time()
-t_end = t0 + THROUGHPUT_DURATION
+def run_throughput_test(sock, log, duration=THROUGHPUT_DURATION, payload_size=PAYLOAD_SIZE, pool=None):
+    # Create random packet, initialize counters send/received, start timer
+    print("[CLIENT] Starting throughput test...")
+    phase = profiling.phase
+    with phase("prep"):
+        buf = (pool if pool is not None else payload.make_pool(payload_size))[:payload_size]
+    view = memoryview(bytearray(payload_size))
+    sent = recv = 0
+    record = log.record
+    clock = time.perf_counter_ns
+    t0 = clock()
+    t_end = t0 + int(duration * 1e9)
 
+    # Send packet then read echo bounced by server
+    while (t := clock()) < t_end:
+        with phase("syscall"):
+            sock.sendall(buf)
+        sent += len(buf)
+        # A short recv must not undercount: wait for the whole echo
+        with phase("wait"):
+            while recv < sent:
+                n = sock.recv_into(view, sent - recv)
+                if not n:
+                    raise ConnectionError("server closed the connection")
+                recv += n
+        # Log progression octets send/received for throughput tracking in time (flushed off the loop)
+        with phase("log"):
+            record(t - t0, sent, recv)
 
-timestamp = datetime.datetime.now().strftime("%d%m_%H%M")
-throughput_file = f"throughput_{timestamp}.csv"
-latency_file = f"latency_{timestamp}.csv"
+    dt = (clock() - t0) / 1e9
+    mbit_s = (recv*8)/1e6/dt
+    print(f"[CLIENT] Throughput: {mbit_s:.2f} Mbit/s over {dt:.2f}s")
+    return mbit_s
 
 
-with open(throughput_file, "w", newline="") as f:
-    writer = csv.writer(f)
-    writer.writerow(["t_s","sent_bytes","recv_bytes"])
-    # Send packet then read echo bounced by server
-    while time.time() < t_end:
-        sock.sendall(buf)
-        sent += len(buf)
-        echo = sock.recv(len(buf))
-        recv += len(echo)
-        # Write in CSV progression octets send/received for throughput tracking in time
-        writer.writerow([f"{time.time()-t0:.6f}", sent, recv])
+# ---------- PIPELINED THROUGHPUT TEST ----------
+def run_windowed_throughput_test(sock, log, duration=THROUGHPUT_DURATION,
+                                 payload_size=PAYLOAD_SIZE, window=WINDOW_KB * 1024, pool=None):
+    # A sender thread keeps up to `window` bytes outstanding while this thread
+    # drains echoes on its own, so the link never idles waiting for a round trip
+    print(f"[CLIENT] Starting pipelined throughput test (window {window} bytes)...")
+    window = max(window, payload_size)
+    phase = profiling.phase
+    with phase("prep"):
+        buf = (pool if pool is not None else payload.make_pool(payload_size))[:payload_size]
+    view = memoryview(bytearray(max(65536, payload_size)))
+    counters = {"sent": 0, "recv": 0, "done": False}
+    cond = threading.Condition()
+    t0 = time.perf_counter()
+    t0_ns = time.perf_counter_ns()
+    t_end = t0 + duration
+
+    def sender():
+        try:
+            while True:
+                with cond:
+                    cond.wait_for(lambda: counters["sent"] - counters["recv"] + payload_size <= window,
+                                  timeout=max(0.0, t_end - time.perf_counter()))
+                    if time.perf_counter() >= t_end:
+                        break
+                    if counters["sent"] - counters["recv"] + payload_size > window:
+                        continue
+                with phase("syscall"):
+                    sock.sendall(buf)
+                with cond:
+                    counters["sent"] += payload_size
+        finally:
+            with cond:
+                counters["done"] = True
+
+    thread = threading.Thread(target=sender, daemon=True)
+    thread.start()
+
+    record = log.record
+    t_drain = None
+    while True:
+        with cond:
+            sent, recv, done = counters["sent"], counters["recv"], counters["done"]
+        if done:
+            if recv >= sent:
+                break
+            t_drain = t_drain or time.perf_counter() + DRAIN_TIMEOUT
+            if time.perf_counter() > t_drain:
+                print(f"[CLIENT] {sent - recv} bytes never echoed back")
+                break
+        # Poll so a sender that just stopped cannot leave us blocked in recv
+        with phase("wait"):
+            if not select.select([sock], [], [], 0.1)[0]:
+                continue
+            n = sock.recv_into(view)
+        if not n:
+            print("[CLIENT] Server closed the connection")
+            break
+        with cond:
+            counters["recv"] += n
+            sent, recv = counters["sent"], counters["recv"]
+            cond.notify()
+        with phase("log"):
+            record(time.perf_counter_ns() - t0_ns, sent, recv)
+    thread.join()
+
+    dt = time.perf_counter()-t0
+    mbit_s = (counters["recv"]*8)/1e6/dt
+    print(f"[CLIENT] Throughput: {mbit_s:.2f} Mbit/s over {dt:.2f}s (window {window} bytes)")
+    return mbit_s
 
-dt = time.time()-t0
-mbit_s = (recv*8)/1e6/dt
-print(f"[CLIENT] Throughput: {mbit_s:.2f} Mbit/s over {dt:.2f}s")
 
 # ---------- LATENCY TEST ----------
-print("[CLIENT] Starting latency test...")
-fmt = "!d"  # double (8 octets)
-pad = b"x" * max(0, LAT_PAYLOAD-8)
-results = []
-losses = 0
-
-with open(latency_file,"w",newline="") as f:
-    writer = csv.writer(f)
-    writer.writerow(["seq","rtt_ms"])
-    for i in range(LATENCY_PINGS):
+def run_latency_test(sock, log, pings=LATENCY_PINGS, payload_size=LAT_PAYLOAD, report_every=LAT_REPORT_EVERY):
+    print("[CLIENT] Starting latency test...")
+    stamp = struct.Struct("!Q")  # perf_counter_ns (8 octets)
+    pkt = bytearray(max(payload_size, stamp.size))
+    pkt[stamp.size:] = b"x" * (len(pkt) - stamp.size)
+    # Constant memory: streaming histogram/moments instead of a list of every RTT
+    total = stats.LatencyStats()
+    interval = stats.LatencyStats()
+    record = log.record
+    clock = time.perf_counter_ns
+    phase = profiling.phase
+    t0 = clock()
+
+    for i in range(pings):
         # Send packet with send time then wait for echo
-        ts = time.monotonic()
-        pkt = struct.pack(fmt, ts)+pad
-        sock.sendall(pkt)
-        try:
-            echo = sock.recv(len(pkt))
-        except OSError:
-            losses += 1
-            continue
+        ts = clock()
+        with phase("encode"):
+            stamp.pack_into(pkt, 0, ts)
+        with phase("syscall"):
+            sock.sendall(pkt)
+        with phase("wait"):
+            try:
+                echo = sock.recv(len(pkt))
+            except OSError:
+                echo = b""
         if len(echo) != len(pkt):
-            losses += 1
-            continue
-        ts2 = time.monotonic()
-        # Calcule le Round-Trip Time (RTT) en millisecondes. Calculate Round-Trip Time (RTT) in ms
-        rtt = (ts2-ts)*1000.0
-       # Store each RTT in a list and CSV for analysis
-        results.append(rtt)
-        writer.writerow([i, f"{rtt:.3f}"])
-# ---------- ANALYSE ----------
-if results:
-        # Give necessary metrics mean/median/jitter
-        mean = statistics.mean(results)
-        median = statistics.median(sorted(results))
-        stdev = statistics.pstdev(results)
-        # Calculate 95th/99th percentiles to show the “worst” observed latencies
-        p95 = statistics.quantiles(results, n=100)[94]
-        p99 = statistics.quantiles(results, n=100)[98]
-        print(f"[CLIENT] Latency mean={mean:.2f} ms median={median:.2f} ms p95={p95:.2f} ms p99={p99:.2f} ms jitter={stdev:.2f} ms losses={losses}")
-else:
-    print("[CLIENT] No latency samples collected.")
-
-sock.close()
-print(f"[CLIENT] Finished. CSV files written: {throughput_file}, {latency_file}")
+            interval.add_loss()
+        else:
+            # Round-Trip Time (RTT) en ns, résumé en ms
+            rtt = clock() - ts
+            interval.add(rtt)
+            with phase("log"):
+                record(i, ts - t0, rtt)
+        if report_every and (i + 1) % report_every == 0:
+            with phase("log"):
+                print(f"[CLIENT] Latency pings {i + 2 - report_every}-{i + 1}: {interval.summary()}")
+            total.merge(interval)
+            interval.reset()
+    total.merge(interval)
+
+    # ---------- ANALYSE ----------
+    if total.count:
+        # p50..p99.9 from the histogram, jitter per RFC 3550 (not the standard deviation)
+        print(f"[CLIENT] Latency {total.summary()}")
+    else:
+        print("[CLIENT] No latency samples collected.")
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RFCOMM throughput + latency client")
+    transport.add_arguments(parser, CHANNEL)
+    parser.add_argument("--duration", type=float, default=THROUGHPUT_DURATION, help="throughput test length (s)")
+    parser.add_argument("--payload-size", type=int, default=PAYLOAD_SIZE, help="throughput packet size (bytes)")
+    parser.add_argument("--window", type=float, default=WINDOW_KB,
+                        help="KB kept in flight by the pipelined throughput test (0 = lock-step)")
+    parser.add_argument("--pings", type=int, default=LATENCY_PINGS, help="number of latency pings")
+    parser.add_argument("--lat-payload", type=int, default=LAT_PAYLOAD, help="latency packet size (bytes)")
+    parser.add_argument("--report-every", type=int, default=LAT_REPORT_EVERY,
+                        help="print a latency summary every N pings (0 = final summary only)")
+    payload.add_arguments(parser)
+    parser.add_argument("--name", default=None, help="resolve the server by device name instead of --address")
+    recorder.add_arguments(parser)
+    resolver.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+    with profiling.from_args(args, "[CLIENT]"):
+        run(args)
+
+
+def run(args):
+    with profiling.phase("prep"):
+        pool = payload.from_args(args, args.payload_size)
+
+    peer = None
+    if transport.in_process(args.transport):
+        import bluetooth_server
+        peer = transport.spawn_peer(bluetooth_server.serve, args.transport, args.channel, sessions=1)
+
+    address = args.address or (server_mac if transport.needs_discovery(args.transport) and not args.name else None)
+
+    # Connection to RFCOMM server on channel 3
+    print("[CLIENT] Connecting to", address or args.name or "localhost", "over", args.transport)
+    resolve = resolver.from_args(args, args.name)
+    sock, setup = session.timed(lambda: resolve.connect(args.transport, args.name, address, args.channel))
+    print(f"[CLIENT] Connected (setup {setup / 1e6:.1f} ms).")
+
+    timestamp = datetime.datetime.now().strftime("%d%m_%H%M")
+    with recorder.from_args(args, f"connect_{timestamp}", session.CONNECT_COLUMNS) as connect_log:
+        connect_log.record(0, setup)
+    throughput_log = recorder.from_args(args, f"throughput_{timestamp}", THROUGHPUT_COLUMNS)
+    latency_log = recorder.from_args(args, f"latency_{timestamp}", LATENCY_COLUMNS)
+
+    with throughput_log:
+        if args.window > 0:
+            run_windowed_throughput_test(sock, throughput_log, args.duration, args.payload_size,
+                                         int(args.window * 1024), pool)
+        else:
+            run_throughput_test(sock, throughput_log, args.duration, args.payload_size, pool)
+    with latency_log:
+        run_latency_test(sock, latency_log, args.pings, args.lat_payload, args.report_every)
+
+    sock.close()
+    if peer:
+        peer.join()
+    print(f"[CLIENT] Finished. Logs written: {throughput_log.path}, {latency_log.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,327 @@
-import bluetooth
+import argparse
+import contextlib
+import datetime
+import os
+import sys
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from btperf import compress, framing, monitor, profiling, recorder, resolver, resume, sender, session, transport
+
 # Change filename to send
 #filename = "/home/pi/ressources/image.jpg"
 filename = "/home/pi/ressources/text.txt"
 # filename = "/home/pi/ressources/video.mp4"
 # filename = "/home/pi/ressources/music.mp3"
 
+CHANNEL = 1
+CHUNK_SIZE = sender.CHUNK_SIZE              # historical S2 value, see --sweep
+SWEEP_SIZES = "256,512,1024,2048,4096,16384,65536"
+# One row per transfer (= trial, in order); `file` is the index of the file in the order printed by the client,
+# `stripes` the number of connections the file was split over, `wire_bytes` what was sent once compressed
+LOG_COLUMNS = (("file", "q"), ("chunk_size", "q"), ("bytes", "q"), ("duration_ns", "q"),
+               ("server_duration_ns", "q"), ("stripes", "q"), ("wire_bytes", "q"))
 
+target_name = "raspi-b"  # Adapt to device name
 
 
-target_name = "raspi-b"  # Adapt to device name
-target_address = None
-
-print("[CLIENT] Searching for server...")
-nearby_devices = bluetooth.discover_devices(duration=8, lookup_names=True)
-for addr, name in nearby_devices:
-    if name == target_name:
-        target_address = addr
-        break
-
-if target_address is None:
-    print("[CLIENT] Could not find target device.")
-    exit()
-
-print(f"[CLIENT] Connecting to {target_address}...")
-sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-sock.connect((target_address, 1))
-
-with open(filename, "rb") as f:
-    print(f"[CLIENT] Sending file: {filename}")
-    start = time.time()
+def _compression_line(total_bytes, wire_bytes, duration, codec):
+    effective = total_bytes / duration / 1024 if duration > 0 else 0.0
+    wire = wire_bytes / duration / 1024 if duration > 0 else 0.0
+    share = wire_bytes / total_bytes if total_bytes else 1.0
+    print(f"[CLIENT] {codec}: {wire_bytes} bytes on the wire ({share:.0%} of {total_bytes}), "
+          f"effective {effective:.2f} KB/s, wire {wire:.2f} KB/s")
+
+
+def send_file(sock, path, chunk_size=CHUNK_SIZE, mode="auto", framed=True, log=None, index=0, session=False,
+              progress=None, codec=None):
+    if isinstance(sock, sender.StripedLink):
+        return send_striped(sock, path, chunk_size, mode, log, index, session, progress, codec)
+    print(f"[CLIENT] Sending file: {path} ({chunk_size}-byte chunks)")
+    size = os.path.getsize(path)
+    start = time.perf_counter()
+    if framed:
+        with profiling.phase("syscall"):
+            framing.send_header(sock, size, os.path.basename(path), session, codec=codec and codec.name)
+    wire_bytes, send_time, used, crc = sender.send_file(sock, path, chunk_size, mode, framed, progress,
+                                                        codec=codec)
+    # Framed transfers stop the clock on the server's ACK, not on the last local send()
+    with profiling.phase("wait"):
+        ack = framing.finish(sock, crc) if framed else None
+    duration = time.perf_counter() - start
+
+    total_bytes = size if codec else wire_bytes
+    throughput = total_bytes / duration / 1024 if duration > 0 else 0.0  # KB/s
+    print(f"[CLIENT] Sent {total_bytes} bytes in {duration:.2f}s ({throughput:.2f} KB/s, {used})")
+    if codec:
+        _compression_line(total_bytes, wire_bytes, duration, codec)
+    if ack:
+        server_rate = ack.received / ack.server_duration / 1024 if ack.server_duration > 0 else 0.0
+        print(f"[CLIENT] Server ACK: {framing.STATUS_TEXT[ack.status]}, {ack.received} bytes in "
+              f"{ack.server_duration:.2f}s ({server_rate:.2f} KB/s); local sends done after {send_time:.2f}s")
+        if not ack.ok:
+            raise framing.ProtocolError(f"transfer of {path} failed: {framing.STATUS_TEXT[ack.status]}")
+    if log is not None:
+        with profiling.phase("log"):
+            log.record(index, chunk_size, total_bytes, int(duration * 1e9),
+                       int(ack.server_duration * 1e9) if ack else -1, 1, wire_bytes)
+    return total_bytes, duration
+
+
+def send_striped(link, path, chunk_size=CHUNK_SIZE, mode="auto", log=None, index=0, session=False, progress=None,
+                 codec=None):
+    """Send one file as contiguous ranges, one per connection of `link`, all at once.
+
+    The clock stops when the last stripe is acknowledged.
+    """
+    size = os.path.getsize(path)
+    name = os.path.basename(path)
+    ranges = sender.split_ranges(size, len(link), chunk_size)
+    transfer_id = int.from_bytes(os.urandom(8), "big") >> 1
+    shares = sender.share_progress(progress, len(link))     # the stripes' threads all count into `progress`
+    print(f"[CLIENT] Sending file: {path} over {len(link)} stripes ({chunk_size}-byte chunks)")
+
+    def stripe(k, sock):
+        offset, length = ranges[k]
+        with profiling.phase("syscall"):
+            framing.send_header(sock, length, name, session, framing.Stripe(transfer_id, offset, size, len(link)),
+                                codec and codec.name)
+        sent, _, used, crc = sender.send_file(sock, path, chunk_size, mode, True, shares[k], offset, length, codec)
+        with profiling.phase("wait"):
+            ack = framing.finish(sock, crc)
+        return sent, used, ack
+
+    start = time.perf_counter()
+    results = link.map(stripe)
+    duration = time.perf_counter() - start
+
+    wire_bytes = sum(sent for sent, _, _ in results)
+    total_bytes = size if codec else wire_bytes
+    acks = [ack for _, _, ack in results]
+    server_duration = max(a.t_last for a in acks) - min(a.t_first for a in acks)
+    throughput = total_bytes / duration / 1024 if duration > 0 else 0.0  # KB/s
+    print(f"[CLIENT] Sent {total_bytes} bytes over {len(link)} stripes in {duration:.2f}s "
+          f"({throughput:.2f} KB/s, {results[0][1]})")
+    if codec:
+        _compression_line(total_bytes, wire_bytes, duration, codec)
+    failed = [k for k, a in enumerate(acks) if not a.ok]
+    if failed:
+        raise framing.ProtocolError(f"stripe(s) {failed} of {path} failed: "
+                                    f"{framing.STATUS_TEXT[acks[failed[0]].status]}")
+    if log is not None:
+        with profiling.phase("log"):
+            log.record(index, chunk_size, total_bytes, int(duration * 1e9), int(server_duration * 1e9), len(link),
+                       wire_bytes)
+    return total_bytes, duration
+
+
+def send_resumable(sock, path, chunk_size=CHUNK_SIZE, log=None, index=0, progress=None, transfer_id=0,
+                   resume_chunk=resume.CHUNK_SIZE):
+    """Send only the ranges of `path` the server has not verified yet (all of it the first time).
+
+    The clock runs from the query to the last range's ACK; the bytes logged are the bytes sent now.
+    """
+    size = os.path.getsize(path)
+    name = os.path.basename(path)
+    start = time.perf_counter()
+    with profiling.phase("wait"):
+        ranges = framing.query_missing(sock, transfer_id, size, resume_chunk, name)
+    missing = sum(length for _, length in ranges)
+    if missing < size:
+        print(f"[CLIENT] Resuming {path}: {missing}/{size} bytes missing in {len(ranges)} range(s)")
+    else:
+        print(f"[CLIENT] Sending file: {path} ({chunk_size}-byte chunks, {resume_chunk}-byte verified chunks)")
     total_bytes = 0
-    while chunk := f.read(1024):
-        sock.send(chunk)
-        total_bytes += len(chunk)
-    end = time.time()
+    server_duration = 0.0
+    for offset, length in ranges:
+        # Every range keeps the connection open: the next query or range follows its ACK
+        with profiling.phase("syscall"):
+            framing.send_header(sock, length, name, True,
+                                resume=framing.Resume(transfer_id, offset, size, resume_chunk))
+        sent, _, _, crc = sender.send_file(sock, path, chunk_size, "mmap", True, progress, offset, length,
+                                           frame=resume_chunk)
+        with profiling.phase("wait"):
+            ack = framing.finish(sock, crc)
+        if not ack.ok:
+            raise framing.ProtocolError(f"range {offset}-{offset + length} of {path} failed: "
+                                        f"{framing.STATUS_TEXT[ack.status]}")
+        total_bytes += sent
+        server_duration += ack.server_duration
+    duration = time.perf_counter() - start
+
+    throughput = total_bytes / duration / 1024 if duration > 0 else 0.0  # KB/s
+    print(f"[CLIENT] Sent {total_bytes} bytes in {duration:.2f}s ({throughput:.2f} KB/s, resumable)")
+    if log is not None:
+        with profiling.phase("log"):
+            log.record(index, chunk_size, total_bytes, int(duration * 1e9), int(server_duration * 1e9), 1,
+                       total_bytes)
+    return total_bytes, duration
+
+
+def plan(files, chunk_sizes, repeat=1):
+    """Trials of a sweep: (file index, path, chunk size), every combination `repeat` times."""
+    return [(index, path, chunk_size) for index, path in enumerate(files) for chunk_size in chunk_sizes
+            for _ in range(repeat)]
+
+
+def run(connect, trials, mode="auto", framed=True, log=None, reconnect=False, connect_log=None, progress=None,
+        compression=None, resume_chunk=0, retries=0):
+    """Send every planned trial, over one connection unless `reconnect`; returns KB/s per (path, chunk size).
+
+    `progress` is the btperf.monitor sampler following the bytes sent, `compression` the
+    btperf.compress.Selector choosing each file's codec. With `resume_chunk` trials are
+    resumable transfers, and a trial whose connection drops is retried `retries` times.
+    """
+    rates = {}
+
+    def trial(sock, n, reuse):
+        index, path, chunk_size = trials[n]
+        if resume_chunk:
+            total_bytes, duration = send_resumable(sock, path, chunk_size, log, index, progress,
+                                                   resume.transfer_id(path, n), resume_chunk)
+        else:
+            codec = compression.codec_for(path) if compression else None
+            total_bytes, duration = send_file(sock, path, chunk_size, mode, framed, log, index, reuse, progress,
+                                              codec)
+        rates.setdefault((path, chunk_size), []).append(total_bytes / duration / 1024 if duration > 0 else 0.0)
+
+    # A raw stream ends with the connection: one connection per trial
+    session.run_trials(connect, len(trials), trial, reconnect or not framed, framed, connect_log, retries)
+    return {key: sum(values) / len(values) for key, values in rates.items()}
+
+
+def sweep(connect, files, chunk_sizes, mode="auto", framed=True, log=None, repeat=1, reconnect=False,
+          connect_log=None, progress=None, compression=None, resume_chunk=0, retries=0):
+    """Send every file at every chunk size and report the best size per file type."""
+    results = run(connect, plan(files, chunk_sizes, repeat), mode, framed, log, reconnect, connect_log, progress,
+                  compression, resume_chunk, retries)
+
+    print("\n[CLIENT] Chunk-size sweep (KB/s)")
+    print(f"  {'file':<24}" + "".join(f"{c:>10}" for c in chunk_sizes))
+    best_by_type = {}
+    for path in files:
+        print(f"  {os.path.basename(path):<24}" + "".join(f"{results[(path, c)]:>10.2f}" for c in chunk_sizes))
+        file_type = os.path.splitext(path)[1].lstrip(".").upper() or "?"
+        for c in chunk_sizes:
+            if results[(path, c)] > best_by_type.get(file_type, (0, 0.0))[1]:
+                best_by_type[file_type] = (c, results[(path, c)])
+    for file_type, (c, rate) in sorted(best_by_type.items()):
+        print(f"[CLIENT] Best chunk size for {file_type}: {c} bytes ({rate:.2f} KB/s)")
+    return best_by_type
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scenario S2: file transfer over RFCOMM")
+    transport.add_arguments(parser, CHANNEL)
+    parser.add_argument("--file", default=filename, help="file to send")
+    parser.add_argument("--name", default=target_name, help="server device name to look up")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="bytes per send call")
+    parser.add_argument("--mode", choices=sender.MODES, default="auto",
+                        help="sendfile, mmap + sendall, or sendfile with mmap fallback (default)")
+    parser.add_argument("--raw", action="store_true",
+                        help="legacy unframed stream: no header/checksum/ACK, timer stops on last send()")
+    parser.add_argument("--sweep", nargs="?", const=SWEEP_SIZES, default=None,
+                        help=f"comma-separated chunk sizes to compare (default list: {SWEEP_SIZES})")
+    parser.add_argument("--files", nargs="+", default=None,
+                        help="files for --sweep (default: every file next to --file)")
+    parser.add_argument("--service", default=framing.SERVICE_NAME,
+                        help="SDP service giving the RFCOMM channel ('' = use --channel)")
+    parser.add_argument("--stripes", type=int, default=1,
+                        help="split each file over this many parallel connections (server: same --stripes)")
+    parser.add_argument("--resume", action="store_true",
+                        help="resumable transfers: resend only the chunks the server has not verified")
+    parser.add_argument("--resume-chunk", type=int, default=resume.CHUNK_SIZE,
+                        help="bytes per verified chunk with --resume (default: %(default)s)")
+    parser.add_argument("--retries", type=int, default=0,
+                        help="reconnect and retry a trial this many times when its connection drops")
+    compress.add_arguments(parser)
+    resolver.add_arguments(parser)
+    session.add_arguments(parser)
+    recorder.add_arguments(parser)
+    monitor.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.stripes > 1 and args.raw:
+        parser.error("--stripes needs the framed protocol (drop --raw)")
+    if args.compress != "none" and args.raw:
+        parser.error("--compress needs the framed protocol (drop --raw)")
+    if args.resume and (args.raw or args.stripes > 1 or args.compress != "none"):
+        parser.error("--resume works on a single uncompressed framed stream (no --raw, --stripes or --compress)")
+    try:
+        compression = compress.Selector(args.compress)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.sweep:
+        chunk_sizes = [int(c) for c in args.sweep.split(",")]
+        directory = os.path.dirname(os.path.abspath(args.file))
+        files = args.files or sorted(os.path.join(directory, n) for n in os.listdir(directory)
+                                     if os.path.isfile(os.path.join(directory, n)))
+    else:
+        files, chunk_sizes = [args.file], [args.chunk_size]
+    trials = plan(files, chunk_sizes, args.repeat)
+
+    peer = None
+    if transport.in_process(args.transport):
+        import bluetooth_server_file
+        # With retries the number of connections is open-ended: the server thread runs until exit
+        sessions = 0 if args.retries else session.connections(len(trials), args.reconnect or args.raw)
+        peer = transport.spawn_peer(bluetooth_server_file.serve, args.transport, args.channel,
+                                    sessions=sessions, stripes=args.stripes)
+
+    # Inquiry/SDP only when the resolver cache misses; every connection reuses it
+    resolve = resolver.from_args(args, args.name)
+    print(f"[CLIENT] Connecting to {args.address or args.name}...")
+
+    def connect_stripe(k):
+        return resolve.connect(args.transport, args.name, args.address,
+                               transport.stripe_channel(args.transport, args.channel, k),
+                               args.service if k == 0 else args.service and framing.stripe_service(k))
+
+    def connect():
+        if args.stripes == 1:
+            return connect_stripe(0)
+        # First stripe alone (it fills the resolver cache), the others in parallel
+        from concurrent.futures import ThreadPoolExecutor
+        first = connect_stripe(0)
+        with ThreadPoolExecutor(max_workers=args.stripes - 1) as pool:
+            futures = [pool.submit(connect_stripe, k) for k in range(1, args.stripes)]
+        socks = [first] + [f.result() for f in futures if not f.exception()]
+        if len(socks) < args.stripes:
+            for sock in socks:
+                sock.close()
+            raise next(f.exception() for f in futures if f.exception())
+        return sender.StripedLink(socks)
+
+    timestamp = datetime.datetime.now().strftime('%d%m_%H%M')
+    with contextlib.ExitStack() as stack:
+        # Entered first, left last: the report covers every transfer and the final log flush
+        stack.enter_context(profiling.from_args(args, "[CLIENT]"))
+        log = stack.enter_context(recorder.from_args(args, f"s2_{timestamp}", LOG_COLUMNS))
+        connect_log = stack.enter_context(recorder.from_args(args, f"connect_{timestamp}", session.CONNECT_COLUMNS))
+        logs = [log.path, connect_log.path]
+        sampler = None
+        if args.rate_interval > 0:
+            # Rate time series sampled beside the send loop (live line, rate_<timestamp> log)
+            rate_log = stack.enter_context(recorder.from_args(args, f"rate_{timestamp}", monitor.RATE_COLUMNS))
+            sampler = stack.enter_context(monitor.from_args(args, label="[CLIENT]", log=rate_log))
+            logs.append(rate_log.path)
+        try:
+            if args.sweep:
+                sweep(connect, files, chunk_sizes, args.mode, not args.raw, log, args.repeat, args.reconnect,
+                      connect_log, sampler, compression, args.resume and args.resume_chunk, args.retries)
+            else:
+                run(connect, trials, args.mode, not args.raw, log, args.reconnect, connect_log, sampler, compression,
+                    args.resume and args.resume_chunk, args.retries)
+        except LookupError:
+            print("[CLIENT] Could not find target device.")
+            sys.exit(1)
+    if sampler:
+        print(f"[CLIENT] Rate: {sampler.summary()}")
+    print(f"[CLIENT] Logs written: {', '.join(logs)}")
+    if peer and sessions:
+        peer.join()
 
-duration = end - start
-throughput = total_bytes / duration / 1024  # KB/s
-print(f"[CLIENT] Sent {total_bytes} bytes in {duration:.2f}s ({throughput:.2f} KB/s)")
 
-sock.close()
+if __name__ == "__main__":
+    main()
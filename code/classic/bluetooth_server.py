@@ -1,26 +1,138 @@
 #!/usr/bin/env python3
-from bluetooth import BluetoothSocket, RFCOMM
-import struct, time
-
-server_sock = BluetoothSocket(RFCOMM)
-server_sock.bind(("", 3))   # channel 3
-server_sock.listen(1)
-
-print("[SERVER] Waiting for connection on RFCOMM channel 3...")
-client_sock, client_info = server_sock.accept()
-print("[SERVER] Accepted connection from", client_info)
-
-try:
-    while True:
-        data = client_sock.recv(4096)
-        if not data:
-            break
-        # Echo back (for RTT measurement & throughput)
-        client_sock.sendall(data)
-except OSError as e:
-    print("[SERVER] Error:", e)
-
-print("[SERVER] Disconnected.")
-client_sock.close()
-server_sock.close()
+import argparse
+import os
+import selectors
+import sys
+import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from btperf import profiling, transport
+
+CHANNEL = 3             # RFCOMM channel
+BACKLOG = 8             # pending connections accepted by the kernel
+RECV_BUFFER = 65536     # shared recv_into buffer (bytes)
+REPORT_INTERVAL = 10    # seconds between aggregate throughput lines
+
+
+class EchoSession:
+    """One connected client: echo bookkeeping and per-connection counters."""
+
+    def __init__(self, sock, info):
+        self.sock = sock
+        self.info = info
+        self.start = time.time()
+        self.bytes = 0
+        self.pending = bytearray()   # echo bytes the socket could not take yet
+
+    def report(self):
+        duration = time.time() - self.start
+        rate = self.bytes / duration / 1024 if duration > 0 else 0.0
+        print(f"[SERVER] {self.info} disconnected: echoed {self.bytes} bytes in {duration:.2f}s ({rate:.2f} KB/s)")
+
+
+def serve(transport_spec=transport.DEFAULT_TRANSPORT, channel=CHANNEL, sessions=None,
+          report_interval=REPORT_INTERVAL):
+    """Echo server for any number of concurrent clients.
+
+    Runs until `sessions` clients have disconnected (forever when None).
+    """
+    server_sock = transport.listen(transport_spec, channel, backlog=BACKLOG)
+    sel = selectors.DefaultSelector()
+    sel.register(server_sock, selectors.EVENT_READ, None)
+    view = memoryview(bytearray(RECV_BUFFER))
+
+    served = 0
+    total_bytes = reported_bytes = 0
+    last_report = time.time()
+    phase = profiling.phase
+
+    def close(session):
+        sel.unregister(session.sock)
+        session.sock.close()
+        session.report()
+
+    print(f"[SERVER] Waiting for connections on {transport_spec} channel {channel}...")
+    listening = True
+    try:
+        while listening and (sessions is None or served < sessions):
+            with phase("wait"):
+                ready = sel.select(timeout=report_interval)
+            for key, mask in ready:
+                if key.data is None:
+                    try:
+                        client_sock, client_info = transport.accept(server_sock)
+                    except transport.ListenerClosed:
+                        listening = False
+                        break
+                    client_sock.setblocking(False)
+                    sel.register(client_sock, selectors.EVENT_READ, EchoSession(client_sock, client_info))
+                    print("[SERVER] Accepted connection from", client_info)
+                    continue
+
+                session = key.data
+                try:
+                    if mask & selectors.EVENT_WRITE:
+                        with phase("syscall"):
+                            sent = session.sock.send(session.pending)
+                        del session.pending[:sent]
+                        if not session.pending:
+                            sel.modify(session.sock, selectors.EVENT_READ, session)
+                        continue
+                    with phase("syscall"):
+                        n = session.sock.recv_into(view)
+                    if not n:
+                        close(session)
+                        served += 1
+                        continue
+                    session.bytes += n
+                    total_bytes += n
+                    # Echo back (for RTT measurement & throughput)
+                    try:
+                        with phase("syscall"):
+                            sent = session.sock.send(view[:n])
+                    except BlockingIOError:
+                        sent = 0
+                    if sent < n:
+                        # Stop reading this client until its echo has drained
+                        session.pending += view[sent:n]
+                        sel.modify(session.sock, selectors.EVENT_WRITE, session)
+                except OSError as e:
+                    print(f"[SERVER] Error on {session.info}:", e)
+                    close(session)
+                    served += 1
+
+            now = time.time()
+            if total_bytes != reported_bytes and now - last_report >= report_interval:
+                rate = (total_bytes - reported_bytes) / (now - last_report) / 1024
+                clients = len(sel.get_map()) - 1
+                print(f"[SERVER] {clients} client(s), {total_bytes} bytes echoed, aggregate {rate:.2f} KB/s")
+                reported_bytes, last_report = total_bytes, now
+            elif total_bytes == reported_bytes:
+                last_report = now
+    except KeyboardInterrupt:
+        print("\n[SERVER] Stopped by user.")
+    finally:
+        for key in list(sel.get_map().values()):
+            if key.data is not None:
+                close(key.data)
+        sel.close()
+        server_sock.close()
+
+    print(f"[SERVER] Served {served} session(s), {total_bytes} bytes echoed in total.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RFCOMM echo server (RTT & throughput), many clients")
+    transport.add_arguments(parser, CHANNEL)
+    parser.add_argument("--sessions", type=int, default=None,
+                        help="exit after this many clients have disconnected (default: run forever)")
+    parser.add_argument("--report-interval", type=float, default=REPORT_INTERVAL,
+                        help="seconds between aggregate throughput reports")
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+    with profiling.from_args(args, "[SERVER]"):
+        serve(args.transport, args.channel, args.sessions, args.report_interval)
+
+
+if __name__ == "__main__":
+    main()
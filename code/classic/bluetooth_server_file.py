@@ -1,33 +1,214 @@
-import bluetooth
+import argparse
+import contextlib
+import os
+import sys
+import threading
 import time
 
-server_sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-server_sock.bind(("", bluetooth.PORT_ANY))
-server_sock.listen(1)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from btperf import compress, framing, monitor, profiling, receiver, resume, transport
 
-port = server_sock.getsockname()[1]
-bluetooth.advertise_service(server_sock, "BTFileServer",
-                            service_classes=[bluetooth.SERIAL_PORT_CLASS],
-                            profiles=[bluetooth.SERIAL_PORT_PROFILE])
+CHANNEL = 0   # bluetooth.PORT_ANY, the client connects on channel 1
+OUTPUT_FILE = "received_file"
+BLOCK_SIZE = receiver.BLOCK_SIZE    # bytes per disk write
+QUEUE_DEPTH = receiver.QUEUE_DEPTH  # blocks buffered between socket and disk
+RESUME_DIR = resume.RESUME_DIR      # chunk indexes of unfinished resumable transfers
 
-print(f"[SERVER] Waiting for connection on RFCOMM channel {port}...")
-client_sock, client_info = server_sock.accept()
-print(f"[SERVER] Accepted connection from {client_info}")
 
-with open("received_file", "wb") as f:
-    start = time.time()
-    total_bytes = 0
+def answer_query(client_sock, output=OUTPUT_FILE, resume_dir=RESUME_DIR):
+    """Tell a resuming client which ranges of its transfer are still missing."""
+    transfer_id, size, chunk_size, name = framing.read_query(client_sock)
+    index = resume.ChunkIndex(resume_dir, transfer_id, size, chunk_size, name)
+    missing = index.missing()
+    if index.complete:
+        # Every chunk arrived before the last connection dropped
+        index.finish(output)
+    else:
+        index.close()
+    framing.send_missing(client_sock, missing)
+    print(f"[SERVER] Resume query for {name or 'payload'}: {sum(n for _, n in missing)}/{size} bytes missing "
+          f"in {len(missing)} range(s)")
+
+
+def receive_one(client_sock, output=OUTPUT_FILE, block_size=BLOCK_SIZE, depth=QUEUE_DEPTH, start=None,
+                rate=None, resume_dir=RESUME_DIR):
+    """Receive one transfer, framed (header/trailer/ACK) or legacy raw stream.
+
+    `start` is the (header, prefix) pair of framing.read_header() when the
+    caller has already read it. `rate(source)` builds the btperf.monitor
+    sampler watching the transfer (None = no sampling).
+    """
+    header, prefix = start or framing.read_header(client_sock)
+    stripe = header.stripe if header is not None else None
+    ranged = header.resume if header is not None else None
+    stats = receiver.ReceiveStats()
+    # Stripes and resumed ranges are parts of one transfer: no sampler of their own
+    sampler = rate(lambda: stats.progress) if rate and not (stripe or ranged) else None
+    if header is None:
+        # Legacy client: raw bytes until the connection closes
+        with sampler or contextlib.nullcontext():
+            receiver.receive_file(client_sock, output, block_size=block_size, depth=depth, prefix=prefix,
+                                  stats=stats)
+    else:
+        if stripe:
+            part = receiver.assembly(stripe.transfer_id, output, stripe.total, stripe.count)
+            print(f"[SERVER] Incoming stripe: {header.name or 'payload'} bytes {stripe.offset}-"
+                  f"{stripe.offset + header.size} of {stripe.total} ({stripe.count} stripes)")
+        elif ranged:
+            index = resume.ChunkIndex(resume_dir, ranged.transfer_id, ranged.total, ranged.chunk_size, header.name)
+            print(f"[SERVER] Incoming range: {header.name or 'payload'} bytes {ranged.offset}-"
+                  f"{ranged.offset + header.size} of {ranged.total}")
+        else:
+            print(f"[SERVER] Incoming transfer: {header.name or 'payload'} ({header.size} bytes)")
+        # Compressed payloads are decompressed on the way in: the receive engine sees original bytes
+        source = compress.Decompressing(client_sock, header.codec) if header.codec else client_sock
+        t_first = time.time()
+        # recv_into preallocated blocks (or the mmap'd output), CRC folded in per block
+        with sampler or contextlib.nullcontext():
+            if stripe:
+                part.receive(source, stripe.offset, header.size, stats, True, block_size)
+            elif ranged:
+                try:
+                    receiver.receive_chunks(source, index, ranged.offset, header.size, stats)
+                finally:
+                    # Verified chunks are on disk whatever happens to the connection now
+                    complete = index.complete
+                    if complete:
+                        index.finish(output)
+                    else:
+                        index.close()
+            else:
+                receiver.receive_file(source, output, size=header.size, block_size=block_size,
+                                      depth=depth, checksum=True, stats=stats)
+            if header.codec and stats.bytes == header.size:
+                source.finish()
+        t_last = time.time()
+        if header.codec:
+            share = source.wire / stats.bytes if stats.bytes else 1.0
+            print(f"[SERVER] {header.codec}: {source.wire} bytes on the wire ({share:.0%}), "
+                  f"decompression {source.cpu_time:.2f}s")
+        client_crc = framing.read_trailer(client_sock) if stats.bytes == header.size else None
+        ack = framing.send_ack(client_sock, header, stats.bytes, stats.crc, client_crc, t_first, t_last)
+        print(f"[SERVER] {'Stripe' if stripe else 'Transfer'} {framing.STATUS_TEXT[ack.status]} "
+              f"(CRC-32 {stats.crc:08x})")
+        if ranged:
+            if stats.rejected:
+                print(f"[SERVER] {stats.rejected} chunk(s) failed their CRC and stay missing")
+            if complete:
+                print(f"[SERVER] Resumable transfer complete: {ranged.total} bytes in {output}")
+        if stripe and part.finish_stripe(stats.bytes):
+            receiver.release(stripe.transfer_id)
+            duration = part.end - part.start
+            throughput = part.bytes / duration / 1024 if duration > 0 else 0.0
+            print(f"[SERVER] Striped transfer complete: {part.bytes}/{part.size} bytes over {part.stripes} "
+                  f"stripes in {duration:.2f}s ({throughput:.2f} KB/s)")
+    total_bytes, duration = stats.bytes, stats.duration
+
+    throughput = total_bytes / duration / 1024 if duration > 0 else 0.0  # KB/s
+    print(f"[SERVER] Received {total_bytes} bytes in {duration:.2f}s ({throughput:.2f} KB/s)")
+    print(f"[SERVER] {stats.summary()}")
+    if sampler:
+        print(f"[SERVER] Rate: {sampler.summary()}")
+    return stats
+
+
+def _next_request(client_sock, output, resume_dir):
+    """read_header() after answering any resume queries; also returns whether there were queries."""
+    queried = False
     while True:
-        data = client_sock.recv(1024)
-        if not data:
+        header, prefix = framing.read_header(client_sock)
+        if prefix != framing.MAGIC_QUERY:
+            return header, prefix, queried
+        answer_query(client_sock, output, resume_dir)
+        queried = True
+
+
+def receive_session(client_sock, output=OUTPUT_FILE, block_size=BLOCK_SIZE, depth=QUEUE_DEPTH, rate=None,
+                    resume_dir=RESUME_DIR):
+    """Receive every trial sent over one connection; returns the number of transfers."""
+    header, prefix, queried = _next_request(client_sock, output, resume_dir)
+    if header is None and queried:
+        return 0    # a resuming client found nothing left to send
+    receive_one(client_sock, output, block_size, depth, (header, prefix), rate, resume_dir)
+    trials = 1
+    # Trials bounded by header/ACK follow until BYE (or the connection closes)
+    while header is not None and header.flags & framing.FLAG_SESSION:
+        header, prefix, _ = _next_request(client_sock, output, resume_dir)
+        if header is None:
+            if prefix not in (b"", framing.MAGIC_BYE):
+                raise framing.ProtocolError(f"expected a header or BYE, got {prefix!r}")
             break
-        f.write(data)
-        total_bytes += len(data)
-    end = time.time()
+        receive_one(client_sock, output, block_size, depth, (header, b""), rate, resume_dir)
+        trials += 1
+    if trials > 1:
+        print(f"[SERVER] Session closed after {trials} transfers")
+    return trials
+
+
+def serve(transport_spec=transport.DEFAULT_TRANSPORT, channel=CHANNEL, output=OUTPUT_FILE,
+          block_size=BLOCK_SIZE, depth=QUEUE_DEPTH, sessions=1, rate=None, stripes=1, resume_dir=RESUME_DIR):
+    """Serve `sessions` connections one after the other (0 = forever), each carrying one or more transfers.
+
+    With stripes > 1 the server also listens on the next stripes - 1 channels
+    (each served the same way from its own thread) for striped transfers.
+    """
+    listeners = [transport.listen(transport_spec, transport.stripe_channel(transport_spec, channel, k),
+                                  advertise=framing.stripe_service(k)) for k in range(stripes)]
+    options = (transport_spec, output, block_size, depth, sessions, rate, resume_dir)
+    threads = [threading.Thread(target=_serve_listener, args=(server_sock,) + options, daemon=True)
+               for server_sock in listeners[1:]]
+    for thread in threads:
+        thread.start()
+    _serve_listener(listeners[0], *options)
+    for thread in threads:
+        thread.join()
+
+
+def _serve_listener(server_sock, transport_spec, output, block_size, depth, sessions, rate, resume_dir):
+    port = transport.channel_of(server_sock)
+    served = 0
+    try:
+        while not sessions or served < sessions:
+            print(f"[SERVER] Waiting for connection on {transport_spec} channel {port}...")
+            try:
+                client_sock, client_info = transport.accept(server_sock)
+            except transport.ListenerClosed:
+                break
+            print(f"[SERVER] Accepted connection from {client_info}")
+
+            try:
+                receive_session(client_sock, output, block_size, depth, rate, resume_dir)
+            except (OSError, framing.ProtocolError) as e:
+                print("[SERVER] Error:", e)
+
+            client_sock.close()
+            served += 1
+    except KeyboardInterrupt:
+        print("\n[SERVER] Stopped by user.")
+    finally:
+        server_sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RFCOMM file receiver (S1/S2)")
+    transport.add_arguments(parser, CHANNEL)
+    parser.add_argument("--output", default=OUTPUT_FILE, help="where to store the received bytes")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE, help="bytes per disk write")
+    parser.add_argument("--queue-depth", type=int, default=QUEUE_DEPTH, help="blocks buffered before disk")
+    parser.add_argument("--sessions", type=int, default=1,
+                        help="connections to serve before exiting (0 = run forever, e.g. for --reconnect)")
+    parser.add_argument("--stripes", type=int, default=1,
+                        help="channels to listen on for striped transfers (bluetooth_client_file.py --stripes)")
+    parser.add_argument("--resume-dir", default=RESUME_DIR,
+                        help="where chunk indexes of unfinished resumable transfers are kept")
+    monitor.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+    rate = (lambda source: monitor.from_args(args, source, "[SERVER]")) if args.rate_interval > 0 else None
+    with profiling.from_args(args, "[SERVER]"):
+        serve(args.transport, args.channel, args.output, args.block_size, args.queue_depth, args.sessions, rate,
+              args.stripes, args.resume_dir)
 
-duration = end - start
-throughput = total_bytes / duration / 1024  # KB/s
-print(f"[SERVER] Received {total_bytes} bytes in {duration:.2f}s ({throughput:.2f} KB/s)")
 
-client_sock.close()
-server_sock.close()
+if __name__ == "__main__":
+    main()
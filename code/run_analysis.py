@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""Rebuild the summary workbooks and every figure from raw runs and/or data/*.xlsx."""
+import argparse
+import os
+import sys
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(CODE_DIR)
+sys.path.insert(0, CODE_DIR)
+from analysis import aggregate, figures, ingest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate benchmark runs and regenerate the figures")
+    parser.add_argument("results", nargs="*", help="orchestrator results directories (runs.jsonl)")
+    parser.add_argument("--data", default=os.path.join(ROOT_DIR, "data"),
+                        help="directory of the legacy spreadsheets ('' to skip them)")
+    parser.add_argument("--figures", default=os.path.join(ROOT_DIR, "figures"), help="figure output directory")
+    parser.add_argument("--tables", default=os.path.join(ROOT_DIR, "data", "summary"),
+                        help="summary workbook output directory")
+    parser.add_argument("--cache", default=os.path.join(ROOT_DIR, "data", ingest.CACHE_FILE),
+                        help="parse cache file ('' to disable)")
+    args = parser.parse_args(argv)
+
+    df = ingest.load(args.results, args.data or None, args.cache or None)
+    if df.empty:
+        print("[ANALYSIS] Nothing to analyse.")
+        sys.exit(1)
+    for path in aggregate.write_tables(df, args.tables):
+        print(f"[ANALYSIS] Wrote {path}")
+    written, skipped = figures.render_all(df, args.figures)
+    print(f"[ANALYSIS] {len(written)} figures written to {args.figures}"
+          + (f", {len(skipped)} without data: {', '.join(skipped)}" if skipped else ""))
+
+
+if __name__ == "__main__":
+    main()
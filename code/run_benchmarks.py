@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""Harness benchmarks: every client/server pair over loopback stand-ins, profiled per phase.
+
+pytest-benchmark style without pytest: each case runs --warmup discarded
+rounds, then --rounds measured ones, each in a fresh interpreter with
+--profile-json (btperf.profiling); wall time and the prep/encode/syscall/
+wait/log/other phases are summarised as min, mean and stdev. --save keeps
+the results as JSON and --compare checks them against a saved run: a phase
+whose mean grew by more than --threshold (and MIN_DELTA_S) is a regression,
+reported with exit status 1.
+
+Stand-ins for the radio: sim (in-process peer thread), unix (the server
+script in a subprocess, profiled too) and mock (btperf.gatt.MockPeripheral
+in place of ble_server.py, which needs BlueZ).
+
+--startup measures process startup instead: every client/server command
+with --help (imports and argument parsing, nothing sent) run as its script,
+through `python3 -m btperf` and in a warm daemon (btperf.daemon), which is
+what a repetition pays before its first byte in each mode.
+"""
+import argparse
+import json
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, CODE_DIR)
+from btperf import cli, daemon, experiment, profiling, transport
+
+TEST_FILE = os.path.join(CODE_DIR, "..", "ressources", "text.txt")
+THRESHOLD = 0.10        # relative growth of a mean flagged as a regression
+MIN_DELTA_S = 0.001     # ... when it is also at least this many seconds
+SERVER_TIMEOUT = 30     # seconds given to a stand-in server to appear / to exit
+STARTUP_COMMANDS = ("s1", "echo", "echo-server", "file", "file-server", "ble", "ble-server")
+STARTUP_MODES = ("script", "cli", "daemon")
+
+# name -> client script and options, optional stand-in server (same layout as a scenarios.json entry)
+CASES = {
+    "s1_sim": {"script": "classic/bluetooth_classic_client.py",
+               "args": {"transport": "sim", "total-bytes": 1_000_000}},
+    "s1_unix": {"script": "classic/bluetooth_classic_client.py",
+                "args": {"transport": "unix", "channel": 41, "total-bytes": 1_000_000},
+                "server": {"script": "classic/bluetooth_server_file.py",
+                           "args": {"transport": "unix", "channel": 41, "output": os.devnull}}},
+    "echo_sim": {"script": "classic/bluetooth_client.py",
+                 "args": {"transport": "sim", "duration": 1, "pings": 200}},
+    "echo_window_unix": {"script": "classic/bluetooth_client.py",
+                         "args": {"transport": "unix", "channel": 43, "duration": 1, "window": 16, "pings": 200},
+                         "server": {"script": "classic/bluetooth_server.py",
+                                    "args": {"transport": "unix", "channel": 43, "sessions": 1}}},
+    "s2_sim": {"script": "classic/bluetooth_client_file.py",
+               "args": {"transport": "sim", "file": TEST_FILE, "repeat": 5}},
+    "s2_striped_sim": {"script": "classic/bluetooth_client_file.py",
+                       "args": {"transport": "sim", "file": TEST_FILE, "repeat": 5, "stripes": 4}},
+    "s2_zlib_sim": {"script": "classic/bluetooth_client_file.py",
+                    "args": {"transport": "sim", "file": TEST_FILE, "repeat": 5, "compress": "zlib"}},
+    "s2_resume_sim": {"script": "classic/bluetooth_client_file.py",
+                      "args": {"transport": "sim", "file": TEST_FILE, "repeat": 5, "resume": True}},
+    "ble_mock": {"script": "ble/ble_client_latency_throughput.py",
+                 "args": {"backend": "mock", "size-mb": 0.05, "count": 50, "pipeline": 4,
+                          "file": "test_data.bin"}},
+}
+
+
+def _command(entry, profile_json):
+    return ([sys.executable, os.path.join(CODE_DIR, entry["script"])] + experiment.to_argv(entry.get("args", {}))
+            + ["--profile-json", profile_json])
+
+
+def _start_server(entry, run_dir):
+    """Start the stand-in server and wait for its socket to appear."""
+    path = transport.unix_path(entry["args"]["channel"])
+    if os.path.exists(path):
+        os.remove(path)     # left over by a killed server
+    log = open(os.path.join(run_dir, "server.log"), "w")
+    server = subprocess.Popen(_command(entry, os.path.join(run_dir, "server.json")), stdout=log,
+                              stderr=subprocess.STDOUT, cwd=run_dir)
+    log.close()
+    deadline = time.time() + SERVER_TIMEOUT
+    while not os.path.exists(path):
+        if server.poll() is not None or time.time() > deadline:
+            server.kill()
+            raise RuntimeError(f"server {entry['script']} did not start (see {run_dir}/server.log)")
+        time.sleep(0.01)
+    return server
+
+
+def run_round(case, run_dir, verbose=False):
+    """One round of a case; returns {"client": summary, "server": summary (cases with a server only)}."""
+    os.makedirs(run_dir, exist_ok=True)
+    server = _start_server(case["server"], run_dir) if case.get("server") else None
+    command = _command(case, os.path.join(run_dir, "client.json")) + ["--log-dir", run_dir]
+    if verbose:
+        print(f"[BENCH] {shlex.join(command)}")
+    try:
+        with open(os.path.join(run_dir, "client.log"), "w") as out:
+            subprocess.run(command, stdout=out, stderr=subprocess.STDOUT, cwd=run_dir, check=True)
+        if server:
+            server.wait(SERVER_TIMEOUT)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        raise RuntimeError(f"{e} (logs in {run_dir})")
+    finally:
+        if server and server.poll() is None:
+            server.kill()
+    result = {}
+    for role in ("client", "server"):
+        path = os.path.join(run_dir, f"{role}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                result[role] = json.load(f)
+    return result
+
+
+def _stats(values):
+    return {"min": min(values), "mean": statistics.mean(values),
+            "stdev": statistics.stdev(values) if len(values) > 1 else 0.0}
+
+
+def summarize(rounds):
+    """{role: {metric: {"min", "mean", "stdev"}}} over rounds; metric is "wall" or a phase name."""
+    summary = {}
+    for role in ("client", "server"):
+        samples = {}
+        for r in rounds:
+            if role not in r:
+                continue
+            samples.setdefault("wall", []).append(r[role]["wall_s"])
+            for name, p in r[role]["phases"].items():
+                samples.setdefault(name, []).append(p["s"])
+        if samples:
+            summary[role] = {metric: _stats(values) for metric, values in samples.items()}
+    return summary
+
+
+def print_table(results):
+    metrics = ("wall",) + profiling.PHASES + ("other",)
+    print(f"\n{'case':<28}" + "".join(f"{m:>10}" for m in metrics) + f"{'stdev':>10}   (ms, mean)")
+    for name, summary in results.items():
+        for role, stats in summary.items():
+            cells = "".join(f"{stats[m]['mean'] * 1e3:>10.1f}" if m in stats else f"{'-':>10}" for m in metrics)
+            print(f"{name + ' [' + role + ']':<28}{cells}{stats['wall']['stdev'] * 1e3:>10.1f}")
+
+
+def _start_daemon(path):
+    daemon_process = subprocess.Popen([sys.executable, "-m", "btperf", "daemon", "--socket", path],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT, cwd=CODE_DIR)
+    deadline = time.time() + SERVER_TIMEOUT
+    while not daemon.listening(path):
+        if daemon_process.poll() is not None or time.time() > deadline:
+            daemon_process.kill()
+            raise RuntimeError("the btperf daemon did not start")
+        time.sleep(0.01)
+    return daemon_process
+
+
+def startup_round(command, mode, socket_path):
+    """Seconds until `command --help` has exited, started in `mode` (script, cli or daemon)."""
+    start = time.perf_counter()
+    if mode == "daemon":
+        with open(os.devnull, "w") as devnull:
+            status = daemon.submit([command, "--help"], socket_path, CODE_DIR, devnull, devnull)
+    else:
+        entry = [os.path.join(CODE_DIR, cli.COMMANDS[command][0])] if mode == "script" else ["-m", "btperf", command]
+        status = subprocess.run([sys.executable] + entry + ["--help"], stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, cwd=CODE_DIR).returncode
+    elapsed = time.perf_counter() - start
+    if status != 0:
+        raise RuntimeError(f"{command} --help exited with {status} ({mode})")
+    return elapsed
+
+
+def run_startup(commands, rounds, warmup):
+    """{"startup_<command>": {"startup": {mode: {"min", "mean", "stdev"}}}}, the layout compare() reads."""
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="btperf-bench-") as scratch:
+        socket_path = os.path.join(scratch, "daemon.sock")
+        daemon_process = _start_daemon(socket_path)
+        try:
+            for command in commands:
+                samples = {mode: [startup_round(command, mode, socket_path) for _ in range(warmup + rounds)][warmup:]
+                           for mode in STARTUP_MODES}
+                results[f"startup_{command}"] = {"startup": {mode: _stats(v) for mode, v in samples.items()}}
+                means = {mode: statistics.mean(v) * 1e3 for mode, v in samples.items()}
+                print(f"[BENCH] {command}: " + ", ".join(f"{mode} {ms:.1f} ms" for mode, ms in means.items()))
+        finally:
+            daemon.stop(socket_path)
+            daemon_process.wait(SERVER_TIMEOUT)
+    return results
+
+
+def print_startup(results):
+    print(f"\n{'command':<16}" + "".join(f"{m:>10}" for m in STARTUP_MODES) + f"{'speedup':>10}   (ms, mean)")
+    for name, summary in results.items():
+        stats = summary["startup"]
+        speedup = stats["script"]["mean"] / stats["daemon"]["mean"] if stats["daemon"]["mean"] > 0 else 0.0
+        print(f"{name[len('startup_'):]:<16}" + "".join(f"{stats[m]['mean'] * 1e3:>10.1f}" for m in STARTUP_MODES)
+              + f"{speedup:>9.0f}x")
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Lines describing every metric that regressed against `baseline`."""
+    regressions = []
+    for name, summary in results.items():
+        for role, stats in summary.items():
+            for metric, s in stats.items():
+                base = baseline.get(name, {}).get(role, {}).get(metric)
+                if not base or base["mean"] <= 0:
+                    continue
+                delta = s["mean"] - base["mean"]
+                if delta > MIN_DELTA_S and delta / base["mean"] > threshold:
+                    regressions.append(f"{name} [{role}] {metric}: {base['mean'] * 1e3:.1f} -> "
+                                       f"{s['mean'] * 1e3:.1f} ms (+{delta / base['mean']:.0%})")
+    return regressions
+
+
+def run_cases(args):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="btperf-bench-") as scratch:
+        root = args.keep or scratch
+        for name in args.only or CASES:
+            rounds = []
+            for n in range(args.warmup + args.rounds):
+                result = run_round(CASES[name], os.path.join(root, name, f"round{n}"), args.verbose)
+                if n >= args.warmup:
+                    rounds.append(result)
+            results[name] = summarize(rounds)
+            wall = results[name]["client"]["wall"]
+            print(f"[BENCH] {name}: {wall['mean']:.3f}s +- {wall['stdev']:.3f}s over {args.rounds} round(s)")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-phase benchmarks of the harness over loopback stand-ins")
+    parser.add_argument("--only", nargs="+", default=None,
+                        help=f"cases to run (default: all of {', '.join(CASES)}), or commands with --startup")
+    parser.add_argument("--startup", action="store_true",
+                        help="measure process startup instead: script vs python3 -m btperf vs the warm daemon")
+    parser.add_argument("--rounds", type=int, default=5, help="measured rounds per case")
+    parser.add_argument("--warmup", type=int, default=1, help="discarded rounds per case")
+    parser.add_argument("--save", metavar="PATH", default=None, help="write the results as JSON to PATH")
+    parser.add_argument("--compare", metavar="PATH", default=None, help="flag regressions against a saved run")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="relative growth of a mean counted as a regression (default: %(default)s)")
+    parser.add_argument("--keep", metavar="DIR", default=None, help="keep every round's logs under DIR")
+    parser.add_argument("--verbose", action="store_true", help="print every command")
+    args = parser.parse_args(argv)
+    unknown = set(args.only or ()) - set(STARTUP_COMMANDS if args.startup else CASES)
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(sorted(unknown))}")
+
+    if args.startup:
+        results = run_startup(args.only or STARTUP_COMMANDS, args.rounds, args.warmup)
+        print_startup(results)
+    else:
+        results = run_cases(args)
+        print_table(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+        print(f"[BENCH] Results written: {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"[BENCH] REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"[BENCH] No regression against {args.compare} (threshold {args.threshold:.0%})")
+
+
+if __name__ == "__main__":
+    main()
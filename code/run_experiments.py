@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Run the S1-S4 scenario matrices described by a JSON spec (see btperf/experiment.py)."""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from btperf import daemon, experiment
+
+DEFAULT_SPEC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios.json")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scenario orchestrator for the Classic/BLE benchmarks")
+    parser.add_argument("spec", nargs="?", default=DEFAULT_SPEC, help="scenario spec (JSON)")
+    parser.add_argument("--only", nargs="+", default=None, help="scenario names to run (default: all)")
+    parser.add_argument("--output", default=None, help="results directory (overrides the spec)")
+    parser.add_argument("--parallel", type=int, default=None, help="cells run at the same time")
+    parser.add_argument("--dry-run", action="store_true", help="print the commands without running them")
+    parser.add_argument("--yes", action="store_true", help="do not pause for manual conditions")
+    parser.add_argument("--daemon", nargs="?", const=daemon.SOCKET_PATH, default=None, metavar="SOCKET",
+                        help="send client runs to a warm `python3 -m btperf daemon` (default socket: %(const)s); "
+                             "the daemon runs them one at a time")
+    args = parser.parse_args(argv)
+
+    spec = experiment.load_spec(args.spec)
+    if args.output:
+        spec["output"] = args.output
+    try:
+        runner = experiment.Runner(spec, args.only, args.dry_run, args.yes, args.parallel, args.daemon)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        runner.run()
+    except RuntimeError as e:
+        print(f"[ORCH] {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n[ORCH] Interrupted; completed repetitions are checkpointed, rerun to resume.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
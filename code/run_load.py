@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Load test: N client processes against one echo server or BLE write handler, stepped into a scaling curve.
+
+Profiles, targets and how latency is measured are described in btperf/load.py.
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, CODE_DIR)
+from btperf import gatt, load, payload, recorder, transport
+
+CHANNEL = 3                 # bluetooth_server.py's channel
+WORKERS = "1,2,4,8"
+SIZES = "64,1024"
+DURATION = 10.0             # seconds per level
+PAUSE = 1.0                 # seconds between levels
+ECHO_SERVER = "classic/bluetooth_server.py"
+
+
+def start_server(spec, channel):
+    """bluetooth_server.py as a stand-in echo server on a tcp/unix transport, ready to accept."""
+    kind, _ = transport.parse_spec(spec)
+    if kind not in ("tcp", "unix"):
+        raise ValueError(f"--server starts a local stand-in: use --transport tcp or unix, not {kind}")
+    command = [sys.executable, os.path.join(CODE_DIR, ECHO_SERVER), "--transport", spec, "--channel", str(channel)]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    deadline = time.time() + 10
+    while True:
+        try:
+            transport.connect(spec, None, channel, timeout=1).close()
+            break
+        except OSError:
+            if server.poll() is not None or time.time() > deadline:
+                server.kill()
+                raise RuntimeError("the stand-in echo server did not start")
+            time.sleep(0.05)
+    print(f"[LOAD] Stand-in server: {ECHO_SERVER} on {spec} channel {channel}")
+    return server
+
+
+def print_curve(levels):
+    print("\n[LOAD] Scaling curve")
+    print(f"  {'size':>6}{'workers':>9}{'msg/s':>11}{'KB/s':>11}{'mean ms':>10}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'p99.9 ms':>10}{'lost':>7}{'errors':>8}")
+    for level in levels:
+        d = level.latency.to_dict()
+        print(f"  {level.size:>6}{level.workers:>9}{level.rate:>11.1f}{level.throughput:>11.2f}"
+              f"{d['mean_ms']:>10.2f}{d['p50_ms']:>9.2f}{d['p99_ms']:>9.2f}{d['p99.9_ms']:>10.2f}"
+              f"{d['lost']:>7}{len(level.errors):>8}")
+    # Where adding peers stops adding throughput
+    for size in sorted({level.size for level in levels}):
+        curve = [level for level in levels if level.size == size]
+        best = max(curve, key=lambda level: level.rate)
+        print(f"[LOAD] {size}-byte messages: peak {best.rate:.1f} msg/s with {best.workers} worker(s)"
+              + (f", {best.rate / curve[0].rate / best.workers * curve[0].workers:.0%} scaling efficiency"
+                 if curve[0].rate > 0 and best is not curve[0] else ""))
+
+
+def _ns(value):
+    return -1 if math.isnan(value) else int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-process load generator (echo server or BLE write handler)")
+    parser.add_argument("--target", choices=load.TARGETS, default="echo",
+                        help="echo: bluetooth_server.py over --transport; ble: the write characteristic via --backend")
+    transport.add_arguments(parser, CHANNEL)
+    parser.add_argument("--backend", choices=gatt.BACKENDS, default="mock", help="GATT backend for --target ble")
+    parser.add_argument("--workers", default=WORKERS,
+                        help=f"comma-separated worker counts, one level each (default: {WORKERS})")
+    parser.add_argument("--sizes", default=SIZES, help=f"comma-separated message sizes in bytes (default: {SIZES})")
+    parser.add_argument("--load", default="closed",
+                        help="closed, open:RATE or ramp:START:END (messages/s per worker, default: closed)")
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds per level")
+    parser.add_argument("--pause", type=float, default=PAUSE, help="seconds between levels")
+    parser.add_argument("--server", action="store_true",
+                        help="start bluetooth_server.py as a local stand-in (tcp/unix transports)")
+    parser.add_argument("--json", metavar="PATH", default=None, help="also write every level as JSON to PATH")
+    parser.add_argument("--seed", type=int, default=payload.DEFAULT_SEED, help="payload RNG seed")
+    recorder.add_arguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        profile = load.parse_profile(args.load)
+        worker_counts = [int(n) for n in args.workers.split(",")]
+        sizes = [int(n) for n in args.sizes.split(",")]
+        if args.target == "echo" and transport.in_process(args.transport):
+            raise ValueError("the sim transport lives in one process: use tcp or unix for a load test")
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = start_server(args.transport, args.channel) if args.server and args.target == "echo" else None
+    timestamp = datetime.datetime.now().strftime("%d%m_%H%M")
+    levels = []
+    try:
+        with recorder.from_args(args, f"load_{timestamp}", load.LOAD_COLUMNS) as log:
+            for size in sizes:
+                for workers in worker_counts:
+                    if levels:
+                        time.sleep(args.pause)
+                    print(f"[LOAD] {workers} worker(s), {size}-byte messages, {profile}, {args.duration:g}s...")
+                    level = load.run_level(args.target, workers, size, profile, args.duration, args.transport,
+                                           args.address, args.channel, args.backend, args.seed)
+                    for error in level.errors:
+                        print(f"[LOAD] {error}")
+                    if level.late > 0.1:
+                        print(f"[LOAD] Warning: a worker started {level.late:.2f}s late, the level ramped up")
+                    d = level.latency.to_dict()
+                    print(f"[LOAD] {level.rate:.1f} msg/s, {level.throughput:.2f} KB/s, "
+                          f"latency {level.latency.summary()}")
+                    log.record(size, workers, level.messages, level.bytes, int(level.duration * 1e9),
+                               _ns(level.latency.moments.mean if level.latency.count else math.nan),
+                               _ns(level.latency.percentile(50)), _ns(level.latency.percentile(99)), d["lost"],
+                               len(level.errors))
+                    levels.append(level)
+    except KeyboardInterrupt:
+        print("\n[LOAD] Interrupted; levels completed so far:")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    print_curve(levels)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"target": args.target, "transport": args.transport, "load": str(profile),
+                       "duration_s": args.duration, "levels": [level.to_dict() for level in levels]}, f, indent=1)
+    print(f"[LOAD] Logs written: {log.path}" + (f", {args.json}" if args.json else ""))
+
+
+if __name__ == "__main__":
+    main()